@@ -0,0 +1,86 @@
+import os
+
+from flask import redirect, request, session, url_for
+from flask_admin import Admin, BaseView, expose
+from flask_admin.contrib.sqla import ModelView
+from flask_admin.form import ImageUploadField
+
+from product_attributes import split_description
+from sales_analytics import ANALYTICS_DAYS
+
+# Product image uploads land next to the bundled images; Flask-Admin creates the directory on first save
+UPLOAD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images')
+
+
+class AdminOnlyMixin:
+    """Restrict a view to admins, sending anyone else to the login page."""
+    def is_accessible(self):
+        return session.get('is_admin') is True
+
+    def inaccessible_callback(self, name, **kwargs):
+        # Redirect non-admin users to the login page
+        return redirect(url_for('login', next=request.url))
+
+
+class SecureModelView(AdminOnlyMixin, ModelView):
+    """Create a secure model view that requires admin privileges."""
+
+
+class AnalyticsView(AdminOnlyMixin, BaseView):
+    """Sales dashboard read from the rollup tables, so it loads as fast with a million orders as with ten."""
+
+    def __init__(self, sales_rollup, **kwargs):
+        self.sales_rollup = sales_rollup
+        super().__init__(**kwargs)
+
+    @expose('/')
+    def index(self):
+        days = min(max(request.args.get('days', ANALYTICS_DAYS, type=int), 1), 366)
+        return self.render('admin/analytics.html', dashboard=self.sales_rollup.dashboard(days),
+                           last_run=self.sales_rollup.last_run)
+
+
+class ProductAdminView(SecureModelView):
+    # Use form_overrides for the class and form_args for constructor arguments
+    # This is the standard and most stable way to configure custom fields.
+    form_overrides = {
+        'image': ImageUploadField
+    }
+    form_args = {
+        'image': {
+            'label': 'Image',
+            'base_path': UPLOAD_PATH,
+            'url_relative_path': 'images/', # Ensures correct URL generation
+            # Replacing an image in place would leave pages on the manifest's hash of the old one until the
+            # next build-assets; a new name gets a plain /static URL at once
+            'allow_overwrite': False
+        }
+    }
+    # Specs are edited as the comma-separated description; on_model_change rebuilds the attribute rows
+    form_excluded_columns = ['attributes']
+
+    def __init__(self, model, session, image_derivatives, **kwargs):
+        self.image_derivatives = image_derivatives
+        super().__init__(model, session, **kwargs)
+
+    def on_model_change(self, form, model, is_created):
+        model.description_list = split_description(model.description)
+
+    def after_model_change(self, form, model, is_created):
+        # Resize the uploaded image right away so the storefront never serves the full-size original
+        if model.image and not model.image.startswith('http'):
+            try:
+                self.image_derivatives.build(model.image)
+            except Exception as e:
+                print(f"Could not build image derivatives for {model.image}: {e}")
+
+
+def init_admin(app, db, user_model, product_model, image_derivatives, sales_rollup):
+    """Mount the Flask-Admin views at /admin. Returns the Admin instance."""
+    # Note: Removed 'template_mode' to maintain compatibility with older Flask-Admin versions
+    admin = Admin(app, name='Tech Kenya Admin')
+    admin.add_view(SecureModelView(user_model, db.session))
+    # Replace the default Product view with our new custom one
+    admin.add_view(ProductAdminView(product_model, db.session, image_derivatives))
+    admin.add_view(AnalyticsView(sales_rollup, name='Analytics', endpoint='analytics'))
+    return admin
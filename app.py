@@ -1,23 +1,50 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, jsonify, abort
 from flask_session import Session
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
-from flask_admin import Admin
-from flask_admin.form import ImageUploadField
-from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import insert, select, union_all
+from sqlalchemy.orm import lazyload
 from sqlalchemy.exc import OperationalError
 from dotenv import load_dotenv
 from flask_mail import Mail, Message
-import webbrowser
-from threading import Timer
-from paystack_handler import initiate_mpesa_charge # Import the Paystack M-PESA function
+from search_index import get_search_backend
+from suggest_index import SuggestIndex, SUGGEST_VERSION_MAX_AGE
+from catalog_cache import create_catalog_cache, SQLCatalogVersion
+from fragment_cache import FragmentCache, FragmentCacheExtension
+from conditional_get import ConditionalGet, release_fingerprint
+from mail_queue import MailDispatcher
+from instrumentation import Instrumentation
+from cart_store import create_cart_store, CartSweeper
+from payment_events import PaymentEventProcessor, record_event
+from payment_reconciliation import PaymentReconciler
+from pagination import keyset_page, encode_cursor, InvalidCursor
+from image_derivatives import ImageDerivatives
+from static_assets import StaticAssets
+from product_attributes import (FACET_PARAM, attribute_rows, parse_facets, facet_params, filter_by_facets,
+                                facet_counts)
+from recommendations import RecommendationBuilder, decode_ids
+from inventory import reserve_stock, restock, short_lines
+from sales_analytics import SalesRollup
+from catalog_io import (CATALOG_BATCH_SIZE, CatalogFormatError, detect_format, open_catalog, read_catalog,
+                        import_catalog, export_catalog)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import functools
 import os
+import threading
+import time
+import uuid
+import click
+from flask.cli import AppGroup
 
 load_dotenv() # Load environment variables from .env file
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'a-default-fallback-secret-key-for-dev')
-app.config['SESSION_TYPE'] = 'filesystem'
+# Server-side sessions: 'sqlalchemy' (app database, default) or 'redis' (SESSION_REDIS_URL)
+app.config['SESSION_TYPE'] = os.environ.get('SESSION_TYPE', 'sqlalchemy')
+# Only write the session back when it changes, not on every request
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
 
 # --- Database Configuration ---
 # Use PostgreSQL in production (on Render) and SQLite for local development
@@ -30,8 +57,22 @@ app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL or \
     'sqlite:///' + os.path.join(basedir, 'database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-Session(app)
 db = SQLAlchemy(app)
+# Latency, SQL and template timings per endpoint: Server-Timing headers and /metrics
+instrumentation = Instrumentation(app, db)
+# Schema changes go through Alembic migrations (flask db upgrade) instead of init-db.
+# Only the flask CLI needs Alembic, so serving processes never import it
+if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+    from flask_migrate import Migrate
+    migrate = Migrate(app, db)
+
+if app.config['SESSION_TYPE'] == 'sqlalchemy':
+    app.config['SESSION_SQLALCHEMY'] = db
+    app.config['SESSION_CLEANUP_N_REQUESTS'] = 1000  # Expired sessions are purged every ~1000 requests
+elif app.config['SESSION_TYPE'] == 'redis':
+    import redis  # Optional dependency, only needed for Redis sessions
+    app.config['SESSION_REDIS'] = redis.Redis.from_url(os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0'))
+# Session(app) runs in create_app(): Flask-Session checks for its table when set up, which must not happen on import
 
 # --- Mail Configuration ---
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER')
@@ -42,12 +83,18 @@ app.config['MAIL_USE_TLS'] = os.environ.get('MAIL_USE_TLS', 'True').lower() == '
 app.config['MAIL_USE_SSL'] = os.environ.get('MAIL_USE_SSL', 'False').lower() == 'true'
 
 mail = Mail(app)
+# Emails are sent from background workers so SMTP latency never blocks a request
+mail_dispatcher = MailDispatcher(app, mail)
 
-# Initialize the database if tables don't exist
-def init_database():
+# Create missing tables and seed an empty database (flask setup-db; never run on import)
+def setup_database():
     """Initialize the database tables and populate with initial data if they don't exist."""
     with app.app_context():
         db.create_all()  # Always ensure all tables exist
+        with db.engine.begin() as connection:
+            # Index products that predate the search table
+            if search_backend.create(connection):
+                search_backend.rebuild(connection)
 
         # Check if products exist; populate if none
         if Product.query.count() == 0:
@@ -57,34 +104,7 @@ def init_database():
             db.session.add(admin_user)
             db.session.commit()  # Commit to assign ID to admin_user
 
-            # Populate with initial products
-            initial_products = [
-                # Laptops
-                {'name': 'Apple MacBook Air M2', 'price': 1500, 'old_price': 1650, 'rating': 4.9, 'description': ['Apple M2 Chip','8GB RAM','256GB SSD'], 'image': 'images/apple_macbook_air_m2.jpg', 'category': 'Laptops'},
-                {'name': 'Dell XPS 15', 'price': 18000, 'old_price': 20000, 'rating': 4.9, 'description': ['Intel Core i9','32GB RAM','1TB SSD'], 'image': 'images/dell_xps_15.jpg', 'category': 'Laptops'},
-                {'name': 'HP Spectre x360', 'price': 14500, 'old_price': 160000, 'rating': 4.7, 'description': ['Intel Core i7','16GB RAM','512GB SSD'], 'image': 'images/hp_spectre_x360.jpg', 'category': 'Laptops'},
-                {'name': 'Lenovo ThinkPad X1 Carbon', 'price': 16500, 'old_price': 18000, 'rating': 4.7, 'description': ['Intel Core i7','16GB RAM','1TB SSD'], 'image': 'images/lenovo_thinkpad_x1_carbon.jpg', 'category': 'Laptops'},
-                {'name': 'Asus ROG Zephyrus G14', 'price': 19000, 'old_price': 21000, 'rating': 4.8, 'description': ['AMD Ryzen 9','16GB RAM','1TB SSD'], 'image': 'images/asus_rog_zephyrus_g14.jpg', 'category': 'Laptops'},
-
-                # Desktops
-                {'name': 'Apple iMac 24"', 'price': 18000, 'old_price': 19500, 'rating': 4.8, 'description': ['Apple M1 Chip','8GB RAM','256GB SSD'], 'image': 'images/apple_imac_24.jpg', 'category': 'Desktops'},
-                {'name': 'Alienware Aurora R15', 'price': 25000, 'old_price': 28000, 'rating': 4.9, 'description': ['Intel Core i9','32GB RAM','2TB SSD'], 'image': 'images/alienware_aurora_r15.jpg', 'category': 'Desktops'},
-                {'name': 'HP Envy All-in-One 34"', 'price': 22000, 'old_price': 24000, 'rating': 4.8, 'description': ['Intel Core i7','16GB RAM','1TB SSD'], 'image': 'images/hp_envy_all-in-one_34.jpg', 'category': 'Desktops'},
-                {'name': 'Corsair Vengeance i7400', 'price': 28000, 'old_price': 31000, 'rating': 4.9, 'description': ['Intel Core i7','32GB DDR5','2TB NVMe'], 'image': 'images/gaming_pc_pro.jpg', 'category': 'Desktops'},
-                {'name': 'HP Pavilion Gaming Desktop', 'price': 9800, 'old_price': 11000, 'rating': 4.6, 'description': ['Intel Core i5','16GB RAM','512GB SSD'], 'image': 'images/hp_pavilion_gaming_desktop.jpg', 'category': 'Desktops'},
-
-                # Accessories
-                {'name': 'Sony WH-1000XM5 Headphones', 'price': 4500, 'old_price': 5200, 'rating': 4.9, 'description': ['Noise Cancelling','Wireless','30-Hour Battery'], 'image': 'images/sony_wh-1000xm5_headphones.jpg', 'category': 'Accessories'},
-                {'name': 'Logitech MX Master 3S Mouse', 'price': 1200, 'old_price': 1500, 'rating': 4.9, 'description': ['Ergonomic Design','8K DPI Sensor','Quiet Clicks'], 'image': 'images/logitech_mx_master_3s_mouse.jpg', 'category': 'Accessories'},
-                {'name': 'Keychron K2 Mechanical Keyboard', 'price': 950, 'old_price': 1100, 'rating': 4.8, 'description': ['Wireless/Wired','Gateron Switches','Mac & Windows'], 'image': 'images/keychron_k2_mechanical_keyboard.jpg', 'category': 'Accessories'},
-                {'name': 'Anker 737 Power Bank', 'price': 1500, 'old_price': 1800, 'rating': 4.9, 'description': ['24,000mAh','140W Output','Smart Display'], 'image': 'images/anker_737_power_bank.jpg', 'category': 'Accessories'},
-                {'name': 'Logitech C920 HD Pro Webcam', 'price': 800, 'old_price': 950, 'rating': 4.7, 'description': ['1080p Full HD','Stereo Audio','Light Correction'], 'image': 'images/logitech_c920_hd_pro_webcam.jpg', 'category': 'Accessories'},
-            ]
-
-            for data in initial_products:
-                p = Product(name=data['name'], price=data['price'], old_price=data.get('old_price'), rating=data.get('rating'), image=data['image'], category=data['category'])
-                p.description_list = data.get('description', [])
-                db.session.add(p)
+            import_products_file(SEED_CATALOG)
 
             # Create a test order for the admin user with sample shipping details
             test_order = Order(
@@ -111,30 +131,109 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
 
 class Product(db.Model):
+    __table_args__ = (
+        # Category listing ordered by name (home() category filter, related products)
+        db.Index('ix_product_category_name', 'category', 'name'),
+        # Full catalog ordered by name
+        db.Index('ix_product_name', 'name'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     price = db.Column(db.Float, nullable=False)
     old_price = db.Column(db.Float)
     rating = db.Column(db.Float)
-    description = db.Column(db.String(500)) # Storing as comma-separated string
+    description = db.Column(db.String(500)) # Free-text specs for search; product.attributes holds them structured
     image = db.Column(db.String(500), nullable=False)
     category = db.Column(db.String(80), nullable=False)
+    # Units available to sell; NULL means stock is not tracked and the product never sells out.
+    # Only changed by inventory.reserve_stock/restock, so sales do not bump the catalog version
+    stock = db.Column(db.Integer)
+    # Loaded with one extra IN query per listing rather than one query per product card
+    attributes = db.relationship('ProductAttribute', order_by='ProductAttribute.position', lazy='selectin',
+                                 cascade='all, delete-orphan', passive_deletes=True)
 
     @property
     def web_image_path(self):
-        """Ensures the image path uses forward slashes for web URLs."""
+        """The static path of the image's resized WebP derivative (or the original until one is built), with forward slashes."""
         if self.image:
-            return self.image.replace('\\', '/')
+            return image_derivatives.default_path(self.image)
         return None
 
-    # Helper to convert description from/to list
+    # The spec lines shown on cards and the product page
     @property
     def description_list(self):
-        return self.description.split(',') if self.description else []
+        return [attribute.value for attribute in self.attributes]
 
     @description_list.setter
     def description_list(self, value_list):
-        self.description = ','.join(value_list)
+        rows = attribute_rows(value_list)
+        self.description = ', '.join(row['value'] for row in rows)
+        self.attributes = [ProductAttribute(**row) for row in rows]
+
+class ProductAttribute(db.Model):
+    """
+    One spec line of a product, e.g. name='RAM', value='16GB RAM'. Lines
+    with a name are facets that home() can filter and count on; the rest are
+    plain features (name is NULL).
+    """
+    __table_args__ = (
+        # Facet filters and counts: (name, value) lookups that yield product ids without touching the table
+        db.Index('ix_product_attribute_name_value', 'name', 'value', 'product_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    name = db.Column(db.String(40))
+    value = db.Column(db.String(120), nullable=False)
+
+class ProductRecommendation(db.Model):
+    """
+    Precomputed neighbours of a product, best first, as comma-separated ids:
+    similar products (shared specs, same category) and products bought in the
+    same orders. Written by `flask build-recs`; product pages read one row.
+    """
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    similar = db.Column(db.Text, nullable=False, default='')
+    bought_with = db.Column(db.Text, nullable=False, default='')
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    @property
+    def similar_ids(self):
+        return decode_ids(self.similar)
+
+    @property
+    def bought_with_ids(self):
+        return decode_ids(self.bought_with)
+
+class ProductCopurchase(db.Model):
+    """How many orders contained both products; kept in both directions so each product's pairs are one range."""
+    product_id = db.Column(db.Integer, primary_key=True)
+    other_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False)
+
+class RecommendationRun(db.Model):
+    """One `flask build-recs` run; the latest last_order_id is the co-purchase watermark."""
+    id = db.Column(db.Integer, primary_key=True)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    full = db.Column(db.Boolean, nullable=False, default=False)
+    last_order_id = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    similar_updated = db.Column(db.Integer, nullable=False, default=0)
+    bought_updated = db.Column(db.Integer, nullable=False, default=0)
+    seconds = db.Column(db.Float)
+
+class RecommendationBacklog(db.Model):
+    """Lines of orders paid since the last `flask build-recs` read them, queued by the payment hook; see recommendations."""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False, index=True)
+    product_id = db.Column(db.Integer, nullable=False)
+
+class CatalogVersion(db.Model):
+    """The single row (id=1) holding the catalog cache version, so every worker sees the same one; see catalog_cache."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=1)
 
 class Order(db.Model):
     """
@@ -149,9 +248,18 @@ class Order(db.Model):
         county: County for shipping (e.g., Nairobi, Mombasa).
         city: City/town for shipping (e.g., Nairobi, Kisumu).
         shipping_address: Full shipping address details.
-        status: Order status ('pending', 'success', 'failed').
+        status: Order status ('initiating', 'pending', 'success', 'failed').
+        payment_provider: Who collects the payment: 'paystack' or 'daraja' (direct STK Push).
+        checkout_request_id: Daraja's id for the STK Push, used to match its callback.
         created_at: Timestamp when the order was created.
     """
+    __table_args__ = (
+        # A user's order history, newest first (orders() page)
+        db.Index('ix_order_user_id_created_at', 'user_id', 'created_at'),
+        # Orders in a given state by age (payment reconciliation)
+        db.Index('ix_order_status_created_at', 'status', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     reference = db.Column(db.String(100), unique=True, nullable=False)
@@ -160,8 +268,279 @@ class Order(db.Model):
     county = db.Column(db.String(100), nullable=False)  # Shipping county (e.g., Nairobi)
     city = db.Column(db.String(100), nullable=False)  # Shipping city/town
     shipping_address = db.Column(db.String(500), nullable=False)  # Full shipping address (e.g.,434, 5th avenue, Nairobi)
-    status = db.Column(db.String(50), default='pending')  # Order status: pending, success, failed
-    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    status = db.Column(db.String(50), default='pending')  # Order status: initiating, pending, success, failed
+    # Set in Python so every stored timestamp has the same format, which the
+    # (created_at, id) keyset cursor on the orders page compares against
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payment_provider = db.Column(db.String(20), default='paystack')
+    checkout_request_id = db.Column(db.String(100), index=True)
+
+class OrderItem(db.Model):
+    """
+    A line of an order, snapshotted from the cart at checkout. The product's
+    name and unit price are copied, so the order keeps what was bought after
+    the catalog changes or the product is deleted (product_id becomes NULL).
+    """
+    __table_args__ = (
+        # An order's lines (restock on failure) and order-to-product baskets (recommendations)
+        db.Index('ix_order_item_order_id_product_id', 'order_id', 'product_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id', ondelete='CASCADE'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='SET NULL'), index=True)
+    name = db.Column(db.String(120), nullable=False)
+    price = db.Column(db.Float, nullable=False)  # Unit price in KSh at checkout
+    quantity = db.Column(db.Integer, nullable=False)
+
+class SalesDaily(db.Model):
+    """Orders and their total amount per day (UTC), shipping county/city and status; see sales_analytics."""
+    day = db.Column(db.Date, primary_key=True)
+    county = db.Column(db.String(100), primary_key=True)
+    city = db.Column(db.String(100), primary_key=True)
+    status = db.Column(db.String(50), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+
+class SalesProduct(db.Model):
+    """Units, revenue and orders per product from paid orders; see sales_analytics."""
+    product_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)  # From the latest order line, so deleted products keep a name
+    units = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0, index=True)  # Best sellers first
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+class SalesRollupState(db.Model):
+    """The single row (id=1) holding the sales rollups' watermark; only locked while a refresh moves it."""
+    id = db.Column(db.Integer, primary_key=True)
+    last_order_id = db.Column(db.Integer, nullable=False, default=0)
+    refreshed_at = db.Column(db.DateTime)
+
+class SalesRollupDelta(db.Model):
+    """An order status change not yet applied to the sales rollups, appended by the payment hook; see sales_analytics."""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, nullable=False, index=True)
+    previous = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+
+class CartItem(db.Model):
+    """
+    A line in a server-side shopping cart. Carts are keyed by a random cart id
+    kept in the user's session; lines not updated within CART_TTL expire.
+    """
+    cart_id = db.Column(db.String(32), primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class WebhookEvent(db.Model):
+    """
+    Append-only log of payment provider notifications. The (provider, event_id)
+    key drops duplicate deliveries; PaymentEventProcessor applies unprocessed
+    rows to orders in batches and stamps processed_at.
+    """
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'event_id', name='uq_webhook_event_provider_event_id'),
+        # The processor's queue: unprocessed events in arrival order
+        db.Index('ix_webhook_event_processed_at_id', 'processed_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(20), nullable=False)  # paystack or mpesa
+    event_id = db.Column(db.String(200), nullable=False)
+    event_type = db.Column(db.String(50))
+    reference = db.Column(db.String(100))  # Order reference the event settles, if any
+    status = db.Column(db.String(50))  # Order status the event implies, if any
+    payload = db.Column(db.Text, nullable=False)  # Raw JSON as received
+    received_at = db.Column(db.DateTime, nullable=False)
+    processed_at = db.Column(db.DateTime)
+
+# Full-text product search, kept in sync by Product insert/update/delete hooks
+search_backend = get_search_backend(app.config['SQLALCHEMY_DATABASE_URI'], Product)
+# In-memory prefix index over product names for the typeahead API
+suggest_index = SuggestIndex(Product)
+# Catalog read cache; any committed Product change bumps the catalog version, kept in the
+# database (or Redis) so every worker sees the bump on its next request
+catalog_cache = create_catalog_cache(versions=SQLCatalogVersion(db, CatalogVersion))
+catalog_cache.watch(Product)
+catalog_cache.watch(ProductAttribute)
+
+# Resized WebP/AVIF variants of product images; templates get srcsets via image_sources()
+image_derivatives = ImageDerivatives(app.static_folder)
+app.add_template_global(image_derivatives.sources, 'image_sources')
+# Rendered product cards, sidebar and carousel ({% cache %} blocks), keyed on the catalog and image versions
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.fragment_cache = FragmentCache(
+    lambda: f'{catalog_version()}.{image_derivatives.manifest.version()}')
+# Content-hashed static URLs (flask build-assets) served with immutable caching from /assets
+static_assets = StaticAssets(app)
+
+# Shopping carts live in their own store (SQL table or Redis hash), not in the session blob
+cart_store = create_cart_store(db, CartItem)
+cart_sweeper = CartSweeper(app, cart_store)
+
+# Sales rollups behind the admin analytics view, refreshed in the background (flask refresh-analytics)
+sales_rollup = SalesRollup(app, db, Order, OrderItem, SalesDaily, SalesProduct, SalesRollupState, SalesRollupDelta)
+
+def order_status_changed(previous, status, order_ids):
+    """
+    Keep stock, the sales rollups and the co-purchase counts in step with
+    payments: a failed order's reserved units go back on sale, and a failed
+    order that is paid after all takes them again (even if that oversells, as
+    the customer has paid). Paid orders are queued for the next build-recs in
+    case its watermark already passed them. Called inside the transaction
+    that moves the orders, once per actual transition.
+    """
+    sales_rollup.order_status_changed(previous, status, order_ids)
+    if status == 'success':
+        recommendation_builder.orders_paid(order_ids)
+    if status == 'failed':
+        restock(db, Product, OrderItem, order_ids)
+    elif status == 'success' and previous == 'failed':
+        restock(db, Product, OrderItem, order_ids, sign=-1)
+        oversold = db.session.query(Product.id).filter(
+            Product.id.in_(select(OrderItem.product_id).where(OrderItem.order_id.in_(order_ids))),
+            Product.stock < 0).all()
+        if oversold:
+            print(f"Late payments oversold products {[product_id for product_id, in oversold]}")
+
+# Webhooks are logged and acknowledged immediately, then applied to orders in batches here
+payment_event_processor = PaymentEventProcessor(app, db, WebhookEvent, Order, order_status_changed)
+
+# --- Background Payment Initiation ---
+# 'paystack' (M-PESA through Paystack) or 'daraja' (STK Push straight from Safaricom)
+PAYMENT_PROVIDER = os.environ.get('PAYMENT_PROVIDER', 'paystack')
+# Paystack calls run here instead of on the request thread; threads start lazily, so this is fork-safe
+payment_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('PAYMENT_WORKERS', 8)),
+                                      thread_name_prefix='payment')
+
+def initiate_order_payment(order_id, phone_number, amount, email):
+    """
+    Initiate the M-Pesa charge for an order created in the 'initiating' state
+    and move it to 'pending' (awaiting the customer's PIN) or 'failed'.
+    """
+    # Payment modules (and requests) load on first use, keeping them out of worker boot and CLI commands
+    from paystack_handler import initiate_mpesa_charge
+    from mpesa_handler import initiate_stk_push
+
+    with app.app_context():
+        order = db.session.get(Order, order_id)
+        try:
+            if order.payment_provider == 'daraja':
+                # Daraja caps AccountReference at 12 characters; the callback is matched on CheckoutRequestID
+                result = initiate_stk_push(phone_number, amount, account_reference=order.reference[-12:])
+            else:
+                result = initiate_mpesa_charge(phone_number=phone_number, amount=amount, email=email,
+                                               reference=order.reference)
+        except Exception as e:
+            result = {"error": str(e)}
+
+        if "error" in result:
+            print(f"Payment initiation failed for order {order.reference}: {result['error']}")
+            new_status = 'failed'
+        else:
+            new_status = 'pending'
+
+        values = {'status': new_status}
+        if result.get('CheckoutRequestID'):
+            values['checkout_request_id'] = result['CheckoutRequestID']
+        # Only move forward from 'initiating', in case a webhook already settled the order
+        moved = Order.query.filter_by(id=order_id, status='initiating').update(values)
+        if moved:
+            order_status_changed('initiating', new_status, [order_id])
+        db.session.commit()
+
+def report_payment_job(reference, future):
+    """
+    Done-callback for initiate_order_payment jobs, which nothing else waits
+    on: log a crash. The order stays 'initiating' until payment_reconciler
+    expires it and puts its stock back.
+    """
+    if future.cancelled():
+        print(f"Payment initiation for order {reference} was cancelled")
+    elif future.exception() is not None:
+        print(f"Payment initiation for order {reference} crashed: {future.exception()!r}")
+
+def lookup_payment_status(reference, provider, checkout_request_id):
+    """The settled status of an order according to its payment provider, or None while unresolved."""
+    from paystack_handler import verify_transaction
+    from mpesa_handler import query_stk_status
+
+    if provider == 'daraja':
+        return query_stk_status(checkout_request_id) if checkout_request_id else None
+    return verify_transaction(reference)
+
+# Settles pending orders whose webhook or callback was lost, and fails orders whose payment
+# request was lost in a restart or crash (flask reconcile-payments)
+payment_reconciler = PaymentReconciler(app, db, Order, lookup_payment_status, order_status_changed)
+
+def paid_baskets(after_id, limit):
+    """
+    (order_id, product_id) lines of the paid orders among the next `limit`
+    orders after `after_id`, and the id of the last of those orders. Stops
+    short of the oldest order still awaiting payment, unless it has waited
+    longer than the reconciler's staleness window; those, like failed orders
+    paid later, reach the counts through the backlog that
+    order_status_changed fills.
+    """
+    stale = datetime.utcnow() - timedelta(seconds=payment_reconciler.stale_after)
+    unsettled = db.session.query(db.func.min(Order.id)).filter(
+        Order.id > after_id, Order.status.in_(('initiating', 'pending')), Order.created_at >= stale).scalar()
+    query = db.session.query(Order.id).filter(Order.id > after_id)
+    if unsettled is not None:
+        query = query.filter(Order.id < unsettled)
+    last = db.session.query(db.func.max(query.order_by(Order.id).limit(limit).subquery().c.id)).scalar()
+    if last is None:
+        return [], None
+    pairs = (db.session.query(OrderItem.order_id, OrderItem.product_id)
+             .join(Order, Order.id == OrderItem.order_id)
+             .filter(OrderItem.order_id > after_id, OrderItem.order_id <= last,
+                     OrderItem.product_id.is_not(None), Order.status == 'success').all())
+    return [tuple(pair) for pair in pairs], last
+
+# Precomputed "similar" and "bought together" lists (flask build-recs); the latter from paid orders' lines
+recommendation_builder = RecommendationBuilder(db, Product, ProductAttribute, ProductRecommendation,
+                                               ProductCopurchase, RecommendationRun, basket_source=paid_baskets,
+                                               backlog_model=RecommendationBacklog, item_model=OrderItem)
+
+# --- Catalog Import/Export ---
+# Sample catalog loaded by setup-db, init-db and the admin reseed
+SEED_CATALOG = os.path.join(basedir, 'seed_products.jsonl')
+# Reseeds run here, one at a time, instead of holding a web worker for the whole import
+catalog_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='catalog')
+last_catalog_job = None
+
+def import_products(rows, replace=False, batch_size=CATALOG_BATCH_SIZE):
+    """Upsert product mappings in batches (see catalog_io.import_catalog), then resync search and caches."""
+    if replace:
+        # Replaced products may get their old ids back; `flask build-recs` recomputes their lists
+        db.session.query(ProductRecommendation).delete()
+    stats = import_catalog(db, Product, ProductAttribute, rows, batch_size=batch_size, replace=replace)
+    # Bulk writes bypass the Product hooks that maintain the search index and the catalog version
+    with db.engine.begin() as connection:
+        search_backend.rebuild(connection)
+    catalog_cache.bump()
+    return stats
+
+def import_products_file(path, fmt=None, replace=False, batch_size=CATALOG_BATCH_SIZE):
+    """Stream a CSV or JSONL catalog file ('-' for stdin) into the product table."""
+    fmt = detect_format(path, fmt)
+    with open_catalog(path) as stream:
+        return import_products(read_catalog(stream, fmt), replace=replace, batch_size=batch_size)
+
+def reseed_catalog_job():
+    """Replace the catalog with the sample products; runs on catalog_executor."""
+    global last_catalog_job
+    with app.app_context():
+        try:
+            stats = import_products_file(SEED_CATALOG, replace=True)
+            print(f"Re-seeded the catalog with {stats['rows']} products in {stats['seconds']}s")
+        except Exception as e:
+            db.session.rollback()
+            stats = {'error': str(e)}
+            print(f"Catalog reseed failed: {e}")
+    stats['finished_at'] = datetime.utcnow().isoformat()
+    last_catalog_job = stats
 
 # --- Email Sending Functions ---
 def send_welcome_email(email, username):
@@ -181,11 +560,7 @@ You can now log in to your account and start shopping for the best tech products
 Best regards,
 The Tech Kenya Team
 """
-    try:
-        mail.send(msg)
-        print(f"Welcome email sent to {email}")
-    except Exception as e:
-        print(f"Failed to send welcome email to {email}: {e}")
+    mail_dispatcher.enqueue(msg)
 
 def send_login_notification(email, username):
     """Send a login notification email to the user."""
@@ -204,11 +579,12 @@ If this was not you, please contact our support team immediately.
 Best regards,
 The Tech Kenya Team
 """
-    try:
-        mail.send(msg)
-        print(f"Login notification sent to {email}")
-    except Exception as e:
-        print(f"Failed to send login notification to {email}: {e}")
+    mail_dispatcher.enqueue(msg)
+
+@app.cli.command('setup-db')
+def setup_db_command():
+    """Creates missing tables and the search index, and seeds an empty database. Safe to re-run."""
+    setup_database()
 
 @app.cli.command('init-db')
 def init_db_command():
@@ -216,74 +592,185 @@ def init_db_command():
     with app.app_context():
         db.drop_all()
         db.create_all()
+        with db.engine.begin() as connection:
+            search_backend.create(connection)
+            search_backend.rebuild(connection)
 
         # Create admin user
         hashed_password = generate_password_hash('admin')
         admin_user = User(username='admin', email='admin@example.com', password_hash=hashed_password, is_admin=True)
         db.session.add(admin_user)
 
-        # This list uses local image paths to guarantee they load.
-        initial_products = [
-            # Laptops
-            {'name': 'Apple MacBook Air M2', 'price': 150000, 'old_price': 165000, 'rating': 4.9, 'description': ['Apple M2 Chip','8GB RAM','256GB SSD'], 'image': 'images/apple_macbook_air_m2.jpg', 'category': 'Laptops'},
-            {'name': 'Dell XPS 15', 'price': 180000, 'old_price': 200000, 'rating': 4.9, 'description': ['Intel Core i9','32GB RAM','1TB SSD'], 'image': 'images/dell_xps_15.jpg', 'category': 'Laptops'},
-            {'name': 'HP Spectre x360', 'price': 145000, 'old_price': 160000, 'rating': 4.7, 'description': ['Intel Core i7','16GB RAM','512GB SSD'], 'image': 'images/hp_spectre_x360.jpg', 'category': 'Laptops'},
-            {'name': 'Lenovo ThinkPad X1 Carbon', 'price': 165000, 'old_price': 180000, 'rating': 4.7, 'description': ['Intel Core i7','16GB RAM','1TB SSD'], 'image': 'images/lenovo_thinkpad_x1_carbon.jpg', 'category': 'Laptops'},
-            {'name': 'Asus ROG Zephyrus G14', 'price': 190000, 'old_price': 210000, 'rating': 4.8, 'description': ['AMD Ryzen 9','16GB RAM','1TB SSD'], 'image': 'images/asus_rog_zephyrus_g14.jpg', 'category': 'Laptops'},
-            
-            # Desktops
-            {'name': 'Apple iMac 24"', 'price': 180000, 'old_price': 195000, 'rating': 4.8, 'description': ['Apple M1 Chip','8GB RAM','256GB SSD'], 'image': 'images/apple_imac_24.jpg', 'category': 'Desktops'},
-            {'name': 'Alienware Aurora R15', 'price': 250000, 'old_price': 280000, 'rating': 4.9, 'description': ['Intel Core i9','32GB RAM','2TB SSD'], 'image': 'images/alienware_aurora_r15.jpg', 'category': 'Desktops'},
-            {'name': 'HP Envy All-in-One 34"', 'price': 220000, 'old_price': 240000, 'rating': 4.8, 'description': ['Intel Core i7','16GB RAM','1TB SSD'], 'image': 'images/hp_envy_all-in-one_34.jpg', 'category': 'Desktops'},
-            {'name': 'Corsair Vengeance i7400', 'price': 280000, 'old_price': 310000, 'rating': 4.9, 'description': ['Intel Core i7','32GB DDR5','2TB NVMe'], 'image': 'images/gaming_pc_pro.jpg', 'category': 'Desktops'},
-            {'name': 'HP Pavilion Gaming Desktop', 'price': 98000, 'old_price': 110000, 'rating': 4.6, 'description': ['Intel Core i5','16GB RAM','512GB SSD'], 'image': 'images/hp_pavilion_gaming_desktop.jpg', 'category': 'Desktops'},
-
-            # Accessories
-            {'name': 'Sony WH-1000XM5 Headphones', 'price': 45000, 'old_price': 52000, 'rating': 4.9, 'description': ['Noise Cancelling','Wireless','30-Hour Battery'], 'image': 'images/sony_wh-1000xm5_headphones.jpg', 'category': 'Accessories'},
-            {'name': 'Logitech MX Master 3S Mouse', 'price': 12000, 'old_price': 15000, 'rating': 4.9, 'description': ['Ergonomic Design','8K DPI Sensor','Quiet Clicks'], 'image': 'images/logitech_mx_master_3s_mouse.jpg', 'category': 'Accessories'},
-            {'name': 'Keychron K2 Mechanical Keyboard', 'price': 9500, 'old_price': 11000, 'rating': 4.8, 'description': ['Wireless/Wired','Gateron Switches','Mac & Windows'], 'image': 'images/keychron_k2_mechanical_keyboard.jpg', 'category': 'Accessories'},
-            {'name': 'Anker 737 Power Bank', 'price': 15000, 'old_price': 18000, 'rating': 4.9, 'description': ['24,000mAh','140W Output','Smart Display'], 'image': 'images/anker_737_power_bank.jpg', 'category': 'Accessories'},
-            {'name': 'Logitech C920 HD Pro Webcam', 'price': 8000, 'old_price': 9500, 'rating': 4.7, 'description': ['1080p Full HD','Stereo Audio','Light Correction'], 'image': 'images/logitech_c920_hd_pro_webcam.jpg', 'category': 'Accessories'},
-        ]
-
-        for data in initial_products:
-            p = Product(name=data['name'], price=data['price'], old_price=data.get('old_price'), rating=data.get('rating'), image=data['image'], category=data['category'])
-            p.description_list = data.get('description', [])
-            db.session.add(p)
-        
         db.session.commit()
+
+        import_products_file(SEED_CATALOG)
         print("✅ Initialized the database with fresh data.")
 
+catalog_cli = AppGroup('catalog', help='Bulk import and export of the product catalog.')
+app.cli.add_command(catalog_cli)
+
+@catalog_cli.command('import')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file extension.')
+@click.option('--replace', is_flag=True, help='Delete every existing product first.')
+@click.option('--batch-size', type=int, default=CATALOG_BATCH_SIZE, show_default=True, help='Rows per transaction.')
+def catalog_import_command(path, fmt, replace, batch_size):
+    """Upserts products from a CSV or JSONL file ('-' for stdin), matching rows on id, else on name."""
+    try:
+        stats = import_products_file(path, fmt, replace=replace, batch_size=batch_size)
+    except CatalogFormatError as e:
+        # Batches before the bad row are already committed
+        raise click.ClickException(str(e))
+    print(f"✅ Imported {stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_second'] or 0} rows/s): "
+          f"{stats['inserted']} inserted, {stats['updated']} updated.")
+
+@catalog_cli.command('export')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file extension.')
+@click.option('--batch-size', type=int, default=CATALOG_BATCH_SIZE, show_default=True, help='Rows fetched at a time.')
+def catalog_export_command(path, fmt, batch_size):
+    """Streams every product to a CSV or JSONL file ('-' for stdout)."""
+    try:
+        fmt = detect_format(path, fmt)
+    except CatalogFormatError as e:
+        raise click.ClickException(str(e))
+    with open_catalog(path, 'w') as stream:
+        stats = export_catalog(db, Product, ProductAttribute, stream, fmt, batch_size=batch_size)
+    # Keep the summary out of the data when exporting to stdout
+    click.echo(f"✅ Exported {stats['rows']} products in {stats['seconds']}s "
+               f"({stats['rows_per_second'] or 0} rows/s).", err=path == '-')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuilds the product search index from the product table."""
+    with db.engine.begin() as connection:
+        search_backend.create(connection)
+        search_backend.rebuild(connection)
+    print(f"✅ Rebuilt the '{search_backend.name}' product search index.")
+
+@app.cli.command('build-images')
+@click.option('--workers', type=int, default=None, help='Worker processes (default: one per CPU).')
+@click.option('--force', is_flag=True, help='Rebuild derivatives that are already up to date.')
+def build_images_command(workers, force):
+    """Builds resized WebP/AVIF derivatives of every image in static/images."""
+    started = time.perf_counter()
+    results = image_derivatives.build_all(workers=workers, force=force)
+    failed = {image: error for image, error in results.items() if isinstance(error, Exception)}
+    for image, error in failed.items():
+        print(f"⚠️ Could not process {image}: {error}")
+    print(f"✅ Built derivatives for {len(results) - len(failed)} images in {time.perf_counter() - started:.1f}s.")
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprints static files, minifies CSS and pre-compresses text assets."""
+    manifest = static_assets.build()
+    compressed = sum(1 for asset in manifest['assets'].values() if asset['encodings'])
+    print(f"✅ Fingerprinted {len(manifest['files'])} static files ({compressed} pre-compressed).")
+
+@app.cli.command('reconcile-payments')
+@click.option('--limit', type=int, default=None, help='Stop after checking this many orders.')
+def reconcile_payments_command(limit):
+    """Settles stale unpaid orders by querying Paystack and Daraja for their status."""
+    stats = payment_reconciler.run(limit=limit)
+    print(f"✅ Checked {stats['checked']} stale unpaid orders in {stats['seconds']}s "
+          f"({stats['orders_per_second'] or 0} orders/s): {stats['updated']} updated "
+          f"({stats['expired']} expired before their payment request), "
+          f"{stats['unresolved']} still unresolved, {stats['errors']} errors. "
+          f"Oldest was waiting {stats['oldest_pending_seconds'] or 0}s.")
+
+@app.cli.command('build-recs')
+@click.option('--full', is_flag=True, help='Recompute every list and recount co-purchases from the first order.')
+def build_recs_command(full):
+    """Builds product recommendations from specs and from orders placed since the last run."""
+    stats = recommendation_builder.run(full=full)
+    # Product pages cache their recommendations with the catalog
+    catalog_cache.bump()
+    print(f"✅ Built recommendations in {stats['seconds']}s: {stats['similar_updated']} similar lists, "
+          f"{stats['bought_updated']} bought-together lists from {stats['orders']} new orders "
+          f"(watermark: order {stats['last_order_id']}).")
+
+@app.cli.command('refresh-analytics')
+@click.option('--full', is_flag=True, help='Rebuild the rollups from the first order.')
+def refresh_analytics_command(full):
+    """Folds orders placed and status changes since the last refresh into the sales rollups."""
+    stats = sales_rollup.run(full=full)
+    print(f"✅ Folded {stats['orders']} orders and {stats['transitions']} status changes into the sales rollups "
+          f"in {stats['seconds']}s (watermark: order {stats['last_order_id']}).")
+
+@app.route('/admin/reconcile-stats')
+def reconcile_stats():
+    """Admin-only JSON view of the last payment reconciliation run in this process."""
+    if not session.get('is_admin'):
+        abort(403)
+    return jsonify(payment_reconciler.last_run or {})
+
+@app.route('/admin/mail-stats')
+def mail_stats():
+    """Admin-only JSON view of the outbound mail queue depth and send latency."""
+    if not session.get('is_admin'):
+        abort(403)
+    return jsonify(mail_dispatcher.stats())
+
 @app.route('/admin/reseed-products')
 def reseed_products():
     """
-    An admin-only route to clear and re-populate the product database.
-    This is useful for development to apply changes from initial_products.
+    An admin-only route to clear and re-populate the product database from
+    seed_products.jsonl. The import runs in the background; its result is
+    shown at /admin/catalog-stats.
     """
     if not session.get('is_admin'):
         flash('You do not have permission to perform this action.', 'danger')
         return redirect(url_for('home'))
 
-    # Clear the Product table
-    db.session.query(Product).delete()
-    db.session.commit()
-    flash('All products have been deleted. Repopulating database...', 'warning')
-    init_db_command() # This will now run the product population logic
-    flash('Product database has been successfully re-seeded.', 'success')
+    catalog_executor.submit(reseed_catalog_job)
+    flash('Re-seeding the product catalog in the background. It will be ready in a moment.', 'info')
     return redirect(url_for('admin.index'))
 
-@app.context_processor
-def inject_cart_count():
-    cart = session.get('cart', {})
-    # Sum the quantities of all items in the cart
-    cart_item_count = sum(cart.values())
+@app.route('/admin/catalog-stats')
+def catalog_stats():
+    """Admin-only JSON view of the last background catalog job in this process."""
+    if not session.get('is_admin'):
+        abort(403)
+    return jsonify(last_catalog_job or {})
+
+# --- Cart Helpers ---
+def get_cart_id(create=False):
+    """The current user's cart id from the session, optionally creating one."""
+    cart_id = session.get('cart_id')
+    if cart_id is None and create:
+        cart_id = session['cart_id'] = uuid.uuid4().hex
+    return cart_id
+
+def get_cart():
+    """The current cart as {product_id: quantity}, read from the cart store once per request."""
+    if 'cart' not in g:
+        cart_id = get_cart_id()
+        g.cart = cart_store.get(cart_id) if cart_id else {}
+    return g.cart
+
+def get_cart_summary():
+    """
+    Hydrate the session cart into display rows and totals.
+
+    All cart products are loaded with a single IN (...) query and the result is
+    memoized on flask.g, so the context processor, cart() and checkout() share
+    one lookup per request regardless of how many lines the cart holds.
+    Returns a dict with 'items', 'total' and 'count'.
+    """
+    if 'cart_summary' in g:
+        return g.cart_summary
+
+    cart = get_cart()
+    products = {}
+    if cart:
+        # The cart never shows specs, so skip the attribute query; code sharing these products still gets them lazily
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(list(cart)))
+                    .options(lazyload(Product.attributes)).all()}
 
-    # Get cart items for dropdown display
     cart_items = []
     total = 0
-    for pid_str, qty in cart.items():
-        pid = int(pid_str)
-        product = Product.query.get(pid)
+    for pid, qty in cart.items():
+        product = products.get(pid)
         if product:
             subtotal = product.price * qty
             total += subtotal
@@ -293,66 +780,251 @@ def inject_cart_count():
                 'price': product.price,
                 'quantity': qty,
                 'subtotal': subtotal,
-                'image': product.web_image_path
+                'image': product.web_image_path,
+                'stock': product.stock
             })
 
-    return dict(
-        cart_item_count=cart_item_count,
-        cart_items=cart_items,
-        cart_total=total
-    )
+    g.cart_summary = {
+        'items': cart_items,
+        'total': total,
+        # Sum the quantities of all items in the cart
+        'count': sum(cart.values())
+    }
+    return g.cart_summary
+
+def invalidate_cart_summary():
+    """Drop the memoized cart and summary after the cart is modified."""
+    g.pop('cart', None)
+    g.pop('cart_summary', None)
+
+@app.before_request
+def start_background_workers():
+    cart_sweeper.ensure_started()
+    # Also drains events logged before a restart
+    payment_event_processor.ensure_started()
+    payment_reconciler.ensure_started()
+    sales_rollup.ensure_started()
+
+# --- Catalog Cache Helpers ---
+def catalog_version():
+    """The catalog version for this request, read from the cache backend once."""
+    if 'catalog_version' not in g:
+        g.catalog_version = catalog_cache.version()
+    return g.catalog_version
+
+def _detach(value):
+    """Expunge loaded products from the session so cached copies survive later commits."""
+    if isinstance(value, dict):
+        _detach(list(value.values()))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _detach(item)
+    elif isinstance(value, db.Model) and value in db.session:
+        db.session.expunge(value)
+    return value
+
+def cached_catalog(key, loader):
+    """Read a catalog query through the versioned catalog cache."""
+    return catalog_cache.get_or_set(key, lambda: _detach(loader()), version=catalog_version())
+
+# --- Keyset Pagination ---
+# Products shown per category on the "All Products" page before "Load more"
+HOME_CATEGORY_PREVIEW = int(os.environ.get('HOME_CATEGORY_PREVIEW', 8))
+CATEGORY_PAGE_SIZE = int(os.environ.get('CATEGORY_PAGE_SIZE', 24))
+ORDERS_PAGE_SIZE = int(os.environ.get('ORDERS_PAGE_SIZE', 20))
+# Products per recommendation list on the product page
+RECOMMENDATIONS_SHOWN = int(os.environ.get('RECOMMENDATIONS_SHOWN', 4))
+
+def product_page(category=None, cursor=None, limit=CATEGORY_PAGE_SIZE, facets=None):
+    """
+    One page of a category (or of the whole catalog) in name order, starting
+    after `cursor` and narrowed to the selected `facets` ({name: [values]}).
+    Returns (products, next_cursor). Raises InvalidCursor.
+    """
+    query = Product.query.filter_by(category=category) if category else Product.query
+    query = filter_by_facets(query, Product, ProductAttribute, facets or {})
+    facet_key = '|'.join(facet_params(facets or {}))
+    return cached_catalog(f'page:{category or ""}:{facet_key}:{cursor or ""}:{limit}',
+                          lambda: keyset_page(query, [Product.name, Product.id], cursor, limit))
+
+def category_facets(category, facets):
+    """Facet options and product counts for a category under the current selection, computed in SQL."""
+    return cached_catalog(f'facets:{category}:{"|".join(facet_params(facets))}',
+                          lambda: facet_counts(db, Product, ProductAttribute, facets, category=category))
+
+def category_previews(categories, limit=HOME_CATEGORY_PREVIEW):
+    """
+    The first `limit` products of every category, fetched in a single query:
+    a UNION ALL of per-category LIMIT subqueries, each an index range scan on
+    (category, name). Returns ({category: products}, {category: next_cursor}).
+    """
+    if not categories:
+        return {}, {}
+    branches = [
+        select(Product.id).where(Product.category == category)
+        .order_by(Product.name, Product.id).limit(limit + 1).subquery()
+        for category in categories
+    ]
+    ids = union_all(*[select(branch.c.id) for branch in branches])
+    products = Product.query.filter(Product.id.in_(ids)).order_by(
+        Product.category, Product.name, Product.id).all()
+
+    grouped, next_cursors = {}, {}
+    for p in products:
+        grouped.setdefault(p.category, []).append(p)
+    for category, items in grouped.items():
+        if len(items) > limit:
+            # The extra row only tells us another page exists
+            grouped[category] = items[:limit]
+            next_cursors[category] = encode_cursor([items[limit - 1].name, items[limit - 1].id])
+    return grouped, next_cursors
+
+def order_page(user_id, cursor=None, limit=ORDERS_PAGE_SIZE):
+    """A user's orders, newest first, starting after `cursor`. Returns (orders, next_cursor)."""
+    return keyset_page(Order.query.filter_by(user_id=user_id), [Order.created_at, Order.id],
+                       cursor, limit, descending=True)
+
+# --- Conditional GET for Catalog Pages ---
+def is_personalized():
+    """Whether this request's page shows per-visitor data: the logged-in navbar or pending flash messages."""
+    return 'username' in session or '_flashes' in session
+
+# Anonymous catalog pages get a strong ETag and s-maxage; the cart is loaded separately from /api/cart
+catalog_pages = ConditionalGet(
+    lambda: f'{catalog_cache.validator(catalog_version())}.{image_derivatives.manifest.version()}',
+    is_personalized, release_fingerprint(app.root_path))
 
 @app.route('/')
+@catalog_pages.page
 def home():
     # Get search query and category from request args
     search_query = request.args.get('q')
     selected_category = request.args.get('category')
+    # Spec filters (?f=RAM:16GB RAM), offered on category pages
+    selected_facets = parse_facets(request.args.getlist(FACET_PARAM)) if selected_category else {}
 
-    # Base query
-    query = Product.query
-
-    # Apply search filter if present
+    # Apply search if present, ranked by relevance across name, description and category
     if search_query:
-        query = query.filter(Product.name.ilike(f'%{search_query}%'))
+        products = cached_catalog(f'search:{search_query.strip().lower()}',
+                                  lambda: search_backend.search(search_query))
         # When searching, we don't want the category filter from the sidebar to be active
         selected_category = None
-
-    # Apply category filter if present (and not searching)
-    elif selected_category:
-        query = query.filter_by(category=selected_category)
-
-    # Fetch products from the filtered query
-    products = query.order_by(Product.name).all()
+        selected_facets = {}
 
     # Get all distinct categories for the sidebar
-    all_categories = [cat[0] for cat in db.session.query(Product.category).distinct().order_by(Product.category).all()]
+    all_categories = cached_catalog('categories', lambda: [
+        cat[0] for cat in db.session.query(Product.category).distinct().order_by(Product.category).all()
+    ])
 
-    # Group the final list of products by category for display
     categorized_products = {}
-    if products:
-        result_categories = sorted(list(set(p.category for p in products)))
-        for cat in result_categories:
-            categorized_products[cat] = [p for p in products if p.category == cat]
+    next_cursors = {}
+    facets = {}
+    if search_query:
+        # Keep relevance order: categories appear in the order of their best match
+        for p in products:
+            categorized_products.setdefault(p.category, []).append(p)
+    elif selected_category:
+        # One keyset page of the category; the cursor comes from "Load more"
+        cursor = request.args.get('cursor')
+        try:
+            products, next_cursor = product_page(selected_category, cursor, facets=selected_facets)
+        except InvalidCursor:
+            products, next_cursor = product_page(selected_category, facets=selected_facets)
+        if products:
+            categorized_products[selected_category] = products
+            next_cursors[selected_category] = next_cursor
+        facets = category_facets(selected_category, selected_facets)
+    else:
+        categorized_products, next_cursors = cached_catalog(
+            'category-previews', lambda: category_previews(all_categories))
 
     # For the carousel, just get the first 3 products
-    carousel_products = Product.query.limit(3).all()
+    carousel_products = cached_catalog('carousel', lambda: Product.query.limit(3).all())
 
     return render_template('home.html', 
                            carousel_products=carousel_products,
                            categories=all_categories, 
                            categorized_products=categorized_products,
                            selected_category=selected_category,
-                           search_query=search_query)
+                           search_query=search_query,
+                           next_cursors=next_cursors,
+                           facets=facets,
+                           selected_facets=selected_facets,
+                           facet_args=facet_params(selected_facets))
+
+@app.route('/api/products')
+@catalog_pages.page
+def products_api():
+    """Next keyset page of a category (or the whole catalog) as rendered product cards, for "Load more"."""
+    category = request.args.get('category')
+    facets = parse_facets(request.args.getlist(FACET_PARAM)) if category else {}
+    try:
+        products, next_cursor = product_page(category, request.args.get('cursor'), facets=facets)
+    except InvalidCursor:
+        abort(400)
+    html = render_template('_product_cards.html', products=products)
+    return jsonify(html=html, next_cursor=next_cursor)
+
+@app.route('/api/search/suggest')
+def search_suggest():
+    """
+    Typeahead suggestions for the search box as compact JSON.
+
+    Served from the in-memory prefix index with no template render. The
+    catalog version the index is checked against is read from the database
+    at most every SUGGEST_VERSION_MAX_AGE seconds, so most keystrokes run no
+    query; this worker's own product edits still rebuild the index at once,
+    other workers' within that time. The ETag is derived from the response
+    body, so it is consistent across workers and repeat lookups get a 304.
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+
+    matches = suggest_index.get(catalog_cache.version(max_age=SUGGEST_VERSION_MAX_AGE)).lookup(query, limit=limit)
+    response = jsonify(
+        q=query,
+        results=[{'id': pid, 'name': name, 'category': category,
+                  'url': url_for('product_detail', product_id=pid)}
+                 for pid, name, category in matches]
+    )
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = 60
+    return response.make_conditional(request)
 
 @app.route('/product/<int:product_id>')
+@catalog_pages.page
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
-    # You could also fetch related products here to show on the page
-    related_products = Product.query.filter(
-        Product.category == product.category, 
-        Product.id != product.id
-    ).limit(4).all()
-    return render_template('product_detail.html', product=product, related_products=related_products)
+    def load_product():
+        product = db.session.get(Product, product_id)
+        if product is None:
+            return None
+        # The precomputed lists are one primary-key lookup; their products are one IN (...) query
+        recommendation = db.session.get(ProductRecommendation, product_id)
+        if recommendation is None:
+            # Not built yet (flask build-recs): show the first products of the category
+            related_products = Product.query.filter(
+                Product.category == product.category,
+                Product.id != product.id
+            ).order_by(Product.name, Product.id).options(lazyload(Product.attributes)).limit(RECOMMENDATIONS_SHOWN).all()
+            return product, related_products, []
+        similar_ids = recommendation.similar_ids[:RECOMMENDATIONS_SHOWN]
+        bought_ids = recommendation.bought_with_ids[:RECOMMENDATIONS_SHOWN]
+        # Recommendation cards show no specs, so skip the attribute query (lazily loaded if ever read)
+        found = {p.id: p for p in Product.query.filter(Product.id.in_(similar_ids + bought_ids))
+                 .options(lazyload(Product.attributes))}
+        return (product, [found[i] for i in similar_ids if i in found],
+                [found[i] for i in bought_ids if i in found])
+
+    cached = cached_catalog(f'product:{product_id}', load_product)
+    if cached is None:
+        abort(404)
+    product, related_products, bought_together = cached
+    return render_template('product_detail.html', product=product, related_products=related_products,
+                           bought_together=bought_together)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
@@ -416,30 +1088,26 @@ def logout():
 
 @app.route('/add_to_cart/<int:product_id>')
 def add_to_cart(product_id):
-    product = Product.query.get(product_id)
+    product = db.session.get(Product, product_id)
     if not product:
         flash('Product not found.', 'danger')
         return redirect(request.referrer or url_for('home'))
 
-    cart = session.get('cart', {})
-    # Use string keys for the cart session dictionary for JSON compatibility
-    product_id_str = str(product_id)
-    cart[product_id_str] = cart.get(product_id_str, 0) + 1
-    session['cart'] = cart
+    # Single atomic upsert; concurrent adds to the same cart never lose an increment
+    cart_store.add(get_cart_id(create=True), product_id)
+    invalidate_cart_summary()
     flash(f"'{product.name}' added to cart.", 'info')
     return redirect(request.referrer or url_for('home'))
 
 @app.route('/remove_from_cart/<int:product_id>')
 def remove_from_cart(product_id):
-    cart = session.get('cart', {})
-    product_id_str = str(product_id)
+    cart_id = get_cart_id()
 
-    if product_id_str in cart:
-        # Get product name before deleting for the flash message
-        product = Product.query.get(product_id)
+    if cart_id and cart_store.remove(cart_id, product_id):
+        invalidate_cart_summary()
+        # Get product name for the flash message
+        product = db.session.get(Product, product_id)
         product_name = product.name if product else 'Item'
-        cart.pop(product_id_str, None)
-        session['cart'] = cart
         flash(f"'{product_name}' removed from cart.", 'info')
     else:
         flash('Item not found in cart.', 'warning')
@@ -448,8 +1116,7 @@ def remove_from_cart(product_id):
 
 @app.route('/update_cart/<int:product_id>', methods=['POST'])
 def update_cart(product_id):
-    cart = session.get('cart', {})
-    product_id_str = str(product_id)
+    cart_id = get_cart_id()
 
     try:
         quantity = int(request.form.get('quantity'))
@@ -457,31 +1124,34 @@ def update_cart(product_id):
         flash('Invalid quantity.', 'danger')
         return redirect(url_for('cart'))
 
-    if product_id_str in cart:
+    if cart_id:
         if quantity > 0:
-            cart[product_id_str] = quantity
-            flash('Cart updated.', 'success')
+            if cart_store.set(cart_id, product_id, quantity):
+                flash('Cart updated.', 'success')
         else: # If quantity is 0 or less, remove the item
-            cart.pop(product_id_str, None)
-            flash('Item removed from cart.', 'info')
-        session['cart'] = cart
+            if cart_store.remove(cart_id, product_id):
+                flash('Item removed from cart.', 'info')
+        invalidate_cart_summary()
 
     return redirect(url_for('cart'))
 
 @app.route('/cart')
 def cart():
-    cart = session.get('cart', {})
-    cart_items = []
-    total = 0
-    for pid_str, qty in cart.items():
-        # Convert the string key from the session back to an integer for product lookup
-        pid = int(pid_str)
-        product = Product.query.get(pid)
-        if product:
-            subtotal = product.price * qty
-            total += subtotal
-            cart_items.append({'id': pid, 'name': product.name, 'price': product.price, 'quantity': qty, 'subtotal': subtotal})
-    return render_template('cart.html', cart_items=cart_items, total=total)
+    summary = get_cart_summary()
+    return render_template('cart.html', cart_items=summary['items'], total=summary['total'])
+
+@app.route('/api/cart')
+def cart_api():
+    """The navbar cart badge and dropdown, fetched by base.html so catalog pages stay cacheable."""
+    summary = get_cart_summary()
+    html = render_template('_cart_dropdown.html', cart_items=summary['items'], cart_total=summary['total'],
+                           cart_item_count=summary['count'],
+                           # Fragment cache key: visitors with the same cart share the rendered dropdown
+                           cart_key=','.join(f'{item["id"]}x{item["quantity"]}' for item in summary['items']))
+    response = jsonify(count=summary['count'], html=html)
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
 
 @app.route('/checkout', methods=['GET', 'POST'])
 def checkout():
@@ -489,8 +1159,12 @@ def checkout():
     Handle the checkout process for users to complete their orders.
 
     GET: Display the checkout form with shipping details fields.
-    POST: Process the checkout form, validate shipping details, initiate M-PESA payment,
-          and create an order record with shipping information.
+    POST: Process the checkout form, validate shipping details, reserve stock for the
+          cart and create an order record with its lines and shipping information in the
+          'initiating' state (one transaction), and hand the M-PESA charge to a background
+          worker. The user is redirected straight to the order status page, which polls
+          for the payment outcome. If any product has sold out, nothing is recorded and
+          the user is sent back to the cart.
 
     Shipping Details Collected:
     - county: User's county (e.g., Nairobi, Mombasa) for regional shipping
@@ -503,11 +1177,12 @@ def checkout():
         flash('Please login to checkout.', 'warning')
         return redirect(url_for('login'))
 
-    if not session.get('cart'):
+    if not get_cart():
         flash('Your cart is empty. Add items before checking out.', 'warning')
         return redirect(url_for('home'))
 
     admin_phone = '0111214624' # Admin's predefined M-PESA number
+    summary = get_cart_summary()
 
     if request.method == 'POST':
         phone_number = request.form.get('phone_number')
@@ -516,12 +1191,7 @@ def checkout():
         shipping_address = request.form.get('shipping_address')  # Full shipping address
 
         # 1. Calculate total amount from the cart
-        cart = session.get('cart', {})
-        total = 0
-        for pid_str, qty in cart.items():
-            product = Product.query.get(int(pid_str))
-            if product:
-                total += product.price * qty
+        total = summary['total']
 
         # Override phone number if the user is an admin
         if session.get('is_admin'):
@@ -535,33 +1205,29 @@ def checkout():
         # Validate that all shipping details are provided
         if not county or not city or not shipping_address:
             flash('Please provide shipping details.', 'warning')
-            return render_template('checkout.html', admin_phone=admin_phone)
+            return render_template('checkout.html', admin_phone=admin_phone,
+                           cart_items=summary['items'], cart_total=summary['total'])
 
-        # 2. Initiate the M-Pesa charge via Paystack (fire and forget)
-        email = "customer@anorld.com"  # Default email, can be updated to get from user
-        result = initiate_mpesa_charge(phone_number=phone_number, amount=total, email=email)
-        if "error" in result:
-            # Still create order as pending for tracking, even if payment fails
-            reference = f"ANORLD_{int(total)}_{phone_number.replace('+', '').replace(' ', '')}"
-            user = User.query.filter_by(username=session['username']).first()
-            order = Order(
-                user_id=user.id,
-                reference=reference,
-                amount=total,
-                phone_number=phone_number,
-                county=county,  # Store shipping county
-                city=city,  # Store shipping city
-                shipping_address=shipping_address,  # Store full shipping address
-                status='failed'
-            )
-            db.session.add(order)
-            db.session.commit()
-            flash(f'Payment initiation failed: {result["error"]}. Order {reference} created for tracking.', 'danger')
-            return render_template('checkout.html', admin_phone=admin_phone)
-
-        # Success: Create pending order with Paystack reference and shipping details
-        reference = result['data']['reference']
+        # Read before the reservation, so the transaction holding the product rows stays short
         user = User.query.filter_by(username=session['username']).first()
+
+        # 2. Reserve the stock first: one conditional UPDATE for the whole cart, so the order is
+        # recorded only if every line fits. Lines the cart summary already saw sold out are turned
+        # away without a write, which is most of the traffic once a flash sale runs out
+        quantities = {item['id']: item['quantity'] for item in summary['items']}
+        short = {item['id']: item['stock'] for item in summary['items']
+                 if item['stock'] is not None and item['stock'] < item['quantity']}
+        if short or not reserve_stock(db, Product, quantities):
+            db.session.rollback()
+            short = short or short_lines(db, Product, quantities)
+            names = {item['id']: item['name'] for item in summary['items']}
+            flash('Sorry, not enough stock left for: ' + ', '.join(
+                f"'{names[product_id]}' ({left} left)" for product_id, left in short.items()) +
+                '. Please update your cart.', 'warning')
+            return redirect(url_for('cart'))
+
+        # 3. Record the order and its lines before talking to Paystack, using our own reference
+        reference = f"ANORLD_{uuid.uuid4().hex[:16].upper()}"
         order = Order(
             user_id=user.id,
             reference=reference,
@@ -570,55 +1236,96 @@ def checkout():
             county=county,  # Store shipping county
             city=city,  # Store shipping city
             shipping_address=shipping_address,  # Store full shipping address
-            status='pending'
+            status='initiating',
+            payment_provider=PAYMENT_PROVIDER
         )
         db.session.add(order)
+        db.session.flush()  # Assigns order.id for the lines
+        # The cart snapshot, in one bulk insert
+        db.session.execute(insert(OrderItem), [
+            {'order_id': order.id, 'product_id': item['id'], 'name': item['name'], 'price': item['price'],
+             'quantity': item['quantity']} for item in summary['items']])
         db.session.commit()
 
-        # 3. Flash success and clear cart
-        flash(f'A payment request has been sent to {phone_number}. Please enter your M-PESA PIN to complete the transaction. Order: {reference}', 'success')
-        session.pop('cart', None)
+        # 4. Initiate the M-Pesa charge in the background so this worker is not parked on Paystack
+        email = "customer@anorld.com"  # Default email, can be updated to get from user
+        payment_executor.submit(initiate_order_payment, order.id, phone_number, total, email).add_done_callback(
+            functools.partial(report_payment_job, reference))
 
-        return redirect(url_for('home'))
-    return render_template('checkout.html', admin_phone=admin_phone)
+        # 5. Clear cart and send the user to the order status page, which polls for the outcome
+        flash(f'Sending a payment request to {phone_number}. Please enter your M-PESA PIN when prompted. Order: {reference}', 'success')
+        cart_store.clear(get_cart_id())
+        invalidate_cart_summary()
+
+        return redirect(url_for('order_status', reference=reference))
+    return render_template('checkout.html', admin_phone=admin_phone,
+                           cart_items=summary['items'], cart_total=summary['total'])
+
+@app.route('/orders/<reference>')
+def order_status(reference):
+    """Order status page; polls order_status_api until the payment settles."""
+    if 'username' not in session:
+        flash('Please login to view your orders.', 'warning')
+        return redirect(url_for('login'))
+
+    order = Order.query.join(User, User.id == Order.user_id).filter(
+        Order.reference == reference, User.username == session['username']
+    ).first_or_404()
+    return render_template('order_status.html', order=order)
+
+@app.route('/api/orders/<reference>/status')
+def order_status_api(reference):
+    """Lightweight JSON status for polling: a single indexed lookup, no template render."""
+    if 'username' not in session:
+        abort(401)
+
+    row = db.session.query(Order.status).join(User, User.id == Order.user_id).filter(
+        Order.reference == reference, User.username == session['username']
+    ).first()
+    if row is None:
+        abort(404)
+    return jsonify(reference=reference, status=row.status)
 
 @app.route('/mpesa_callback', methods=['POST'])
 def mpesa_callback():
-    # M-PESA will send a POST request to this URL after a transaction.
-    # You need to process the JSON data to confirm payment status.
-    data = request.get_json()
-    # Logic to update order status in the database based on the callback data.
-    return 'OK', 200
+    """
+    Daraja STK Push result. Logged to the webhook event log (deduplicated on
+    CheckoutRequestID) and applied to the order by payment_event_processor,
+    the same way as Paystack webhooks.
+    """
+    from mpesa_handler import stk_result_status
+
+    data = request.get_json(silent=True) or {}
+    callback = (data.get('Body') or {}).get('stkCallback') or {}
+    checkout_request_id = callback.get('CheckoutRequestID')
+    if not checkout_request_id or 'ResultCode' not in callback:
+        return jsonify(ResultCode=1, ResultDesc='Rejected'), 400
+
+    row = db.session.query(Order.reference).filter_by(checkout_request_id=checkout_request_id).first()
+    if record_event(db, WebhookEvent, 'mpesa', checkout_request_id, 'stk_callback', row.reference if row else None,
+                    stk_result_status(callback['ResultCode']), data):
+        payment_event_processor.notify()
+    return jsonify(ResultCode=0, ResultDesc='Accepted')
 
 @app.route('/paystack_webhook', methods=['POST'])
 def paystack_webhook():
-    # Paystack sends webhooks for payment events
-    data = request.get_json()
+    """
+    Verify, log and acknowledge Paystack events. Orders are updated in batches
+    by payment_event_processor, so a burst of (re)deliveries costs one insert
+    each and duplicates are dropped by the event log's unique key.
+    """
+    from paystack_handler import verify_webhook_signature, webhook_event_id, WEBHOOK_EVENT_STATUSES
+
+    body = request.get_data()
+    if not verify_webhook_signature(body, request.headers.get('x-paystack-signature')):
+        abort(401)
+
+    data = request.get_json(silent=True) or {}
     event = data.get('event')
-    if event == 'charge.success':
-        # Payment was successful
-        reference = data.get('data', {}).get('reference')
-        if reference:
-            order = Order.query.filter_by(reference=reference).first()
-            if order:
-                order.status = 'success'
-                db.session.commit()
-                print(f"Order {reference} marked as success.")
-            else:
-                print(f"Order with reference {reference} not found.")
-        print(f"Payment successful: {data}")
-        # Here you can send email, etc.
-    elif event == 'charge.failed':
-        reference = data.get('data', {}).get('reference')
-        if reference:
-            order = Order.query.filter_by(reference=reference).first()
-            if order:
-                order.status = 'failed'
-                db.session.commit()
-                print(f"Order {reference} marked as failed.")
-            else:
-                print(f"Order with reference {reference} not found.")
-        print(f"Payment failed: {data}")
+    reference = (data.get('data') or {}).get('reference')
+    if record_event(db, WebhookEvent, 'paystack', webhook_event_id(data, body), event,
+                    reference, WEBHOOK_EVENT_STATUSES.get(event), data):
+        payment_event_processor.notify()
     return 'OK', 200
 
 @app.route('/orders')
@@ -628,8 +1335,27 @@ def orders():
         return redirect(url_for('login'))
 
     user = User.query.filter_by(username=session['username']).first()
-    user_orders = Order.query.filter_by(user_id=user.id).order_by(Order.created_at.desc()).all()
-    return render_template('orders.html', orders=user_orders)
+    cursor = request.args.get('cursor')
+    try:
+        user_orders, next_cursor = order_page(user.id, cursor)
+    except InvalidCursor:
+        cursor = None
+        user_orders, next_cursor = order_page(user.id)
+    return render_template('orders.html', orders=user_orders, next_cursor=next_cursor, cursor=cursor)
+
+@app.route('/api/orders')
+def orders_api():
+    """Next keyset page of the user's orders as rendered table rows, for "Load more"."""
+    if 'username' not in session:
+        abort(401)
+
+    user = User.query.filter_by(username=session['username']).first_or_404()
+    try:
+        user_orders, next_cursor = order_page(user.id, request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    html = ''.join(render_template('_order_row.html', order=order) for order in user_orders)
+    return jsonify(html=html, next_cursor=next_cursor)
 
 @app.route('/contact', methods=['GET', 'POST'])
 def contact():
@@ -649,49 +1375,43 @@ def contact():
         return redirect(url_for('home'))
     return render_template('contact.html')
 
-# --- Admin Configuration ---
-class SecureModelView(ModelView):
-    """Create a secure model view that requires admin privileges."""
-    def is_accessible(self):
-        return session.get('is_admin') is True
-
-    def inaccessible_callback(self, name, **kwargs):
-        # Redirect non-admin users to the login page
-        return redirect(url_for('login', next=request.url))
-
-# --- Custom Admin View for Products with Image Upload ---
-# Define the path for image uploads relative to the app's root directory
-upload_path = os.path.join(os.path.dirname(__file__), 'static/images')
-# Create the directory if it doesn't exist
-try:
-    os.makedirs(upload_path)
-except OSError:
-    pass
-
-class ProductAdminView(SecureModelView):
-    # Use form_overrides for the class and form_args for constructor arguments
-    # This is the standard and most stable way to configure custom fields.
-    form_overrides = {
-        'image': ImageUploadField
-    }
-    form_args = {
-        'image': {
-            'label': 'Image',
-            'base_path': upload_path,
-            'url_relative_path': 'images/' # Ensures correct URL generation
-        }
-    }
+# --- Application Factory ---
+admin = None  # The Flask-Admin instance, once create_app() has mounted it
+_create_app_lock = threading.Lock()
 
-# Note: Removed 'template_mode' to maintain compatibility with older Flask-Admin versions
-admin = Admin(app, name='Tech Kenya Admin')
-admin.add_view(SecureModelView(User, db.session))
-# Replace the default Product view with our new custom one
-admin.add_view(ProductAdminView(Product, db.session))
-
-# Initialize database on startup
-init_database()
+def create_app():
+    """
+    Finish startup for a serving process and return the app: gunicorn runs
+    'app:create_app()', `flask run` loads it through .flaskenv and
+    `python app.py` calls it.
+
+    This is not a full application factory. There is one app per process,
+    the module-level `app` configured on import, and every call returns that
+    same object. The first call sets up server-side sessions and mounts the
+    admin views (CLI commands only import the module and skip both); later
+    calls just reset the connection pool again, so it is safe to call more
+    than once. Schema and sample data are never changed here; run
+    `flask db upgrade` and `flask setup-db` before starting.
+    """
+    global admin
+    with _create_app_lock:
+        if admin is None:
+            # The sessions table comes from migration 0012; Flask-Session only checks that it exists
+            Session(app)
+            from admin_views import init_admin  # Flask-Admin is only needed when serving
+            admin = init_admin(app, db, User, Product, image_derivatives, sales_rollup)
+    with app.app_context():
+        # A preloading gunicorn master forks workers after this; they must not share its connections
+        db.engine.dispose()
+    return app
 
 if __name__ == '__main__':
+    import webbrowser
+    from threading import Timer
+
+    setup_database()
+    create_app()
+
     # Open the web browser automatically
     def open_browser():
         webbrowser.open_new('http://127.0.0.1:5000/')
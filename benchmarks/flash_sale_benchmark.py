@@ -0,0 +1,222 @@
+"""
+Flash-sale stress test for checkout stock reservation: many buyers check out
+the same hot product at the same moment, then some of their payments fail.
+
+Seeds a throwaway SQLite database (or the database given with --database-url,
+which is WIPED) with --buyers users. Each round adds a hot product holding
+--stock units and puts --quantity of it in every buyer's cart; a barrier then
+releases all checkouts together, through the Flask test client on threads
+and/or a real gunicorn with several workers. Afterwards a charge.failed
+webhook is delivered twice for every other accepted order, and a late
+charge.success for one of those. Payment calls go to the local payment stub.
+
+Exits non-zero unless, in every round:
+- nothing was oversold: stock never goes negative and the units taken equal
+  the units on accepted orders;
+- nobody was turned away while stock remained, and no request errored;
+- each failed payment returned its units exactly once, and the late success
+  took them again.
+
+    python benchmarks/flash_sale_benchmark.py --buyers 200 --stock 50 --mode both
+"""
+import argparse
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from storefront_benchmark import (PAYSTACK_SECRET, HTTPSession, TestClientSession, git_commit,  # noqa: E402
+                                  gunicorn_server, percentile)
+from payment_stub_server import start_stub_server  # noqa: E402
+
+BUYER_PASSWORD = 'flash-password'
+CHECKOUT_FORM = {'phone_number': '0712345678', 'county': 'Nairobi', 'city': 'Nairobi',
+                 'shipping_address': 'Flash Sale St'}
+
+
+def seed_buyers(app_module, count):
+    from werkzeug.security import generate_password_hash
+
+    # One cheap hash shared by every buyer, so logging in does not dominate the setup
+    password_hash = generate_password_hash(BUYER_PASSWORD, method='pbkdf2:sha256:1000')
+    app_module.db.session.execute(app_module.User.__table__.insert(), [
+        {'username': f'flash_buyer_{i}', 'email': f'flash_{i}@example.com', 'password_hash': password_hash,
+         'is_admin': False} for i in range(count)])
+    app_module.db.session.commit()
+
+
+def signed_webhook(session, event, reference):
+    # The event id is fixed per (event, reference), so redeliveries must be dropped by the event log
+    body = json.dumps({'event': event, 'data': {'id': f'{event}-{reference}', 'reference': reference}}).encode()
+    signature = hmac.new(PAYSTACK_SECRET.encode(), body, hashlib.sha512).hexdigest()
+    return session.post('/paystack_webhook', body=body, headers={
+        'Content-Type': 'application/json', 'x-paystack-signature': signature})
+
+
+def wait_for(condition, timeout=60):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.2)
+    return True
+
+
+def run_round(app_module, new_session, args, label):
+    db, Product, Order, OrderItem, Event = (app_module.db, app_module.Product, app_module.Order,
+                                            app_module.OrderItem, app_module.WebhookEvent)
+    with app_module.app.app_context():
+        product = Product(name=f'Flash Sale Deal ({label})', price=4999, image='images/pc.webp',
+                          category='Flash Sale', stock=args.stock)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    sessions = []
+    for i in range(args.buyers):
+        session = new_session()
+        session.post('/login', form={'username': f'flash_buyer_{i}', 'password': BUYER_PASSWORD})
+        session.get(f'/add_to_cart/{product_id}')
+        session.post(f'/update_cart/{product_id}', form={'quantity': str(args.quantity)})
+        sessions.append(session)
+
+    barrier = threading.Barrier(args.buyers)
+
+    def checkout(session):
+        barrier.wait()
+        started = time.perf_counter()
+        status, headers = session.post('/checkout', form=CHECKOUT_FORM)
+        elapsed = time.perf_counter() - started
+        location = headers.get('Location', '') if status == 302 else ''
+        outcome = 'accepted' if '/orders/' in location else 'sold_out' if location.endswith('/cart') else 'error'
+        return elapsed, outcome, location.rsplit('/', 1)[-1]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.buyers) as pool:
+        results = list(pool.map(checkout, sessions))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    references = [reference for _, outcome, reference in results if outcome == 'accepted']
+    counts = {outcome: sum(1 for _, o, _ in results if o == outcome) for outcome in ('accepted', 'sold_out', 'error')}
+
+    def stock_and_ordered(statuses=None):
+        with app_module.app.app_context():
+            stock = db.session.get(Product, product_id).stock
+            query = (db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0))
+                     .join(Order, Order.id == OrderItem.order_id).filter(OrderItem.product_id == product_id))
+            if statuses is not None:
+                query = query.filter(Order.status.in_(statuses))
+            return stock, query.scalar()
+
+    stock_after_sale, ordered = stock_and_ordered()
+    expected_accepted = min(args.buyers, args.stock // args.quantity)
+    checks = {
+        'never_oversold': stock_after_sale >= 0 and args.stock - stock_after_sale == ordered,
+        'accepted_while_stock_lasted': counts['accepted'] == expected_accepted and counts['error'] == 0,
+    }
+
+    # Every other accepted order fails (each failure delivered twice); the first of them is then paid late
+    failing = references[::2]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda reference: signed_webhook(new_session(), 'charge.failed', reference),
+                      failing + failing))
+    if failing:
+        wait_for(lambda: stock_and_ordered(['failed'])[1] == len(failing) * args.quantity)
+        signed_webhook(new_session(), 'charge.success', failing[0])
+
+    def settled():
+        with app_module.app.app_context():
+            return not db.session.query(Event.id).filter(Event.processed_at.is_(None)).first()
+    wait_for(settled)
+    stock_final, still_reserved = stock_and_ordered(['initiating', 'pending', 'success'])
+    returned = (len(failing) - (1 if failing else 0)) * args.quantity
+    checks['failures_restocked_once'] = (stock_final == stock_after_sale + returned
+                                         and args.stock - stock_final == still_reserved)
+
+    return {
+        'buyers': args.buyers, 'stock': args.stock, 'quantity': args.quantity,
+        **counts,
+        'checkouts_per_second': round(args.buyers / wall, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'stock_after_sale': stock_after_sale,
+        'failed_payments': len(failing),
+        'stock_final': stock_final,
+        'checks': checks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--buyers', type=int, default=100, help='Concurrent checkouts of the hot product')
+    parser.add_argument('--stock', type=int, default=40, help='Units of the hot product on sale')
+    parser.add_argument('--quantity', type=int, default=1, help='Units in each buyer\'s cart')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--mode', choices=['testclient', 'gunicorn', 'both'], default='testclient')
+    parser.add_argument('--database-url', help='Database to seed and benchmark (it will be wiped)')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='flash-sale-bench-')
+    stub, stub_url = start_stub_server()
+    os.environ.update({
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'PAYSTACK_BASE_URL': stub_url, 'MPESA_BASE_URL': stub_url, 'PAYSTACK_SECRET_KEY': PAYSTACK_SECRET,
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'metrics'),
+        # Apply webhook batches as soon as they arrive
+        'WEBHOOK_POLL_INTERVAL': '0.2',
+    })
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    os.chdir(workdir)  # Keep any files the app creates out of the repo
+
+    # The app and its background workers log with print(); keep that out of the JSON report
+    with open(os.path.join(workdir, 'app.log'), 'w') as app_log, contextlib.redirect_stdout(app_log):
+        import app as app_module
+
+        with app_module.app.app_context():
+            db = app_module.db
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as connection:
+                app_module.search_backend.create(connection)
+            seed_buyers(app_module, args.buyers)
+            dialect = db.engine.dialect.name
+
+        results = {}
+        if args.mode in ('testclient', 'both'):
+            flask_app = app_module.create_app()
+            results['testclient'] = run_round(app_module, lambda: TestClientSession(flask_app), args, 'testclient')
+        if args.mode in ('gunicorn', 'both'):
+            with gunicorn_server(args.workers, dict(os.environ), workdir) as base_url:
+                results['gunicorn'] = run_round(app_module, lambda: HTTPSession(base_url), args, 'gunicorn')
+    stub.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'database': dialect,
+        'gunicorn': {'workers': args.workers} if 'gunicorn' in results else None,
+        'results': results,
+        'passed': all(all(result['checks'].values()) for result in results.values()),
+        'logs': workdir,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
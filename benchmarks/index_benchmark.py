@@ -0,0 +1,142 @@
+"""
+Measure hot catalog and order queries with and without the secondary indexes
+added in migration 0002_hot_path_indexes.
+
+Seeds a throwaway SQLite database (or the database given with --database-url,
+which is WIPED) with synthetic products, users and orders, runs each query
+with the indexes dropped and again with them created, and prints a JSON report.
+
+    python benchmarks/index_benchmark.py --products 100000 --orders 1000000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+HOT_INDEXES = ['ix_product_category_name', 'ix_product_name',
+               'ix_order_user_id_created_at', 'ix_order_status_created_at']
+CATEGORIES = ['Laptops', 'Desktops', 'Accessories', 'Monitors', 'Keyboards', 'Mice', 'Headphones',
+              'Speakers', 'Webcams', 'Printers', 'Routers', 'SSD', 'USB Drives', 'Cables',
+              'Chargers', 'Bags', 'Stands', 'Graphics Cards', 'RAM', 'Software']
+STATUSES = ['success'] * 80 + ['failed'] * 12 + ['pending'] * 8
+BATCH_SIZE = 10000
+
+
+def seed(app_module, products, users, orders):
+    db, Product, User, Order = app_module.db, app_module.Product, app_module.User, app_module.Order
+    rng = random.Random(42)
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'bench_user_{i}', 'email': f'bench_{i}@example.com',
+         'password_hash': 'x', 'is_admin': False} for i in range(users)])
+    user_ids = [row[0] for row in db.session.query(User.id).all()]
+
+    for start in range(0, products, BATCH_SIZE):
+        db.session.execute(Product.__table__.insert(), [
+            {'name': f'Product {rng.randrange(10 ** 9):09d}', 'price': rng.randrange(500, 300000),
+             'old_price': None, 'rating': round(rng.uniform(3, 5), 1), 'description': 'Spec A,Spec B,Spec C',
+             'image': 'images/pc.webp', 'category': rng.choice(CATEGORIES)}
+            for _ in range(min(BATCH_SIZE, products - start))])
+
+    now = datetime.utcnow()
+    for start in range(0, orders, BATCH_SIZE):
+        db.session.execute(Order.__table__.insert(), [
+            {'user_id': rng.choice(user_ids), 'reference': f'BENCH_{start + i}', 'amount': rng.randrange(500, 300000),
+             'phone_number': '0712345678', 'county': 'Nairobi', 'city': 'Nairobi', 'shipping_address': 'Bench St',
+             'status': rng.choice(STATUSES), 'created_at': now - timedelta(minutes=rng.randrange(525600))}
+            for i in range(min(BATCH_SIZE, orders - start))])
+    db.session.commit()
+    return user_ids
+
+
+def hot_queries(app_module, user_ids):
+    db, Product, Order = app_module.db, app_module.Product, app_module.Order
+    rng = random.Random(7)
+    stale_cutoff = datetime.utcnow() - timedelta(minutes=15)
+    return {
+        'home_category_page': lambda: Product.query.filter_by(category=rng.choice(CATEGORIES))
+            .order_by(Product.name).limit(48).all(),
+        'catalog_by_name_page': lambda: Product.query.order_by(Product.name).limit(48).all(),
+        'user_order_history': lambda: Order.query.filter_by(user_id=rng.choice(user_ids))
+            .order_by(Order.created_at.desc()).all(),
+        'stale_pending_orders': lambda: Order.query.filter(Order.status == 'pending', Order.created_at < stale_cutoff)
+            .order_by(Order.created_at).limit(100).all(),
+        'category_list': lambda: db.session.query(Product.category).distinct().order_by(Product.category).all(),
+    }
+
+
+def measure(queries, db, repeat):
+    results = {}
+    for name, run in queries.items():
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+            db.session.expunge_all()
+        timings.sort()
+        results[name] = {'p50_ms': round(statistics.median(timings), 3),
+                         'p95_ms': round(timings[int(len(timings) * 0.95) - 1], 3)}
+    return results
+
+
+def set_indexes(app_module, present):
+    db = app_module.db
+    tables = [app_module.Product.__table__, app_module.Order.__table__]
+    indexes = [ix for table in tables for ix in table.indexes if ix.name in HOT_INDEXES]
+    with db.engine.begin() as connection:
+        for ix in indexes:
+            if present:
+                ix.create(connection, checkfirst=True)
+            else:
+                ix.drop(connection, checkfirst=True)
+        connection.exec_driver_sql('ANALYZE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--database-url', help='Database to seed and benchmark (it will be wiped)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='index-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)  # Keep any files the app creates out of the repo
+    import app as app_module
+
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        started = time.perf_counter()
+        user_ids = seed(app_module, args.products, args.users, args.orders)
+        seed_seconds = time.perf_counter() - started
+
+        queries = hot_queries(app_module, user_ids)
+        set_indexes(app_module, present=False)
+        before = measure(queries, app_module.db, args.repeat)
+        set_indexes(app_module, present=True)
+        after = measure(queries, app_module.db, args.repeat)
+        dialect = app_module.db.engine.dialect.name
+
+    report = {
+        'database': dialect,
+        'products': args.products, 'orders': args.orders, 'users': args.users,
+        'seed_seconds': round(seed_seconds, 1),
+        'queries': {name: {'without_indexes': before[name], 'with_indexes': after[name],
+                           'p50_speedup': round(before[name]['p50_ms'] / max(after[name]['p50_ms'], 0.001), 1)}
+                    for name in queries},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Measure application startup: module import, create_app() and the first
+request in fresh interpreters, and gunicorn boot with and without preloading
+(time until every worker is ready, and until a worker added at runtime with
+SIGTTIN, as an autoscaler would, is ready). Prints a JSON report.
+
+Uses a throwaway SQLite database set up once beforehand, so schema and seed
+work (now `flask setup-db`) is not part of any timing.
+
+    python benchmarks/startup_benchmark.py --repeat 10 --workers 4
+
+To compare with a build that predates create_app(), check it out and pass
+--wsgi-app app:app.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter per sample
+IMPORT_PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {repo!r})
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+factory = getattr(app, 'create_app', None)
+flask_app = factory() if factory else app.app
+created = time.perf_counter()
+status = flask_app.test_client().get('/').status_code
+served = time.perf_counter()
+print(json.dumps({{
+    'import_seconds': imported - started,
+    'create_app_seconds': created - imported,
+    'first_request_seconds': served - created,
+    'first_request_status': status,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+# Wraps the repo's gunicorn.conf.py and records when each worker finishes booting
+GUNICORN_CONFIG = """
+exec(open({config!r}).read())
+
+def post_worker_init(worker):
+    import os, time
+    with open(os.path.join({markers!r}, str(worker.pid)), 'w') as f:
+        f.write(repr(time.time()))
+"""
+
+
+def median(samples, key):
+    return round(statistics.median(sample[key] for sample in samples), 4)
+
+
+def measure_import(env, workdir, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE.format(repo=REPO_DIR)],
+                                         env=env, cwd=workdir, text=True, stderr=subprocess.DEVNULL)
+        sample = json.loads(output.strip().splitlines()[-1])
+        sample['process_seconds'] = time.perf_counter() - started
+        samples.append(sample)
+    keys = ['process_seconds', 'import_seconds', 'create_app_seconds', 'first_request_seconds', 'max_rss_mb']
+    return {key: median(samples, key) for key in keys}
+
+
+def wait_for(predicate, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise RuntimeError('Timed out waiting for gunicorn')
+        time.sleep(0.01)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_gunicorn(env, workdir, workers, preload, wsgi_app):
+    import requests
+
+    markers = tempfile.mkdtemp(dir=workdir, prefix='workers-')
+    config = os.path.join(workdir, 'gunicorn_bench.conf.py')
+    with open(config, 'w') as f:
+        f.write(GUNICORN_CONFIG.format(config=os.path.join(REPO_DIR, 'gunicorn.conf.py'), markers=markers))
+    port = free_port()
+    env = dict(env, GUNICORN_PRELOAD='true' if preload else 'false')
+    log = open(os.path.join(workdir, f"gunicorn-{'preload' if preload else 'no-preload'}.log"), 'w')
+
+    started = time.time()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', config, '--chdir', REPO_DIR, '-w', str(workers),
+         '-b', f'127.0.0.1:{port}', wsgi_app], env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        def ready_times():
+            times = []
+            for name in os.listdir(markers):
+                with open(os.path.join(markers, name)) as f:
+                    content = f.read()
+                if content:
+                    times.append(float(content))
+            return times
+
+        def responds():
+            try:
+                return requests.get(f'http://127.0.0.1:{port}/', timeout=5).status_code < 500
+            except requests.exceptions.RequestException:
+                return False
+
+        wait_for(lambda: len(ready_times()) >= workers)
+        all_ready = max(ready_times()) - started
+        wait_for(responds)
+        first_response = time.time() - started
+
+        # Add one worker at runtime, the way an autoscaler grows a gunicorn pool
+        added = time.time()
+        os.kill(process.pid, signal.SIGTTIN)
+        wait_for(lambda: len(ready_times()) > workers)
+        added_worker = max(ready_times()) - added
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        log.close()
+    return {'all_workers_ready_seconds': round(all_ready, 3), 'first_response_seconds': round(first_response, 3),
+            'added_worker_ready_seconds': round(added_worker, 3)}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per import measurement')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--wsgi-app', default='app:create_app()')
+    parser.add_argument('--skip-gunicorn', action='store_true')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='startup-bench-')
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'))
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+    # Schema and sample data are created up front so they are never part of a timing
+    subprocess.check_call(
+        [sys.executable, '-c', f"import sys; sys.path.insert(0, {REPO_DIR!r}); import app; "
+                               f"getattr(app, 'setup_database', getattr(app, 'init_database', None))()"],
+        env=env, cwd=workdir, stdout=subprocess.DEVNULL)
+
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'import': measure_import(env, workdir, args.repeat),
+    }
+    if not args.skip_gunicorn:
+        report['gunicorn'] = {
+            'workers': args.workers,
+            'preload': measure_gunicorn(env, workdir, args.workers, True, args.wsgi_app),
+            'no_preload': measure_gunicorn(env, workdir, args.workers, False, args.wsgi_app),
+        }
+    report['logs'] = workdir
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,309 @@
+"""
+Load-test the storefront hot paths and report latency, throughput and
+queries per request as JSON, so runs can be compared between commits.
+
+Seeds a throwaway SQLite database (or the database given with --database-url,
+which is WIPED) with a synthetic catalog, users and orders through the app's
+models. It then drives each scenario through the Flask test client
+(in-process, no network) and/or a real gunicorn instance. Checkout and
+payment calls go to the local payment stub, so no real API is contacted.
+
+    python benchmarks/storefront_benchmark.py --products 100000 --mode both --output before.json
+
+Queries per request come from the Server-Timing header the app adds to every
+response.
+"""
+import argparse
+import contextlib
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from index_benchmark import CATEGORIES, seed  # noqa: E402
+from payment_stub_server import start_stub_server  # noqa: E402
+
+BENCH_USER = ('bench_shopper', 'bench-password')
+PAYSTACK_SECRET = 'sk_bench'
+SEARCH_TERMS = ['product', 'product 1', 'laptop', 'spec', 'router', 'ssd']
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+class Scenario:
+    """One hot path: `setup` runs once per session, `prepare` before each request (both untimed)."""
+
+    def __init__(self, request, setup=None, prepare=None):
+        self.request = request
+        self.setup = setup
+        self.prepare = prepare
+
+
+def login(client, data):
+    client.post('/login', form={'username': BENCH_USER[0], 'password': BENCH_USER[1]})
+
+
+def build_scenarios(data):
+    rng = random.Random(11)
+    product_ids, references = data['product_ids'], data['references']
+    webhook_ids = itertools.count(1)
+
+    def signed_webhook(client, i):
+        body = json.dumps({'event': 'charge.success', 'data': {
+            'id': f'{os.getpid()}-{threading.get_ident()}-{next(webhook_ids)}',
+            'reference': rng.choice(references)}}).encode()
+        signature = hmac.new(PAYSTACK_SECRET.encode(), body, hashlib.sha512).hexdigest()
+        return client.post('/paystack_webhook', body=body, headers={
+            'Content-Type': 'application/json', 'x-paystack-signature': signature})
+
+    def fill_cart(client, data):
+        for product_id in rng.sample(product_ids, 3):
+            client.get(f'/add_to_cart/{product_id}')
+
+    def remember_etag(client, data):
+        client.etag = client.get('/')[1].get('ETag')
+
+    return {
+        'home': Scenario(lambda c, i: c.get('/')),
+        'home_category': Scenario(lambda c, i: c.get(f'/?category={quote(rng.choice(CATEGORIES))}')),
+        'search': Scenario(lambda c, i: c.get(f'/?q={quote(rng.choice(SEARCH_TERMS))}')),
+        'search_suggest': Scenario(lambda c, i: c.get(f'/api/search/suggest?q={quote(rng.choice(SEARCH_TERMS)[:4])}')),
+        'product_detail': Scenario(lambda c, i: c.get(f'/product/{rng.choice(product_ids)}')),
+        'cart_add': Scenario(lambda c, i: c.get(f'/add_to_cart/{rng.choice(product_ids)}')),
+        'home_revalidate': Scenario(lambda c, i: c.get('/', headers={'If-None-Match': c.etag}), setup=remember_etag),
+        'cart_view': Scenario(lambda c, i: c.get('/cart'), setup=fill_cart),
+        'cart_dropdown': Scenario(lambda c, i: c.get('/api/cart'), setup=fill_cart),
+        'cart_update': Scenario(
+            lambda c, i: c.post(f'/update_cart/{c.cart_product}', form={'quantity': str(i % 5 + 1)}),
+            setup=lambda c, d: (c.get(f'/add_to_cart/{product_ids[0]}'), setattr(c, 'cart_product', product_ids[0]))),
+        'checkout': Scenario(
+            lambda c, i: c.post('/checkout', form={'phone_number': '0712345678', 'county': 'Nairobi',
+                                                   'city': 'Nairobi', 'shipping_address': 'Bench St'}),
+            setup=login, prepare=lambda c, i: c.get(f'/add_to_cart/{rng.choice(product_ids)}')),
+        'paystack_webhook': Scenario(signed_webhook),
+    }
+
+
+class TestClientSession:
+    """Flask test client with the same small interface as HTTPSession."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path, headers=None):
+        response = self.client.get(path, headers=headers)
+        return response.status_code, response.headers
+
+    def post(self, path, form=None, body=None, headers=None):
+        response = self.client.post(path, data=body if body is not None else form, headers=headers)
+        return response.status_code, response.headers
+
+
+class HTTPSession:
+    """A keep-alive requests session against a running server; redirects are not followed."""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.session = requests.Session()
+
+    def get(self, path, headers=None):
+        response = self.session.get(self.base_url + path, headers=headers, allow_redirects=False)
+        return response.status_code, response.headers
+
+    def post(self, path, form=None, body=None, headers=None):
+        response = self.session.post(self.base_url + path, data=body if body is not None else form,
+                                     headers=headers, allow_redirects=False)
+        return response.status_code, response.headers
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(new_session, scenario, data, requests_total, concurrency):
+    sessions = []
+    for _ in range(concurrency):
+        session = new_session()
+        if scenario.setup:
+            scenario.setup(session, data)
+        sessions.append(session)
+
+    def drive(session, count):
+        samples, busy = [], 0.0
+        for i in range(count):
+            if scenario.prepare:
+                scenario.prepare(session, i)
+            started = time.perf_counter()
+            status, headers = scenario.request(session, i)
+            elapsed = time.perf_counter() - started
+            busy += elapsed
+            match = QUERIES_RE.search(headers.get('Server-Timing', ''))
+            samples.append((elapsed, status, int(match.group(1)) if match else None))
+        return samples, busy
+
+    counts = [requests_total // concurrency + (1 if n < requests_total % concurrency else 0)
+              for n in range(concurrency)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(drive, sessions, counts))
+
+    samples = [sample for thread_samples, _ in results for sample in thread_samples]
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    queries = [q for _, _, q in samples if q is not None]
+    # Throughput over the time sessions spent in timed requests (untimed prepare steps excluded)
+    busiest = max(busy for _, busy in results)
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for _, status, _ in samples if status >= 500),
+        'requests_per_second': round(len(samples) / busiest, 1) if busiest else None,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'queries_per_request': round(statistics.mean(queries), 2) if queries else None,
+    }
+
+
+def run_all(new_session, data, args, concurrency):
+    scenarios = build_scenarios(data)
+    selected = args.scenarios.split(',') if args.scenarios else list(scenarios)
+    results = {}
+    for name in selected:
+        # Warm caches and connection pools before measuring
+        run_scenario(new_session, scenarios[name], data, min(args.warmup, args.requests), 1)
+        results[name] = run_scenario(new_session, scenarios[name], data, args.requests, concurrency)
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def gunicorn_server(workers, env, workdir):
+    port = free_port()
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'), '--chdir', REPO_DIR,
+         '-w', str(workers), '-b', f'127.0.0.1:{port}', 'app:create_app()'],
+        env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        import requests
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                requests.get(base_url + '/metrics', timeout=5)
+                break
+            except requests.exceptions.RequestException:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"gunicorn did not start; see {log.name}")
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+        log.close()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=300, help='Measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads against gunicorn')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--mode', choices=['testclient', 'gunicorn', 'both'], default='testclient')
+    parser.add_argument('--scenarios', help='Comma-separated subset, e.g. home,search,checkout')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='Simulated payment API latency (s)')
+    parser.add_argument('--database-url', help='Database to seed and benchmark (it will be wiped)')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='storefront-bench-')
+    stub, stub_url = start_stub_server(latency=args.stub_latency)
+    os.environ.update({
+        'DATABASE_URL': args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'PAYSTACK_BASE_URL': stub_url, 'MPESA_BASE_URL': stub_url, 'PAYSTACK_SECRET_KEY': PAYSTACK_SECRET,
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'metrics'),
+    })
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    os.chdir(workdir)  # Keep any files the app creates out of the repo
+
+    # The app and its background workers log with print(); keep that out of the JSON report
+    with open(os.path.join(workdir, 'app.log'), 'w') as app_log, contextlib.redirect_stdout(app_log):
+        import app as app_module
+        from werkzeug.security import generate_password_hash
+
+        with app_module.app.app_context():
+            db = app_module.db
+            db.drop_all()
+            db.create_all()
+            started = time.perf_counter()
+            seed(app_module, args.products, args.users, args.orders)
+            db.session.add(app_module.User(username=BENCH_USER[0], email='bench_shopper@example.com',
+                                           password_hash=generate_password_hash(BENCH_USER[1])))
+            db.session.commit()
+            with db.engine.begin() as connection:
+                app_module.search_backend.create(connection)
+                app_module.search_backend.rebuild(connection)
+            seed_seconds = time.perf_counter() - started
+            data = {
+                'product_ids': [row[0] for row in db.session.query(app_module.Product.id).all()],
+                'references': [row[0] for row in db.session.query(app_module.Order.reference).limit(10000).all()],
+            }
+            dialect = db.engine.dialect.name
+
+        results = {}
+        if args.mode in ('testclient', 'both'):
+            flask_app = app_module.create_app()
+            results['testclient'] = run_all(lambda: TestClientSession(flask_app), data, args, concurrency=1)
+        if args.mode in ('gunicorn', 'both'):
+            with gunicorn_server(args.workers, dict(os.environ), workdir) as base_url:
+                results['gunicorn'] = run_all(lambda: HTTPSession(base_url), data, args, args.concurrency)
+    stub.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'database': dialect,
+        'products': args.products, 'users': args.users, 'orders': args.orders,
+        'requests_per_scenario': args.requests,
+        'gunicorn': {'workers': args.workers, 'concurrency': args.concurrency} if 'gunicorn' in results else None,
+        'seed_seconds': round(seed_seconds, 1),
+        'results': results,
+        'logs': workdir,
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
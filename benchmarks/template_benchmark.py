@@ -0,0 +1,110 @@
+"""
+Measure how long home.html takes to render a large product grid with the
+{% cache %} fragment cache disabled, cold (every fragment rendered and
+stored) and warm (every fragment served from the cache).
+
+Seeds a throwaway SQLite database (or the database given with --database-url,
+which is WIPED) with one category of synthetic products, loads them once and
+renders the same page repeatedly, so only template work is timed.
+
+    python benchmarks/template_benchmark.py --products 500
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORY = 'Laptops'
+SPECS = [['Intel Core i5', 'Intel Core i7', 'AMD Ryzen 7', 'Apple M2 Chip'],
+         ['8GB RAM', '16GB RAM', '32GB RAM'],
+         ['256GB SSD', '512GB SSD', '1TB SSD'],
+         ['14" FHD Display', '15.6" FHD Display', 'Backlit Keyboard']]
+
+
+def catalog_rows(count):
+    rng = random.Random(5)
+    for i in range(count):
+        price = rng.randrange(30000, 300000)
+        yield {'name': f'Bench Laptop {i:05d}', 'price': price, 'old_price': price * 1.15 if i % 3 == 0 else None,
+               'rating': round(rng.uniform(3, 5), 1), 'description': [rng.choice(options) for options in SPECS],
+               'image': 'images/pc.webp', 'category': CATEGORY}
+
+
+def timed(render, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {'p50_ms': round(statistics.median(samples), 2), 'p95_ms': round(samples[int(len(samples) * 0.95)], 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--products', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--database-url', help='Database to seed and benchmark (it will be wiped)')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='template-bench-')
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.chdir(workdir)  # Keep any files the app creates out of the repo
+    with open(os.path.join(workdir, 'app.log'), 'w') as app_log, contextlib.redirect_stdout(app_log):
+        import app as app_module
+        from catalog_io import normalize_row
+        from fragment_cache import FragmentCache
+        from flask import render_template
+
+        flask_app = app_module.create_app()
+        with flask_app.app_context():
+            db = app_module.db
+            db.drop_all()
+            db.create_all()
+            with db.engine.begin() as connection:
+                app_module.search_backend.create(connection)
+            app_module.import_products(normalize_row(row, i) for i, row in enumerate(catalog_rows(args.products), 1))
+
+        with flask_app.test_request_context(f'/?category={CATEGORY}'):
+            products = app_module.Product.query.order_by(app_module.Product.name).all()
+            environment = flask_app.jinja_env
+            fragment_cache = environment.fragment_cache
+
+            def render():
+                return render_template('home.html', carousel_products=products[:3], categories=[CATEGORY],
+                                       categorized_products={CATEGORY: products}, selected_category=CATEGORY,
+                                       search_query=None, next_cursors={}, facets={}, selected_facets={},
+                                       facet_args=[])
+
+            environment.fragment_cache = None
+            uncached_html = render()
+            uncached = timed(render, args.repeat)
+
+            cold_samples = []
+            for _ in range(args.repeat):
+                environment.fragment_cache = FragmentCache(fragment_cache.version, maxsize=args.products * 2)
+                cold_samples.append(timed(render, 1)['p50_ms'])
+            warm = timed(render, args.repeat)
+            if render() != uncached_html:
+                raise SystemExit('Cached render differs from the uncached one')
+            environment.fragment_cache = fragment_cache
+
+    report = {
+        'products': args.products,
+        'uncached': uncached,
+        'cold': {'p50_ms': round(statistics.median(cold_samples), 2)},
+        'warm': warm,
+        'warm_speedup': round(uncached['p50_ms'] / max(warm['p50_ms'], 0.001), 1),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import case
+
+# Carts untouched for this many seconds expire
+CART_TTL = int(os.environ.get('CART_TTL', 30 * 24 * 3600))
+CART_SWEEP_INTERVAL = int(os.environ.get('CART_SWEEP_INTERVAL', 3600))
+# e.g. redis://localhost:6379/1 to keep carts in Redis instead of the database
+CART_STORE_URL = os.environ.get('CART_STORE_URL')
+
+
+class SQLCartStore:
+    """
+    Cart storage in the application database, one row per (cart, product).
+
+    Every mutation is a single atomic statement: adding uses
+    INSERT ... ON CONFLICT DO UPDATE (SQLite and PostgreSQL), so concurrent
+    requests on the same cart never lose an increment. Rows not touched within
+    the TTL are deleted by sweep(); until then they count as absent, so a
+    write never revives an expired quantity.
+    """
+    name = 'sql'
+
+    def __init__(self, db, model, ttl=CART_TTL):
+        self.db = db
+        self.model = model
+        self.ttl = ttl
+
+    def _cutoff(self):
+        """Lines last updated at or before this have expired."""
+        return datetime.utcnow() - timedelta(seconds=self.ttl)
+
+    def get(self, cart_id):
+        """Return the cart as {product_id: quantity}."""
+        CartItem = self.model
+        rows = self.db.session.query(CartItem.product_id, CartItem.quantity).filter(
+            CartItem.cart_id == cart_id,
+            CartItem.updated_at > self._cutoff()
+        ).all()
+        return {product_id: quantity for product_id, quantity in rows}
+
+    def add(self, cart_id, product_id, quantity=1):
+        """Add `quantity` of a product to the cart."""
+        table = self.model.__table__
+        values = {'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity,
+                  'updated_at': datetime.utcnow()}
+        dialect = self.db.engine.dialect.name
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            # No portable upsert: update first, insert if the line does not exist yet
+            if not self._update(cart_id, product_id, self._added(quantity)):
+                self.db.session.execute(table.insert().values(**values))
+            self.db.session.commit()
+            return
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.cart_id, table.c.product_id],
+            set_={'quantity': self._added(stmt.excluded.quantity),
+                  'updated_at': stmt.excluded.updated_at}
+        )
+        self.db.session.execute(stmt)
+        self.db.session.commit()
+
+    def set(self, cart_id, product_id, quantity):
+        """Set the quantity of a product already in the cart. Returns False if it was not in the cart."""
+        updated = self._update(cart_id, product_id, quantity, live_only=True)
+        self.db.session.commit()
+        return updated
+
+    def remove(self, cart_id, product_id):
+        """Remove a product from the cart. Returns False if it was not in the cart."""
+        table = self.model.__table__
+        result = self.db.session.execute(table.delete().where(
+            table.c.cart_id == cart_id, table.c.product_id == product_id))
+        self.db.session.commit()
+        return result.rowcount > 0
+
+    def clear(self, cart_id):
+        table = self.model.__table__
+        self.db.session.execute(table.delete().where(table.c.cart_id == cart_id))
+        self.db.session.commit()
+
+    def sweep(self):
+        """Delete expired cart lines. Returns the number of rows removed."""
+        table = self.model.__table__
+        result = self.db.session.execute(table.delete().where(table.c.updated_at <= self._cutoff()))
+        self.db.session.commit()
+        return result.rowcount
+
+    def _added(self, quantity):
+        """The new quantity of a line `quantity` is added to: an expired line starts again from nothing."""
+        table = self.model.__table__
+        return case((table.c.updated_at <= self._cutoff(), quantity), else_=table.c.quantity + quantity)
+
+    def _update(self, cart_id, product_id, quantity, live_only=False):
+        table = self.model.__table__
+        stmt = table.update().where(table.c.cart_id == cart_id, table.c.product_id == product_id)
+        if live_only:
+            stmt = stmt.where(table.c.updated_at > self._cutoff())
+        result = self.db.session.execute(stmt.values(quantity=quantity, updated_at=datetime.utcnow()))
+        return result.rowcount > 0
+
+
+class RedisCartStore:
+    """
+    Cart storage in a Redis hash per cart (field = product id). HINCRBY makes
+    adds atomic, and every mutation refreshes the key's TTL, so Redis expires
+    abandoned carts by itself.
+    """
+    name = 'redis'
+
+    def __init__(self, client, ttl=CART_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def _key(self, cart_id):
+        return f'cart:{cart_id}'
+
+    def get(self, cart_id):
+        return {int(pid): int(qty) for pid, qty in self.client.hgetall(self._key(cart_id)).items()}
+
+    def add(self, cart_id, product_id, quantity=1):
+        key = self._key(cart_id)
+        pipe = self.client.pipeline()
+        pipe.hincrby(key, product_id, quantity)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def set(self, cart_id, product_id, quantity):
+        key = self._key(cart_id)
+        if not self.client.hexists(key, product_id):
+            return False
+        pipe = self.client.pipeline()
+        pipe.hset(key, product_id, quantity)
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        return True
+
+    def remove(self, cart_id, product_id):
+        return self.client.hdel(self._key(cart_id), product_id) > 0
+
+    def clear(self, cart_id):
+        self.client.delete(self._key(cart_id))
+
+    def sweep(self):
+        return 0  # Redis expires carts through key TTLs
+
+
+class CartSweeper:
+    """
+    Background thread that periodically deletes expired carts. Started lazily
+    in each process that serves requests, so forked workers each run one.
+    """
+
+    def __init__(self, app, store, interval=CART_SWEEP_INTERVAL):
+        self.app = app
+        self.store = store
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='cart-sweeper', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    removed = self.store.sweep()
+                if removed:
+                    print(f"Cart sweeper removed {removed} expired cart lines")
+            except Exception as e:
+                print(f"Cart sweep failed: {e}")
+
+
+def create_cart_store(db, model, url=CART_STORE_URL, client=None):
+    """Redis-backed when a client or redis:// URL is given (redis is optional), otherwise SQL."""
+    if client is None and url:
+        import redis  # Optional dependency, only needed for Redis carts
+        client = redis.Redis.from_url(url, decode_responses=True)
+    if client is not None:
+        return RedisCartStore(client)
+    return SQLCartStore(db, model)
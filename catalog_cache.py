@@ -0,0 +1,226 @@
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session, object_session
+
+# e.g. redis://localhost:6379/0 to share the cache and catalog version across workers
+CATALOG_CACHE_URL = os.environ.get('CATALOG_CACHE_URL')
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', 1024))
+
+_MISSING = object()
+
+
+class LRUCacheBackend:
+    """
+    In-process LRU cache with per-entry TTL.
+
+    Its own version lives in process memory, so on its own other workers only
+    see a change once their entries expire (CATALOG_CACHE_TTL); the app pairs
+    it with SQLCatalogVersion so every worker sees a bump on its next request.
+    """
+    name = 'lru'
+    shared = False
+
+    def __init__(self, maxsize=CATALOG_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_version(self):
+        return self._version
+
+    def bump_version(self):
+        with self._lock:
+            self._version += 1
+            # Entries under the old version can never be read again
+            self._data.clear()
+            return self._version
+
+
+class RedisCacheBackend:
+    """
+    Cache backend for any Redis-protocol client (redis-py, fakeredis, ...).
+
+    The catalog version is a shared counter, so a bump from one worker is seen
+    by every worker on its next request.
+    """
+    name = 'redis'
+    shared = True
+    VERSION_KEY = 'catalog:version'
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return _MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), ex=ttl)
+
+    def get_version(self):
+        return int(self.client.get(self.VERSION_KEY) or 1)
+
+    def bump_version(self):
+        return int(self.client.incr(self.VERSION_KEY))
+
+
+class SQLCatalogVersion:
+    """
+    The catalog version as a counter row (id=1) in the application database,
+    for deployments without Redis: every worker reads it once per request, so
+    a bump from one worker or host is seen by all of them on their next
+    request. Bumps made by watched model changes run in the transaction that
+    changed the catalog, so the new version becomes visible with the data.
+    """
+    shared = True
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get(self):
+        return self.db.session.scalar(select(self.model.version).where(self.model.id == 1)) or 1
+
+    def bump(self, connection=None):
+        """Increment the version, in `connection`'s transaction if given. Returns the new version."""
+        if connection is None:
+            with self.db.engine.begin() as connection:
+                return self.bump(connection)
+        model = self.model
+        version = connection.scalar(update(model).where(model.id == 1).values(version=model.version + 1)
+                                    .returning(model.version))
+        if version is None:
+            # Databases bootstrapped with create_all() start without the row
+            version = 2
+            connection.execute(model.__table__.insert().values(id=1, version=version))
+        return version
+
+
+class CatalogCache:
+    """
+    Read-through cache for catalog queries, keyed on the catalog version.
+
+    Every key is namespaced with the current version, so bumping the version
+    (done automatically when a commit touches a product) invalidates all
+    cached catalog reads at once. The version comes from `versions` (a
+    SQLCatalogVersion) when given, otherwise from the backend.
+    """
+
+    def __init__(self, backend, ttl=CATALOG_CACHE_TTL, versions=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.versions = versions
+        self._last_read = (None, float('-inf'))
+
+    @property
+    def shared(self):
+        """Whether every worker reads the same version."""
+        return self.versions is not None or self.backend.shared
+
+    def version(self, max_age=0):
+        """
+        The current catalog version. With `max_age`, a version this process
+        read less than `max_age` seconds ago is returned without a round trip.
+        """
+        if max_age:
+            version, read_at = self._last_read
+            if time.monotonic() - read_at < max_age:
+                return version
+        version = self.versions.get() if self.versions is not None else self.backend.get_version()
+        self._last_read = (version, time.monotonic())
+        return version
+
+    def bump(self):
+        if self.versions is not None:
+            return self.versions.bump()
+        return self.backend.bump_version()
+
+    def validator(self, version=None):
+        """
+        The catalog version for HTTP validators. A shared version (database
+        or Redis) is the same in every worker, so all of them issue the same
+        ETag for a page. A purely in-process one is not, so it is paired with
+        a TTL-sized time bucket and a worker that missed another's bump stops
+        confirming old pages within one TTL, as with its cached reads.
+        """
+        if version is None:
+            version = self.version()
+        if self.shared:
+            return str(version)
+        return f'{version}.{int(time.time() // self.ttl)}'
+
+    def get_or_set(self, key, loader, version=None):
+        """Return the cached value for key, calling loader() to fill it on a miss."""
+        if version is None:
+            version = self.version()
+        full_key = f'catalog:{version}:{key}'
+        value = self.backend.get(full_key)
+        if value is _MISSING:
+            value = loader()
+            self.backend.set(full_key, value, self.ttl)
+        return value
+
+    def watch(self, model):
+        """
+        Bump the catalog version whenever a commit inserts, updates or deletes
+        a `model` row: in the same transaction with a SQLCatalogVersion,
+        otherwise right after the commit.
+        """
+        def mark_changed(mapper, connection, target):
+            session = object_session(target)
+            if session is not None:
+                session.info['catalog_changed'] = True
+
+        def after_flush(session, flush_context):
+            if session.info.pop('catalog_changed', False):
+                self.versions.bump(session.connection())
+
+        def after_commit(session):
+            if session.info.pop('catalog_changed', False):
+                self.bump()
+
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, mark_changed)
+        if self.versions is not None:
+            event.listen(Session, 'after_flush', after_flush)
+        else:
+            event.listen(Session, 'after_commit', after_commit)
+
+
+def create_catalog_cache(url=CATALOG_CACHE_URL, client=None, versions=None):
+    """
+    Build the catalog cache: Redis-backed when a client or redis:// URL is
+    given (redis is an optional dependency), otherwise an in-process LRU
+    whose version comes from `versions` (a SQLCatalogVersion), if given.
+    """
+    if client is None and url:
+        import redis  # Optional dependency, only needed for a shared cache
+        client = redis.Redis.from_url(url)
+    if client is not None:
+        return CatalogCache(RedisCacheBackend(client))
+    return CatalogCache(LRUCacheBackend(), versions=versions)
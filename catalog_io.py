@@ -0,0 +1,242 @@
+import csv
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from itertools import islice
+
+from sqlalchemy import delete, insert, select, text
+
+from product_attributes import attribute_rows, split_description
+
+CATALOG_FIELDS = ('id', 'name', 'price', 'old_price', 'rating', 'description', 'image', 'category', 'stock',
+                  'attributes')
+CATALOG_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+# Rows per upsert transaction (and per fetch when exporting)
+CATALOG_BATCH_SIZE = int(os.environ.get('CATALOG_BATCH_SIZE', 1000))
+
+
+class CatalogFormatError(ValueError):
+    """A catalog file or row that cannot be imported."""
+
+
+def detect_format(path, fmt=None):
+    """The explicit format, or the one implied by the file extension."""
+    if fmt:
+        return fmt
+    fmt = CATALOG_FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt is None:
+        raise CatalogFormatError(f"Cannot tell the format of {path!r}; pass --format csv or jsonl.")
+    return fmt
+
+
+@contextmanager
+def open_catalog(path, mode='r'):
+    """Open a catalog file for streaming, with '-' meaning stdin/stdout."""
+    if path == '-':
+        yield sys.stdin if mode == 'r' else sys.stdout
+    else:
+        # newline='' lets the csv module handle quoted line breaks; JSONL is unaffected
+        with open(path, mode, encoding='utf-8', newline='') as f:
+            yield f
+
+
+def _number(value, cast, field, line, required=False):
+    if value is None or value == '':
+        if required:
+            raise CatalogFormatError(f"Line {line}: '{field}' is required.")
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        raise CatalogFormatError(f"Line {line}: '{field}' must be a number, got {value!r}.")
+
+
+def normalize_row(row, line):
+    """Validate one catalog row and convert it to a product mapping."""
+    mapping = {
+        'id': _number(row.get('id'), int, 'id', line),
+        'price': _number(row.get('price'), float, 'price', line, required=True),
+        'old_price': _number(row.get('old_price'), float, 'old_price', line),
+        'rating': _number(row.get('rating'), float, 'rating', line),
+    }
+    # Files without a stock column leave existing stock levels alone; an empty value means untracked
+    if 'stock' in row:
+        mapping['stock'] = _number(row['stock'], int, 'stock', line)
+        if mapping['stock'] is not None and mapping['stock'] < 0:
+            raise CatalogFormatError(f"Line {line}: 'stock' cannot be negative.")
+    for field in ('name', 'image', 'category'):
+        value = (row.get(field) or '').strip()
+        if not value:
+            raise CatalogFormatError(f"Line {line}: '{field}' is required.")
+        mapping[field] = value
+    # Specs come as 'attributes' ([{"name", "value"}]; JSON text in CSV) or, in older files, as a
+    # description list or comma-joined string, in which case the facet names are inferred
+    description = row.get('description') or ''
+    attributes = row.get('attributes') or None
+    if isinstance(attributes, str):
+        try:
+            attributes = json.loads(attributes)
+        except ValueError:
+            raise CatalogFormatError(f"Line {line}: 'attributes' must be a JSON list.")
+    if attributes is not None and not isinstance(attributes, list):
+        raise CatalogFormatError(f"Line {line}: 'attributes' must be a list.")
+    if attributes is None:
+        attributes = description if isinstance(description, list) else split_description(description)
+    mapping['attributes'] = attribute_rows(attributes)
+    if isinstance(description, list) or not description:
+        description = ', '.join(attribute['value'] for attribute in mapping['attributes'])
+    mapping['description'] = description
+    if mapping['id'] is None:
+        del mapping['id']
+    return mapping
+
+
+def read_catalog(stream, fmt):
+    """Yield validated product mappings from a CSV or JSONL stream, one row at a time."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield normalize_row(row, reader.line_num)
+    elif fmt == 'jsonl':
+        for line, content in enumerate(stream, 1):
+            if not content.strip():
+                continue
+            try:
+                row = json.loads(content)
+            except ValueError as e:
+                raise CatalogFormatError(f"Line {line}: invalid JSON ({e}).")
+            yield normalize_row(row, line)
+    else:
+        raise CatalogFormatError(f"Unknown catalog format {fmt!r}.")
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_catalog(db, model, attribute_model, rows, batch_size=CATALOG_BATCH_SIZE, replace=False):
+    """
+    Upsert product mappings in batches of `batch_size`, one transaction each.
+    Rows are matched on `id` when they have one, otherwise on `name`; matches
+    are updated and the rest inserted, with one lookup query per batch, and
+    each product's attribute rows are replaced. With `replace`, every existing
+    product is deleted first.
+
+    Bulk writes bypass ORM events, so the caller must refresh anything kept in
+    sync by Product hooks. Returns counts and throughput.
+    """
+    started = time.perf_counter()
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'batches': 0}
+    if replace:
+        # Explicitly, since SQLite does not enforce the ON DELETE CASCADE by default
+        db.session.query(attribute_model).delete()
+        db.session.query(model).delete()
+        db.session.commit()
+
+    explicit_ids = False
+    for batch in _batches(rows, batch_size):
+        ids = [row['id'] for row in batch if 'id' in row]
+        names = [row['name'] for row in batch if 'id' not in row]
+        existing_ids = set()
+        if ids:
+            existing_ids = {id_ for id_, in db.session.query(model.id).filter(model.id.in_(ids))}
+        ids_by_name = {}
+        if names:
+            for id_, name in (db.session.query(model.id, model.name).filter(model.name.in_(names))
+                              .order_by(model.id.desc())):
+                ids_by_name[name] = id_  # Descending, so duplicated names match their oldest product
+
+        # Later rows for the same product win over earlier ones in the batch
+        updates, inserts = {}, {}
+        for row in batch:
+            if 'id' in row:
+                explicit_ids = True
+                target = updates if row['id'] in existing_ids else inserts
+                target[row['id']] = row
+            elif row['name'] in ids_by_name:
+                updates[ids_by_name[row['name']]] = dict(row, id=ids_by_name[row['name']])
+            else:
+                inserts[('name', row['name'])] = row
+        attributes = []
+        if updates:
+            db.session.bulk_update_mappings(model, [_without_attributes(row) for row in updates.values()])
+            db.session.execute(delete(attribute_model).where(attribute_model.product_id.in_(list(updates))))
+            for product_id, row in updates.items():
+                attributes += [dict(attribute, product_id=product_id) for attribute in row['attributes']]
+        # Rows with and without their own id (or stock) are inserted separately, as executemany needs uniform keys
+        groups = {}
+        for row in inserts.values():
+            groups.setdefault(frozenset(row), []).append(row)
+        for group in groups.values():
+            # RETURNING in parameter order gives the new ids for the attribute rows in the same round trip
+            new_ids = db.session.scalars(
+                insert(model).returning(model.id, sort_by_parameter_order=True),
+                [_without_attributes(row) for row in group]).all()
+            for product_id, row in zip(new_ids, group):
+                attributes += [dict(attribute, product_id=product_id) for attribute in row['attributes']]
+        if attributes:
+            db.session.execute(insert(attribute_model), attributes)
+        db.session.commit()
+        stats['rows'] += len(batch)
+        stats['updated'] += len(updates)
+        stats['inserted'] += len(inserts)
+        stats['batches'] += 1
+
+    if explicit_ids and db.engine.dialect.name == 'postgresql':
+        # Rows inserted with their own ids do not advance the serial sequence
+        table = model.__table__.name
+        db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                f"COALESCE((SELECT MAX(id) FROM \"{table}\"), 1))"))
+        db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = round(elapsed, 3)
+    stats['rows_per_second'] = round(stats['rows'] / elapsed, 1) if elapsed else None
+    return stats
+
+
+def _without_attributes(row):
+    return {key: value for key, value in row.items() if key != 'attributes'}
+
+
+def export_catalog(db, model, attribute_model, stream, fmt, batch_size=CATALOG_BATCH_SIZE):
+    """
+    Stream every product to `stream` as CSV or JSONL, ordered by id and
+    fetched `batch_size` rows at a time (plus one attribute query per batch).
+    Returns counts and throughput.
+    """
+    if fmt not in ('csv', 'jsonl'):
+        raise CatalogFormatError(f"Unknown catalog format {fmt!r}.")
+    started = time.perf_counter()
+    columns = [getattr(model, field) for field in CATALOG_FIELDS if field != 'attributes']
+    result = db.session.execute(select(*columns).order_by(model.id).execution_options(yield_per=batch_size))
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(CATALOG_FIELDS)
+    count = 0
+    for batch in result.partitions():
+        attributes = {}
+        for product_id, name, value in (
+                db.session.query(attribute_model.product_id, attribute_model.name, attribute_model.value)
+                .filter(attribute_model.product_id.in_([row[0] for row in batch]))
+                .order_by(attribute_model.product_id, attribute_model.position)):
+            attributes.setdefault(product_id, []).append({'name': name, 'value': value})
+        for row in batch:
+            record = dict(zip(CATALOG_FIELDS, row), attributes=attributes.get(row[0], []))
+            if writer:
+                record['attributes'] = json.dumps(record['attributes'])
+                writer.writerow(['' if record[field] is None else record[field] for field in CATALOG_FIELDS])
+            else:
+                stream.write(json.dumps(record) + '\n')
+            count += 1
+    elapsed = time.perf_counter() - started
+    return {'rows': count, 'seconds': round(elapsed, 3),
+            'rows_per_second': round(count / elapsed, 1) if elapsed else None}
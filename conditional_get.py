@@ -0,0 +1,77 @@
+import functools
+import glob
+import hashlib
+import os
+
+from flask import make_response, request
+
+# How long a CDN or reverse proxy may serve an anonymous catalog page before revalidating it
+CATALOG_SHARED_MAX_AGE = int(os.environ.get('CATALOG_SHARED_MAX_AGE', 60))
+
+
+def release_fingerprint(root, patterns=('*.py', 'templates/*.html', 'static/dist/manifest.json')):
+    """
+    Hash of the code, templates and static-asset manifest under `root`, so
+    page validators change on every deploy. Every worker of one deploy reads
+    the same files and gets the same fingerprint.
+    """
+    digest = hashlib.sha1()
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(root, pattern))):
+            digest.update(path.encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class ConditionalGet:
+    """
+    Strong ETags and shared-cache headers for pages that only change with the
+    catalog.
+
+    The ETag hashes `version()` (catalog and image versions), the release
+    fingerprint, the endpoint and its arguments, and the query string. A
+    matching If-None-Match gets a 304 before the view runs, so no query or
+    template render happens. Responses are `public, max-age=0, s-maxage=N`:
+    browsers revalidate every time and shared caches keep the page for N
+    seconds. Personalized requests (see `personalized()`) get
+    `private, no-cache` and no validator.
+    """
+
+    def __init__(self, version, personalized, release, shared_max_age=CATALOG_SHARED_MAX_AGE):
+        self.version = version
+        self.personalized = personalized
+        self.release = release
+        self.shared_max_age = shared_max_age
+
+    def etag(self):
+        parts = (self.version(), self.release, request.endpoint, sorted((request.view_args or {}).items()),
+                 sorted(request.args.items(multi=True)))
+        return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+    def _public(self, response, etag):
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = 0
+        response.cache_control.s_maxage = self.shared_max_age
+        # Logged-in visitors share the URL; a cache must not hand them an anonymous copy keyed only on it
+        response.vary.add('Cookie')
+        return response
+
+    def page(self, view):
+        """Decorator for a catalog view whose output depends only on the catalog and the URL."""
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if self.personalized():
+                response = make_response(view(*args, **kwargs))
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+                return response
+            etag = self.etag()
+            if request.if_none_match.contains_weak(etag):
+                return self._public(make_response('', 304), etag)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                self._public(response, etag)
+            return response
+        return wrapper
@@ -0,0 +1,69 @@
+import os
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from catalog_cache import LRUCacheBackend, _MISSING
+
+# Rendered fragments kept per worker, and how long one lives when {% cache %} gives no ttl
+FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE', 4096))
+FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 600))
+
+
+class FragmentCache:
+    """
+    In-process LRU of rendered template fragments.
+
+    Keys are namespaced with `version()` (the catalog version, for instance),
+    so a catalog change makes every older fragment unreachable; those entries
+    are then pushed out by the LRU instead of being cleared eagerly.
+    """
+
+    def __init__(self, version, maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL):
+        self.version = version
+        self.ttl = ttl
+        self.backend = LRUCacheBackend(maxsize=maxsize)
+
+    def get_or_render(self, key, render, ttl=None):
+        """Return the cached fragment for key, calling render() to fill it on a miss."""
+        full_key = f'fragment:{self.version()}:{key}'
+        value = self.backend.get(full_key)
+        if value is _MISSING:
+            value = render()
+            self.backend.set(full_key, value, self.ttl if ttl is None else ttl)
+        return value
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Jinja tag caching the rendered body of a block:
+
+        {% cache ('card', product.id) %}...{% endcache %}
+        {% cache ('sidebar', selected_category), 300 %}...{% endcache %}
+
+    The key (a value or tuple) is prefixed with the template name; the
+    optional second argument is a TTL in seconds. Renders uncached until a
+    FragmentCache is assigned to `environment.fragment_cache`.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        ttl = nodes.Const(None)
+        if parser.stream.skip_if('comma'):
+            ttl = parser.parse_expression()
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        args = [nodes.Const(parser.name), key, ttl]
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, template, key, ttl, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        parts = key if isinstance(key, tuple) else (key,)
+        return cache.get_or_render(':'.join(map(str, (template, *parts))), caller, ttl)
@@ -0,0 +1,31 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn 'app:create_app()'`
+(or plain `gunicorn`, which uses wsgi_app below).
+
+The app is preloaded: the master imports it once and forks workers that
+share its memory, so adding or restarting a worker costs a fork instead of
+a full import. Set GUNICORN_PRELOAD=false to import in every worker instead.
+
+Sets up prometheus_client multiprocess mode so /metrics aggregates all
+workers: each worker writes its metrics to PROMETHEUS_MULTIPROC_DIR, which
+must exist (and be emptied) before the app is imported.
+"""
+import os
+import shutil
+import tempfile
+
+# prometheus_client picks in-process or multiprocess metric values when it is first imported,
+# so nothing may import it before PROMETHEUS_MULTIPROC_DIR is set here
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'store-metrics'))
+shutil.rmtree(metrics_dir, ignore_errors=True)  # Counters from a previous run would be added in
+os.makedirs(metrics_dir, exist_ok=True)
+
+wsgi_app = 'app:create_app()'
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drop the dead worker's live gauges; its counters and histograms are kept
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import url_for
+from werkzeug.utils import secure_filename
+
+# Widths (px) generated for every product image; the srcset lets the browser pick one
+IMAGE_WIDTHS = tuple(int(w) for w in os.environ.get('IMAGE_WIDTHS', '320,640,1280').split(','))
+# Width used for the plain <img src> fallback and Product.web_image_path
+IMAGE_DEFAULT_WIDTH = int(os.environ.get('IMAGE_DEFAULT_WIDTH', 640))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 70))
+# Derivatives live under static/, next to the originals, but are not committed
+DERIVED_DIR = 'images/derived'
+SOURCE_EXTENSIONS = frozenset(['.jpg', '.jpeg', '.png', '.webp', '.avif', '.gif'])
+# Most efficient first: <picture> uses the first <source> the browser supports
+FORMAT_PREFERENCE = ('avif', 'webp')
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+
+
+def supported_formats():
+    """Output formats the installed Pillow can encode, in preference order."""
+    from PIL import features  # Pillow is only needed to build derivatives, not to serve them
+    return [fmt for fmt in FORMAT_PREFERENCE if features.check(fmt)]
+
+
+def derivative_path(image, width, fmt):
+    """Static-relative path of one derivative, e.g. images/derived/dell_xps_15-640.webp."""
+    stem = os.path.splitext(image.replace('\\', '/'))[0]
+    if stem.startswith('images/'):
+        stem = stem[len('images/'):]
+    return f"{DERIVED_DIR}/{secure_filename(stem.replace('/', '_'))}-{width}.{fmt}"
+
+
+def build_derivatives(static_root, image, widths=IMAGE_WIDTHS, formats=None, force=False):
+    """
+    Resize one original (a static-relative path) to every width in every format.
+    Originals are never upscaled, so small images get fewer widths. Derivatives
+    newer than their original are skipped unless `force`. Runs in pool workers,
+    so it only takes picklable arguments. Returns (image, manifest entry).
+    """
+    from PIL import Image, ImageOps
+    formats = formats or supported_formats()
+    source = os.path.join(static_root, image)
+    os.makedirs(os.path.join(static_root, DERIVED_DIR), exist_ok=True)
+
+    with Image.open(source) as original:
+        im = ImageOps.exif_transpose(original)
+        if im.mode not in ('RGB', 'RGBA'):
+            im = im.convert('RGBA' if im.has_transparency_data else 'RGB')
+        targets = sorted({min(width, im.width) for width in widths})
+        for width in targets:
+            resized = None
+            for fmt in formats:
+                out = os.path.join(static_root, derivative_path(image, width, fmt))
+                if not force and os.path.exists(out) and os.path.getmtime(out) >= os.path.getmtime(source):
+                    continue
+                if resized is None:
+                    height = max(1, round(im.height * width / im.width))
+                    resized = im if width == im.width else im.resize((width, height), Image.LANCZOS)
+                # Write then rename, so a request never sees a half-written file
+                tmp = f'{out}.{os.getpid()}.tmp'
+                resized.save(tmp, format=fmt.upper(), quality=IMAGE_QUALITY)
+                os.replace(tmp, out)
+    return image, {'widths': targets, 'formats': formats}
+
+
+class DerivativeManifest:
+    """
+    Which widths and formats exist for each original, persisted as
+    manifest.json in the derived directory. Lookups never touch the image
+    files; the manifest is re-read when another process (the build command, an
+    upload in another worker) rewrites it, checked at most every few seconds.
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self._entries = {}
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+                self._mtime = mtime
+        except (OSError, ValueError):
+            pass  # Not built yet (or mid-rewrite); keep what we have
+
+    def get(self, image):
+        self._refresh()
+        return self._entries.get(image)
+
+    def version(self):
+        """Changes whenever the manifest is rewritten, so cached markup using its srcsets can be keyed on it."""
+        self._refresh()
+        return self._mtime
+
+    def update(self, entries):
+        """Merge new entries into the manifest file."""
+        with self._lock:
+            self._refresh(force=True)
+            merged = dict(self._entries)
+            merged.update(entries)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(merged, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+            self._entries = merged
+            self._mtime = os.path.getmtime(self.path)
+
+
+class ImageDerivatives:
+    """
+    Resized WebP/AVIF variants of the product images under static/images.
+
+    Derivatives are built at upload time (build) or in bulk with a process
+    pool (build_all). Templates ask for srcsets through sources() and fall back
+    to the original for images that have no derivatives yet.
+    """
+
+    def __init__(self, static_root, widths=IMAGE_WIDTHS, default_width=IMAGE_DEFAULT_WIDTH):
+        self.static_root = static_root
+        self.widths = widths
+        self.default_width = default_width
+        self.manifest = DerivativeManifest(os.path.join(static_root, DERIVED_DIR, 'manifest.json'))
+
+    def originals(self):
+        """Static-relative paths of every original image under static/images."""
+        directory = os.path.join(self.static_root, 'images')
+        return sorted(
+            f'images/{name}' for name in os.listdir(directory)
+            if os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS
+            and os.path.isfile(os.path.join(directory, name))
+        )
+
+    def build(self, image, force=False):
+        """Build the derivatives of one image in this process (used on admin upload)."""
+        image, entry = build_derivatives(self.static_root, image, self.widths, force=force)
+        self.manifest.update({image: entry})
+        return entry
+
+    def build_all(self, images=None, workers=None, force=False):
+        """Build derivatives for many images across a process pool. Returns {image: entry or error}."""
+        images = images if images is not None else self.originals()
+        results, entries = {}, {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(build_derivatives, self.static_root, image, self.widths, None, force): image
+                       for image in images}
+            for future, image in futures.items():
+                try:
+                    entries[image] = future.result()[1]
+                    results[image] = entries[image]
+                except Exception as e:  # One corrupt upload must not stop the batch
+                    results[image] = e
+        self.manifest.update(entries)
+        return results
+
+    def _entry(self, image):
+        return self.manifest.get(image.replace('\\', '/')) if image else None
+
+    def default_path(self, image):
+        """The derivative closest to the default width in the most compatible format, or the original."""
+        image = image.replace('\\', '/')
+        entry = self._entry(image)
+        if not entry or 'webp' not in entry['formats']:
+            return image
+        fits = [w for w in entry['widths'] if w <= self.default_width]
+        width = max(fits) if fits else min(entry['widths'])
+        return derivative_path(image, width, 'webp')
+
+    def sources(self, image):
+        """[(mime type, srcset)] for a <picture>'s <source> tags, best format first; empty without derivatives."""
+        entry = self._entry(image)
+        if not entry:
+            return []
+        return [
+            (MIME_TYPES[fmt], ', '.join(
+                f"{url_for('static', filename=derivative_path(image, width, fmt))} {width}w"
+                for width in entry['widths']))
+            for fmt in FORMAT_PREFERENCE if fmt in entry['formats']
+        ]
@@ -0,0 +1,108 @@
+import os
+import time
+
+from flask import g, has_request_context, request, Response, abort
+from flask import before_render_template, template_rendered
+from prometheus_client import Counter, Histogram, CollectorRegistry, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint', ['endpoint', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL statements executed per request', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_seconds', 'Total SQL time per request', ['endpoint'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+TEMPLATE_RENDER = Histogram(
+    'template_render_seconds', 'Template render time', ['template'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5))
+OUTBOUND_LATENCY = Histogram(
+    'outbound_request_duration_seconds', 'Calls to Paystack, M-PESA and SMTP', ['service', 'outcome'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+DB_QUERIES = Counter('db_queries_total', 'SQL statements executed, including background work')
+
+
+def record_outbound(service, seconds, ok=True):
+    """Record one call to an external service; inside a request it also counts towards Server-Timing."""
+    OUTBOUND_LATENCY.labels(service, 'ok' if ok else 'error').observe(seconds)
+    if has_request_context() and 'perf' in g:
+        g.perf['outbound'] += seconds
+
+
+class Instrumentation:
+    """
+    Per-request performance accounting: endpoint latency, SQL statement count
+    and time (engine events), template render time and outbound API time.
+    Each response gets a Server-Timing header, and /metrics exposes the
+    Prometheus histograms. When PROMETHEUS_MULTIPROC_DIR is set (see
+    gunicorn.conf.py) /metrics aggregates every gunicorn worker.
+    """
+
+    def __init__(self, app, db):
+        self.app = app
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_finished, app)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._query_started)
+            event.listen(db.engine, 'after_cursor_execute', self._query_finished)
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+
+    def _start(self):
+        g.perf = {'start': time.perf_counter(), 'queries': 0, 'db': 0.0, 'templates': 0.0, 'outbound': 0.0}
+
+    def _finish(self, response):
+        perf = g.pop('perf', None)
+        if perf is None:
+            return response
+        elapsed = time.perf_counter() - perf['start']
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(elapsed)
+        REQUEST_QUERIES.labels(endpoint).observe(perf['queries'])
+        REQUEST_DB_TIME.labels(endpoint).observe(perf['db'])
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={perf["db"] * 1000:.1f};desc="{perf["queries"]} queries"',
+            f'tpl;dur={perf["templates"] * 1000:.1f}',
+            f'ext;dur={perf["outbound"] * 1000:.1f}',
+            f'app;dur={elapsed * 1000:.1f}',
+        ])
+        return response
+
+    def _query_started(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        DB_QUERIES.inc()
+        if has_request_context() and 'perf' in g:
+            g.perf['queries'] += 1
+            g.perf['db'] += elapsed
+
+    def _template_started(self, sender, template, context, **extra):
+        if 'perf' in g:
+            g.setdefault('template_starts', []).append(time.perf_counter())
+
+    def _template_finished(self, sender, template, context, **extra):
+        starts = g.get('template_starts')
+        if starts:
+            elapsed = time.perf_counter() - starts.pop()
+            TEMPLATE_RENDER.labels(template.name or 'string').observe(elapsed)
+            if not starts:  # Nested render_template calls are already inside the outer one
+                g.perf['templates'] += elapsed
+
+    def metrics(self):
+        if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+            abort(401)
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
@@ -0,0 +1,55 @@
+from sqlalchemy import case, func, or_, select, update
+
+
+def reserve_stock(db, product_model, quantities):
+    """
+    Take {product_id: quantity} units out of stock with one conditional
+    UPDATE ... SET stock = stock - qty WHERE stock >= qty covering every line,
+    so concurrent checkouts of the same product can never oversell it.
+    Products with a NULL stock are not tracked and always match.
+
+    Does not commit. Returns True if every line was reserved; otherwise the
+    caller must roll back, as the lines that did fit were already taken.
+    """
+    if not quantities:
+        return True
+    Product = product_model
+    wanted = case(quantities, value=Product.id)
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(list(quantities)), or_(Product.stock.is_(None), Product.stock >= wanted))
+        .values(stock=Product.stock - wanted)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(quantities)
+
+
+def short_lines(db, product_model, quantities):
+    """The {product_id: units left} of the lines that reserve_stock could not fill."""
+    Product = product_model
+    rows = db.session.query(Product.id, Product.stock).filter(Product.id.in_(list(quantities)))
+    left = {product_id: stock for product_id, stock in rows}
+    return {product_id: left.get(product_id) or 0 for product_id, quantity in quantities.items()
+            if product_id not in left or (left[product_id] is not None and left[product_id] < quantity)}
+
+
+def restock(db, product_model, item_model, order_ids, sign=1):
+    """
+    Put the units reserved by `order_ids` back in stock, or take them out
+    again with sign=-1, with one UPDATE that sums the orders' lines per
+    product. Untracked products are left alone. Does not commit.
+    """
+    if not order_ids:
+        return 0
+    Product, Item = product_model, item_model
+    units = (select(func.sum(Item.quantity))
+             .where(Item.order_id.in_(order_ids), Item.product_id == Product.id)
+             .scalar_subquery())
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(select(Item.product_id).where(Item.order_id.in_(order_ids))),
+               Product.stock.is_not(None))
+        .values(stock=Product.stock + units if sign > 0 else Product.stock - units)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -0,0 +1,164 @@
+import atexit
+import collections
+import os
+import queue
+import random
+import threading
+import time
+
+from instrumentation import record_outbound
+
+MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))
+MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 1))
+MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 20))
+MAIL_MAX_RETRIES = int(os.environ.get('MAIL_MAX_RETRIES', 3))
+# Messages given up on, kept for /admin/mail-stats
+MAIL_DEAD_LETTERS = int(os.environ.get('MAIL_DEAD_LETTERS', 100))
+
+
+class MailDispatcher:
+    """
+    Sends Flask-Mail messages from background worker threads.
+
+    Requests only enqueue a message, so SMTP latency never reaches the user.
+    Each worker drains up to MAIL_BATCH_SIZE messages and sends them over one
+    SMTP connection. Attempts are counted per message: one that fails is
+    retried on its own with exponential backoff and jitter, while the rest of
+    the batch carries on over a new connection, and after MAIL_MAX_RETRIES
+    retries it is dead-lettered (see stats()). Workers start lazily in the
+    process that first enqueues, so forked gunicorn workers each get their own.
+    """
+
+    def __init__(self, app, mail, maxsize=MAIL_QUEUE_SIZE, workers=MAIL_WORKERS,
+                 batch_size=MAIL_BATCH_SIZE, max_retries=MAIL_MAX_RETRIES, dead_letters=MAIL_DEAD_LETTERS):
+        self.app = app
+        self.mail = mail
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._waiting = 0  # Messages waiting out a retry backoff
+        self._dead_letters = collections.deque(maxlen=dead_letters)
+        self._stats = {'enqueued': 0, 'sent': 0, 'failed': 0, 'dropped': 0, 'retried': 0,
+                       'send_seconds_total': 0.0, 'last_send_seconds': 0.0}
+        atexit.register(self.flush)
+
+    def enqueue(self, msg):
+        """Queue a message for sending. Returns False if the queue is full and the message was dropped."""
+        self._ensure_workers()
+        try:
+            self._queue.put_nowait((msg, 0, time.monotonic()))
+        except queue.Full:
+            self._count('dropped')
+            print(f"Mail queue full, dropped message to {msg.recipients}")
+            return False
+        self._count('enqueued')
+        return True
+
+    def stats(self):
+        """Queue depth, counters, send latency and the latest dead-lettered messages for monitoring."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['retry_waiting'] = self._waiting
+            stats['dead_letters'] = list(self._dead_letters)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['avg_send_seconds'] = stats['send_seconds_total'] / stats['sent'] if stats['sent'] else 0.0
+        return stats
+
+    def flush(self, timeout=5):
+        """Wait up to `timeout` seconds for queued messages to be sent (used at shutdown)."""
+        deadline = time.monotonic() + timeout
+        while (self._queue.unfinished_tasks or self._waiting) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            for i in range(self.workers):
+                threading.Thread(target=self._run, name=f'mail-worker-{i}', daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send_batch(self, batch):
+        pending = list(batch)
+        with self.app.app_context():
+            while pending:
+                connected = False
+                started = time.monotonic()
+                try:
+                    with self.mail.connect() as connection:
+                        connected = True
+                        while pending:
+                            msg, attempts, enqueued_at = pending[0]
+                            started = time.monotonic()
+                            connection.send(msg)
+                            pending.pop(0)
+                            elapsed = time.monotonic() - started
+                            record_outbound('smtp', elapsed)
+                            with self._lock:
+                                self._stats['sent'] += 1
+                                self._stats['send_seconds_total'] += elapsed
+                                self._stats['last_send_seconds'] = elapsed
+                            print(f"Email sent to {msg.recipients} ({time.monotonic() - enqueued_at:.2f}s after enqueue)")
+                except Exception as e:
+                    record_outbound('smtp', time.monotonic() - started, ok=False)
+                    if not pending:
+                        break  # Everything was sent; only closing the connection failed
+                    if not connected:
+                        # No connection at all: every waiting message used up an attempt
+                        print(f"Failed to connect to send {len(pending)} queued email(s): {e}")
+                        for msg, attempts, enqueued_at in pending:
+                            self._retry(msg, attempts + 1, enqueued_at, e)
+                        return
+                    # Only the message being sent is charged; the rest go out over a new connection
+                    msg, attempts, enqueued_at = pending.pop(0)
+                    print(f"Failed to send email to {msg.recipients}: {e}")
+                    self._retry(msg, attempts + 1, enqueued_at, e)
+
+    def _retry(self, msg, attempts, enqueued_at, error):
+        """Queue a failed message again after a backoff, or dead-letter it once it has run out of retries."""
+        if attempts > self.max_retries:
+            with self._lock:
+                self._stats['failed'] += 1
+                self._dead_letters.append({'recipients': list(msg.recipients), 'subject': msg.subject,
+                                           'attempts': attempts, 'error': str(error), 'failed_at': time.time()})
+            print(f"Giving up on email to {msg.recipients} after {attempts} attempts")
+            return
+        with self._lock:
+            self._waiting += 1
+        timer = threading.Timer(min(2 ** attempts, 60) + random.uniform(0, 1), self._requeue,
+                                (msg, attempts, enqueued_at))
+        timer.daemon = True
+        timer.start()
+
+    def _requeue(self, msg, attempts, enqueued_at):
+        try:
+            self._queue.put_nowait((msg, attempts, enqueued_at))
+            self._count('retried')
+        except queue.Full:
+            self._count('dropped')
+        finally:
+            with self._lock:
+                self._waiting -= 1
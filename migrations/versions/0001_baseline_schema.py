@@ -0,0 +1,83 @@
+"""Baseline schema: user, product, order and cart_item tables
+
+Matches the schema previously created by db.create_all(). Tables that already
+exist are skipped, so databases created before migrations were introduced can
+simply run `flask db upgrade`.
+
+Revision ID: 0001_baseline_schema
+Revises: 
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_baseline_schema'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if not _has_table('user'):
+        op.create_table('user',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=80), nullable=False),
+            sa.Column('email', sa.String(length=120), nullable=False),
+            sa.Column('password_hash', sa.String(length=128), nullable=False),
+            sa.Column('is_admin', sa.Boolean(), nullable=False),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('email'),
+            sa.UniqueConstraint('username')
+        )
+    if not _has_table('product'):
+        op.create_table('product',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=120), nullable=False),
+            sa.Column('price', sa.Float(), nullable=False),
+            sa.Column('old_price', sa.Float(), nullable=True),
+            sa.Column('rating', sa.Float(), nullable=True),
+            sa.Column('description', sa.String(length=500), nullable=True),
+            sa.Column('image', sa.String(length=500), nullable=False),
+            sa.Column('category', sa.String(length=80), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if not _has_table('order'):
+        op.create_table('order',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('user_id', sa.Integer(), nullable=False),
+            sa.Column('reference', sa.String(length=100), nullable=False),
+            sa.Column('amount', sa.Float(), nullable=False),
+            sa.Column('phone_number', sa.String(length=20), nullable=False),
+            sa.Column('county', sa.String(length=100), nullable=False),
+            sa.Column('city', sa.String(length=100), nullable=False),
+            sa.Column('shipping_address', sa.String(length=500), nullable=False),
+            sa.Column('status', sa.String(length=50), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('reference')
+        )
+    if not _has_table('cart_item'):
+        op.create_table('cart_item',
+            sa.Column('cart_id', sa.String(length=32), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('cart_id', 'product_id')
+        )
+        op.create_index('ix_cart_item_updated_at', 'cart_item', ['updated_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_cart_item_updated_at', table_name='cart_item')
+    op.drop_table('cart_item')
+    op.drop_table('order')
+    op.drop_table('product')
+    op.drop_table('user')
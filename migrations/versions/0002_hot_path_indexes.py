@@ -0,0 +1,36 @@
+"""Indexes for hot lookup paths
+
+- product (category, name): home() category filter ordered by name, related products
+- product (name): full catalog ordered by name
+- order (user_id, created_at): a user's order history, newest first
+- order (status, created_at): orders in a given state by age (reconciliation)
+
+Revision ID: 0002_hot_path_indexes
+Revises: 0001_baseline_schema
+Create Date: 2026-10-18 09:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_hot_path_indexes'
+down_revision = '0001_baseline_schema'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # if_not_exists: databases bootstrapped with create_all() already have them
+    op.create_index('ix_product_category_name', 'product', ['category', 'name'], unique=False, if_not_exists=True)
+    op.create_index('ix_product_name', 'product', ['name'], unique=False, if_not_exists=True)
+    op.create_index('ix_order_user_id_created_at', 'order', ['user_id', 'created_at'], unique=False, if_not_exists=True)
+    op.create_index('ix_order_status_created_at', 'order', ['status', 'created_at'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_order_status_created_at', table_name='order')
+    op.drop_index('ix_order_user_id_created_at', table_name='order')
+    op.drop_index('ix_product_name', table_name='product')
+    op.drop_index('ix_product_category_name', table_name='product')
@@ -0,0 +1,41 @@
+"""Append-only webhook_event log for idempotent payment webhook ingestion
+
+Revision ID: 0003_webhook_event_log
+Revises: 0002_hot_path_indexes
+Create Date: 2026-10-18 10:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_webhook_event_log'
+down_revision = '0002_hot_path_indexes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the table
+    if sa.inspect(op.get_bind()).has_table('webhook_event'):
+        return
+    op.create_table('webhook_event',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('provider', sa.String(length=20), nullable=False),
+        sa.Column('event_id', sa.String(length=200), nullable=False),
+        sa.Column('event_type', sa.String(length=50), nullable=True),
+        sa.Column('reference', sa.String(length=100), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('received_at', sa.DateTime(), nullable=False),
+        sa.Column('processed_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('provider', 'event_id', name='uq_webhook_event_provider_event_id')
+    )
+    op.create_index('ix_webhook_event_processed_at_id', 'webhook_event', ['processed_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_webhook_event_processed_at_id', table_name='webhook_event')
+    op.drop_table('webhook_event')
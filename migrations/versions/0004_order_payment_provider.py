@@ -0,0 +1,37 @@
+"""Record each order's payment provider and Daraja CheckoutRequestID
+
+Lets mpesa_callback match STK Push results to orders and lets
+reconcile-payments query the right provider.
+
+Revision ID: 0004_order_payment_provider
+Revises: 0003_webhook_event_log
+Create Date: 2026-10-18 11:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_order_payment_provider'
+down_revision = '0003_webhook_event_log'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the columns
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('order')}
+    with op.batch_alter_table('order') as batch_op:
+        if 'payment_provider' not in columns:
+            batch_op.add_column(sa.Column('payment_provider', sa.String(length=20), nullable=True))
+        if 'checkout_request_id' not in columns:
+            batch_op.add_column(sa.Column('checkout_request_id', sa.String(length=100), nullable=True))
+    op.create_index('ix_order_checkout_request_id', 'order', ['checkout_request_id'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_order_checkout_request_id', table_name='order')
+    with op.batch_alter_table('order') as batch_op:
+        batch_op.drop_column('checkout_request_id')
+        batch_op.drop_column('payment_provider')
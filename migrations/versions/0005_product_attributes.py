@@ -0,0 +1,65 @@
+"""Normalized product_attribute table, backfilled from product.description
+
+Revision ID: 0005_product_attributes
+Revises: 0004_order_payment_provider
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from product_attributes import attribute_rows, split_description
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_product_attributes'
+down_revision = '0004_order_payment_provider'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Databases bootstrapped with create_all() already have the table
+    if not sa.inspect(bind).has_table('product_attribute'):
+        op.create_table('product_attribute',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('position', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=40), nullable=True),
+            sa.Column('value', sa.String(length=120), nullable=False),
+            sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_product_attribute_product_id', 'product_attribute', ['product_id'],
+                    unique=False, if_not_exists=True)
+    op.create_index('ix_product_attribute_name_value', 'product_attribute', ['name', 'value', 'product_id'],
+                    unique=False, if_not_exists=True)
+
+    # Split existing descriptions into attribute rows, skipping products that already have some
+    product = sa.table('product', sa.column('id', sa.Integer), sa.column('description', sa.String))
+    attribute = sa.table('product_attribute', sa.column('product_id', sa.Integer), sa.column('position', sa.Integer),
+                         sa.column('name', sa.String), sa.column('value', sa.String))
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(product.c.id, product.c.description)
+            .where(product.c.id > last_id, product.c.description.isnot(None),
+                   ~sa.exists().where(attribute.c.product_id == product.c.id))
+            .order_by(product.c.id).limit(BACKFILL_BATCH_SIZE)).all()
+        if not rows:
+            break
+        values = [dict(row, product_id=product_id)
+                  for product_id, description in rows
+                  for row in attribute_rows(split_description(description))]
+        if values:
+            bind.execute(attribute.insert(), values)
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_index('ix_product_attribute_name_value', table_name='product_attribute')
+    op.drop_index('ix_product_attribute_product_id', table_name='product_attribute')
+    op.drop_table('product_attribute')
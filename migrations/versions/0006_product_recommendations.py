@@ -0,0 +1,58 @@
+"""Precomputed product recommendations, co-purchase counts and build runs
+
+Tables written by `flask build-recs`; product pages read product_recommendation
+by primary key.
+
+Revision ID: 0006_product_recommendations
+Revises: 0005_product_attributes
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_product_recommendations'
+down_revision = '0005_product_attributes'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the tables
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'product_recommendation' not in existing:
+        op.create_table('product_recommendation',
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('similar', sa.Text(), nullable=False),
+            sa.Column('bought_with', sa.Text(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=False),
+            sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('product_id')
+        )
+    if 'product_copurchase' not in existing:
+        op.create_table('product_copurchase',
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('other_id', sa.Integer(), nullable=False),
+            sa.Column('count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('product_id', 'other_id')
+        )
+    if 'recommendation_run' not in existing:
+        op.create_table('recommendation_run',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('finished_at', sa.DateTime(), nullable=False),
+            sa.Column('full', sa.Boolean(), nullable=False),
+            sa.Column('last_order_id', sa.Integer(), nullable=False),
+            sa.Column('orders', sa.Integer(), nullable=False),
+            sa.Column('similar_updated', sa.Integer(), nullable=False),
+            sa.Column('bought_updated', sa.Integer(), nullable=False),
+            sa.Column('seconds', sa.Float(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('recommendation_run')
+    op.drop_table('product_copurchase')
+    op.drop_table('product_recommendation')
@@ -0,0 +1,48 @@
+"""Order lines snapshotted at checkout and product stock levels
+
+Existing products get a NULL stock (not tracked) and keep selling as before
+until a stock level is set in the admin or a catalog import.
+
+Revision ID: 0007_order_items_and_stock
+Revises: 0006_product_recommendations
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_order_items_and_stock'
+down_revision = '0006_product_recommendations'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the column and table
+    inspector = sa.inspect(op.get_bind())
+    if 'stock' not in {column['name'] for column in inspector.get_columns('product')}:
+        with op.batch_alter_table('product') as batch_op:
+            batch_op.add_column(sa.Column('stock', sa.Integer(), nullable=True))
+    if not inspector.has_table('order_item'):
+        op.create_table('order_item',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('order_id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=True),
+            sa.Column('name', sa.String(length=120), nullable=False),
+            sa.Column('price', sa.Float(), nullable=False),
+            sa.Column('quantity', sa.Integer(), nullable=False),
+            sa.ForeignKeyConstraint(['order_id'], ['order.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='SET NULL'),
+            sa.PrimaryKeyConstraint('id')
+        )
+    op.create_index('ix_order_item_order_id_product_id', 'order_item', ['order_id', 'product_id'],
+                    unique=False, if_not_exists=True)
+    op.create_index('ix_order_item_product_id', 'order_item', ['product_id'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_table('order_item')
+    with op.batch_alter_table('product') as batch_op:
+        batch_op.drop_column('stock')
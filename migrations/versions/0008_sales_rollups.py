@@ -0,0 +1,58 @@
+"""Sales rollup tables behind the admin analytics view
+
+Filled by `flask refresh-analytics` (or the in-process refresh) from the
+orders after the watermark in sales_rollup_state.
+
+Revision ID: 0008_sales_rollups
+Revises: 0007_order_items_and_stock
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_sales_rollups'
+down_revision = '0007_order_items_and_stock'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the tables
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'sales_daily' not in existing:
+        op.create_table('sales_daily',
+            sa.Column('day', sa.Date(), nullable=False),
+            sa.Column('county', sa.String(length=100), nullable=False),
+            sa.Column('city', sa.String(length=100), nullable=False),
+            sa.Column('status', sa.String(length=50), nullable=False),
+            sa.Column('orders', sa.Integer(), nullable=False),
+            sa.Column('amount', sa.Float(), nullable=False),
+            sa.PrimaryKeyConstraint('day', 'county', 'city', 'status')
+        )
+    if 'sales_product' not in existing:
+        op.create_table('sales_product',
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=120), nullable=False),
+            sa.Column('units', sa.Integer(), nullable=False),
+            sa.Column('amount', sa.Float(), nullable=False),
+            sa.Column('orders', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('product_id')
+        )
+    op.create_index('ix_sales_product_amount', 'sales_product', ['amount'], unique=False, if_not_exists=True)
+    if 'sales_rollup_state' not in existing:
+        op.create_table('sales_rollup_state',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('last_order_id', sa.Integer(), nullable=False),
+            sa.Column('refreshed_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('sales_rollup_state')
+    op.drop_index('ix_sales_product_amount', table_name='sales_product')
+    op.drop_table('sales_product')
+    op.drop_table('sales_daily')
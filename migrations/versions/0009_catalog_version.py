@@ -0,0 +1,35 @@
+"""Catalog cache version shared by every worker
+
+One row, bumped in the same transaction as any product change, so workers
+without a shared Redis cache stop serving stale catalog reads on their next
+request.
+
+Revision ID: 0009_catalog_version
+Revises: 0008_sales_rollups
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009_catalog_version'
+down_revision = '0008_sales_rollups'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the table
+    if not sa.inspect(op.get_bind()).has_table('catalog_version'):
+        table = op.create_table('catalog_version',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('version', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.bulk_insert(table, [{'id': 1, 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('catalog_version')
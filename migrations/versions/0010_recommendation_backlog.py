@@ -0,0 +1,36 @@
+"""Backlog of paid orders for the co-purchase counts
+
+Lines of orders paid after the build-recs watermark may already have passed
+them, appended by the payment status hook and consumed by the next run.
+
+Revision ID: 0010_recommendation_backlog
+Revises: 0009_catalog_version
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010_recommendation_backlog'
+down_revision = '0009_catalog_version'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the table
+    if not sa.inspect(op.get_bind()).has_table('recommendation_backlog'):
+        op.create_table('recommendation_backlog',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('order_id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_recommendation_backlog_order_id', 'recommendation_backlog', ['order_id'])
+
+
+def downgrade():
+    op.drop_index('ix_recommendation_backlog_order_id', table_name='recommendation_backlog')
+    op.drop_table('recommendation_backlog')
@@ -0,0 +1,37 @@
+"""Append-only log of order status changes for the sales rollups
+
+Written by the payment status hook and applied by the next refresh, so
+payment transitions no longer lock the single sales_rollup_state row.
+
+Revision ID: 0011_sales_rollup_delta
+Revises: 0010_recommendation_backlog
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011_sales_rollup_delta'
+down_revision = '0010_recommendation_backlog'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases bootstrapped with create_all() already have the table
+    if not sa.inspect(op.get_bind()).has_table('sales_rollup_delta'):
+        op.create_table('sales_rollup_delta',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('order_id', sa.Integer(), nullable=False),
+            sa.Column('previous', sa.String(length=50), nullable=False),
+            sa.Column('status', sa.String(length=50), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_sales_rollup_delta_order_id', 'sales_rollup_delta', ['order_id'])
+
+
+def downgrade():
+    op.drop_index('ix_sales_rollup_delta_order_id', table_name='sales_rollup_delta')
+    op.drop_table('sales_rollup_delta')
@@ -0,0 +1,36 @@
+"""Server-side session table
+
+Flask-Session used to create it with CREATE TABLE when app.py was imported.
+The schema is Flask-Session's own (SESSION_SQLALCHEMY_TABLE = 'sessions').
+
+Revision ID: 0012_sessions
+Revises: 0011_sales_rollup_delta
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012_sessions'
+down_revision = '0011_sales_rollup_delta'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases that already served requests have the table
+    if not sa.inspect(op.get_bind()).has_table('sessions'):
+        op.create_table('sessions',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('session_id', sa.String(length=255), nullable=True),
+            sa.Column('data', sa.LargeBinary(), nullable=True),
+            sa.Column('expiry', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('session_id')
+        )
+
+
+def downgrade():
+    op.drop_table('sessions')
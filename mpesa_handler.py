@@ -2,7 +2,11 @@ import os
 import requests
 from requests.auth import HTTPBasicAuth
 import base64
+import json
+import threading
+import time
 from datetime import datetime
+from payment_http import payment_http
 
 # Load M-PESA credentials from environment variables
 MPESA_CONSUMER_KEY = os.environ.get('MPESA_CONSUMER_KEY')
@@ -11,24 +15,34 @@ MPESA_BUSINESS_SHORTCODE = os.environ.get('MPESA_BUSINESS_SHORTCODE')
 MPESA_PASSKEY = os.environ.get('MPESA_PASSKEY')
 MPESA_CALLBACK_URL = os.environ.get('MPESA_CALLBACK_URL') # e.g., https://your-app.on-render.com/mpesa_callback
 
-# Use sandbox URLs for development/testing
-API_AUTH_URL = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-STK_PUSH_URL = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
+# Use sandbox URLs for development/testing (override to point at a local stub)
+MPESA_BASE_URL = os.environ.get('MPESA_BASE_URL', 'https://sandbox.safaricom.co.ke')
+API_AUTH_URL = f"{MPESA_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
+STK_PUSH_URL = f"{MPESA_BASE_URL}/mpesa/stkpush/v1/processrequest"
+STK_QUERY_URL = f"{MPESA_BASE_URL}/mpesa/stkpushquery/v1/query"
+# Daraja's STK query answers with this error code while the customer has not responded yet
+STK_PENDING_ERROR_CODE = '500.001.1001'
 
-def get_mpesa_access_token():
+# Refresh the OAuth token this many seconds before it expires
+MPESA_TOKEN_REFRESH_MARGIN = int(os.environ.get('MPESA_TOKEN_REFRESH_MARGIN', 300))
+# Optional file shared by all gunicorn workers on a host, e.g. /tmp/mpesa_token.json
+MPESA_TOKEN_CACHE_FILE = os.environ.get('MPESA_TOKEN_CACHE_FILE')
+
+def fetch_mpesa_access_token():
     """
-    Makes a request to the Safaricom API to get an access token.
-    Returns a tuple (access_token, error_message).
+    Makes a request to the Safaricom API to get a new access token.
+    Returns a tuple (access_token, expires_in_seconds, error_message).
     """
     if not MPESA_CONSUMER_KEY or not MPESA_CONSUMER_SECRET:
         error_msg = "M-PESA Consumer Key or Secret not configured in environment variables."
         print(error_msg)
-        return None, error_msg
+        return None, 0, error_msg
         
     try:
-        res = requests.get(API_AUTH_URL, auth=HTTPBasicAuth(MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET))
+        res = payment_http.get(API_AUTH_URL, auth=HTTPBasicAuth(MPESA_CONSUMER_KEY, MPESA_CONSUMER_SECRET), service='mpesa')
         res.raise_for_status() # Raise an exception for bad status codes (4xx or 5xx)
-        return res.json().get('access_token'), None
+        data = res.json()
+        return data.get('access_token'), int(data.get('expires_in', 3599)), None
     except requests.exceptions.RequestException as e:
         # Safaricom often returns error details in the response body even on failure
         error_details = str(e)
@@ -41,7 +55,116 @@ def get_mpesa_access_token():
         
         error_msg = f"API request failed. Details: {error_details}"
         print(f"Error getting M-PESA access token: {error_msg}")
-        return None, error_msg
+        return None, 0, error_msg
+
+class MpesaTokenCache:
+    """
+    Process-wide cache for the M-PESA OAuth token (valid for about an hour).
+
+    A lock ensures only one thread calls the auth endpoint when the token is
+    missing or expired. Once the token is within MPESA_TOKEN_REFRESH_MARGIN of
+    expiring, callers keep using it while one background thread fetches the
+    next one. With MPESA_TOKEN_CACHE_FILE set, tokens are also shared with
+    other worker processes through that file.
+    """
+
+    def __init__(self, fetch=fetch_mpesa_access_token, cache_file=MPESA_TOKEN_CACHE_FILE,
+                 refresh_margin=MPESA_TOKEN_REFRESH_MARGIN):
+        self.fetch = fetch
+        self.cache_file = cache_file
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self):
+        """Returns a tuple (access_token, error_message)."""
+        remaining = self._expires_at - time.time()
+        if self._token and remaining > 0:
+            if remaining < self.refresh_margin:
+                self._refresh_in_background()
+            return self._token, None
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token and self._expires_at > time.time():
+                return self._token, None
+            if self._load_shared():
+                return self._token, None
+            return self._refresh()
+
+    def _refresh(self):
+        token, expires_in, error = self.fetch()
+        if error:
+            return None, error
+        self._token = token
+        self._expires_at = time.time() + expires_in
+        self._store_shared()
+        return token, None
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self._lock:
+                    # Another worker may already have refreshed the shared token
+                    if not self._load_shared():
+                        self._refresh()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='mpesa-token-refresh', daemon=True).start()
+
+    def _load_shared(self):
+        """Adopt a fresh token from the shared cache file. Returns True on success."""
+        if not self.cache_file:
+            return False
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('expires_at', 0) - time.time() <= self.refresh_margin:
+            return False
+        self._token = data['access_token']
+        self._expires_at = data['expires_at']
+        return True
+
+    def _store_shared(self):
+        if not self.cache_file:
+            return
+        tmp_path = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'access_token': self._token, 'expires_at': self._expires_at}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.cache_file)  # Atomic, so readers never see a partial file
+        except OSError as e:
+            print(f"Could not write M-PESA token cache file: {e}")
+
+mpesa_token_cache = MpesaTokenCache()
+
+def get_mpesa_access_token():
+    """
+    Returns a tuple (access_token, error_message), using the cached token
+    when it is still valid instead of calling the Safaricom API.
+    """
+    return mpesa_token_cache.get()
+
+def stk_password():
+    """Returns (timestamp, password) for STK requests: base64 of shortcode + passkey + timestamp."""
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    password_data = f"{MPESA_BUSINESS_SHORTCODE}{MPESA_PASSKEY}{timestamp}"
+    return timestamp, base64.b64encode(password_data.encode()).decode('utf-8')
+
+def stk_result_status(result_code):
+    """The order status an STK ResultCode implies: 0 is paid; anything else was cancelled, timed out or failed."""
+    return 'success' if str(result_code) == '0' else 'failed'
 
 def initiate_stk_push(phone_number, amount, account_reference="TechKenya", transaction_desc="Payment for goods"):
     """
@@ -64,11 +187,7 @@ def initiate_stk_push(phone_number, amount, account_reference="TechKenya", trans
         # Propagate the detailed error from the token function
         return {"error": "Could not get access token.", "details": error}
 
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    
-    # Generate the M-PESA password
-    password_data = f"{MPESA_BUSINESS_SHORTCODE}{MPESA_PASSKEY}{timestamp}"
-    password = base64.b64encode(password_data.encode()).decode('utf-8')
+    timestamp, password = stk_password()
 
     # Format phone number to Safaricom's required format (e.g., 2547...)
     if phone_number.startswith('+'):
@@ -96,11 +215,42 @@ def initiate_stk_push(phone_number, amount, account_reference="TechKenya", trans
     }
 
     try:
-        response = requests.post(STK_PUSH_URL, json=payload, headers=headers)
+        response = payment_http.post(STK_PUSH_URL, json=payload, headers=headers, service='mpesa')
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Error initiating STK push: {e}")
         # Provide more detailed error from the API response if possible
         error_details = e.response.json() if e.response else str(e)
-        return {"error": "STK Push failed.", "details": error_details}
\ No newline at end of file
+        return {"error": "STK Push failed.", "details": error_details}
+
+def query_stk_status(checkout_request_id):
+    """
+    Queries the result of an STK Push. Returns the order status it implies
+    ('success' or 'failed'), or None while the customer has not responded.
+    Raises if Daraja cannot be reached or answers unexpectedly.
+    """
+    access_token, error = get_mpesa_access_token()
+    if error:
+        raise RuntimeError(f"Could not get access token: {error}")
+
+    timestamp, password = stk_password()
+    payload = {
+        "BusinessShortCode": MPESA_BUSINESS_SHORTCODE,
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id
+    }
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json"
+    }
+    # A status query has no side effects, so it is safe to retry
+    response = payment_http.post(STK_QUERY_URL, json=payload, headers=headers, idempotent=True, service='mpesa')
+    data = response.json()
+    if 'ResultCode' in data:
+        return stk_result_status(data['ResultCode'])
+    if data.get('errorCode') == STK_PENDING_ERROR_CODE:
+        return None
+    response.raise_for_status()
+    raise RuntimeError(f"Unexpected STK query response: {data}")
@@ -0,0 +1,75 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import BigInteger, Integer, literal, tuple_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor from the URL cannot be decoded."""
+
+
+def encode_cursor(values):
+    """Encode the sort-key values of the last row on a page as an opaque URL-safe cursor."""
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _coerce(value, column):
+    """
+    Convert one cursor value to `column`'s Python type. Cursors come from the
+    URL, so anything encode_cursor() could not have produced is rejected
+    rather than passed on to the database.
+    """
+    if value is None or isinstance(value, (bool, list, dict)):
+        raise TypeError(f'unexpected {type(value).__name__} for {column.key}')
+    python_type = column.type.python_type
+    if python_type is datetime:
+        if not isinstance(value, str):
+            raise TypeError(f'expected an ISO timestamp for {column.key}')
+        return datetime.fromisoformat(value)
+    if python_type is int:
+        if isinstance(value, float):
+            raise TypeError(f'expected an integer for {column.key}')
+        value = int(value)
+        bits = 63 if isinstance(column.type, BigInteger) else 31
+        if isinstance(column.type, Integer) and not -2 ** bits <= value < 2 ** bits:
+            raise ValueError(f'{column.key} out of range')
+        return value
+    if python_type is str and not isinstance(value, str):
+        raise TypeError(f'expected a string for {column.key}')
+    return python_type(value)
+
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor back into sort-key values typed for `columns`. Raises InvalidCursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('wrong number of values')
+        return [_coerce(v, c) for v, c in zip(values, columns)]
+    except (ValueError, TypeError, RecursionError) as e:
+        raise InvalidCursor(f'Invalid cursor: {cursor!r}') from e
+
+
+def keyset_page(query, columns, cursor=None, limit=20, descending=False):
+    """
+    Fetch one page of `query` ordered by `columns` (which must end in a unique
+    column such as the primary key) starting after `cursor`.
+
+    Uses a row-value comparison, (a, b) > (:a, :b), instead of OFFSET, so every
+    page is an index range scan no matter how deep it is.
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    if cursor:
+        values = decode_cursor(cursor, columns)
+        key = tuple_(*columns)
+        bound = tuple_(*[literal(v, c.type) for v, c in zip(values, columns)])
+        query = query.filter(key < bound if descending else key > bound)
+    order = [c.desc() for c in columns] if descending else list(columns)
+    rows = query.order_by(*order).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], c.key) for c in columns])
+    return rows, next_cursor
@@ -0,0 +1,194 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 200))
+# Idle poll interval; new events in this process wake the worker immediately
+WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 2))
+# How long an M-PESA callback that arrived before its order's CheckoutRequestID was saved keeps being retried
+WEBHOOK_RESOLVE_TIMEOUT = int(os.environ.get('WEBHOOK_RESOLVE_TIMEOUT', 3600))
+
+# Order states each target state may be entered from. Settled payments never
+# move backwards: nothing leaves 'success', and a late failure cannot undo it.
+ORDER_TRANSITIONS = {
+    'pending': ('initiating',),
+    'failed': ('initiating', 'pending'),
+    'success': ('initiating', 'pending', 'failed'),
+}
+
+
+def apply_status_updates(db, order_model, updates, on_change=None):
+    """
+    Apply {reference: new status} with one guarded UPDATE per target status,
+    so out-of-order or repeated notifications cannot regress an order.
+
+    With `on_change`, there is one UPDATE ... RETURNING per (previous, new)
+    status pair instead, and `on_change(previous, status, order_ids)` is
+    called in the same transaction for the orders that actually moved, so a
+    repeated notification never triggers it twice. Does not commit. Returns
+    the number of orders changed.
+    """
+    by_status = {}
+    for reference, status in updates.items():
+        by_status.setdefault(status, []).append(reference)
+    changed = 0
+    for status, references in by_status.items():
+        if on_change is None:
+            result = db.session.execute(
+                update(order_model)
+                .where(order_model.reference.in_(references), order_model.status.in_(ORDER_TRANSITIONS[status]))
+                .values(status=status)
+                .execution_options(synchronize_session=False)
+            )
+            changed += result.rowcount
+            continue
+        for previous in ORDER_TRANSITIONS[status]:
+            order_ids = db.session.scalars(
+                update(order_model)
+                .where(order_model.reference.in_(references), order_model.status == previous)
+                .values(status=status)
+                .returning(order_model.id)
+                .execution_options(synchronize_session=False)
+            ).all()
+            if order_ids:
+                on_change(previous, status, order_ids)
+                changed += len(order_ids)
+    return changed
+
+
+def record_event(db, event_model, provider, event_id, event_type, reference, status, payload):
+    """
+    Append a provider notification to the event log. Duplicate deliveries
+    (same provider and event id) are ignored. Commits; returns True if new.
+    """
+    table = event_model.__table__
+    values = {'provider': provider, 'event_id': event_id, 'event_type': event_type, 'reference': reference,
+              'status': status, 'payload': json.dumps(payload), 'received_at': datetime.utcnow()}
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        exists = db.session.query(event_model.id).filter_by(provider=provider, event_id=event_id).first()
+        if exists:
+            return False
+        db.session.execute(table.insert().values(**values))
+        db.session.commit()
+        return True
+    result = db.session.execute(insert(table).values(**values).on_conflict_do_nothing(
+        index_elements=[table.c.provider, table.c.event_id]))
+    db.session.commit()
+    return result.rowcount > 0
+
+
+class PaymentEventProcessor:
+    """
+    Background worker that applies logged payment events to orders in batches:
+    each batch is one transaction with one guarded UPDATE per target status.
+    Started lazily in each process that serves requests; with several workers
+    the row locks are skipped (PostgreSQL) and the guards make any overlap
+    harmless. `on_status_change` is passed to apply_status_updates.
+
+    An M-PESA callback can arrive before the payment worker has saved the
+    order's CheckoutRequestID, and is then logged without a reference. Such
+    events are matched to their order when processed; until that works they
+    stay unprocessed and are retried with every batch, for up to
+    `resolve_timeout` seconds.
+    """
+
+    def __init__(self, app, db, event_model, order_model, on_status_change=None,
+                 batch_size=WEBHOOK_BATCH_SIZE, interval=WEBHOOK_POLL_INTERVAL,
+                 resolve_timeout=WEBHOOK_RESOLVE_TIMEOUT):
+        self.app = app
+        self.db = db
+        self.event_model = event_model
+        self.order_model = order_model
+        self.on_status_change = on_status_change
+        self.batch_size = batch_size
+        self.interval = interval
+        self.resolve_timeout = resolve_timeout
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='payment-events', daemon=True).start()
+
+    def notify(self):
+        """Wake the worker after recording an event."""
+        self.ensure_started()
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    while self.process_batch() >= self.batch_size:
+                        pass
+            except Exception as e:
+                print(f"Payment event processing failed: {e}")
+
+    def process_batch(self):
+        """Apply up to batch_size unprocessed events. Returns how many were handled."""
+        Event = self.event_model
+        unprocessed = Event.query.filter(Event.processed_at.is_(None))
+        # Callbacks still waiting for their order are fetched separately, so they never hold up the queue
+        unmatched = (Event.provider == 'mpesa') & Event.reference.is_(None) & Event.status.is_not(None)
+        events = (unprocessed.filter(~unmatched).order_by(Event.id)
+                  .limit(self.batch_size).with_for_update(skip_locked=True).all())
+        waiting = (unprocessed.filter(unmatched).order_by(Event.id)
+                   .limit(self.batch_size).with_for_update(skip_locked=True).all())
+        events += self._match_orders(waiting)
+        if not events:
+            self.db.session.rollback()
+            return 0
+
+        updates = {}
+        for event in events:
+            if event.reference and event.status:
+                # Success outranks failure whatever order the events arrived in
+                if updates.get(event.reference) != 'success':
+                    updates[event.reference] = event.status
+        changed = apply_status_updates(self.db, self.order_model, updates, self.on_status_change)
+        self.db.session.execute(
+            update(Event).where(Event.id.in_([event.id for event in events]))
+            .values(processed_at=datetime.utcnow()).execution_options(synchronize_session=False)
+        )
+        self.db.session.commit()
+        print(f"Applied {len(events)} payment events ({changed} orders updated)")
+        return len(events)
+
+    def _match_orders(self, events):
+        """
+        Fill in the order reference of M-PESA callbacks by CheckoutRequestID
+        (their event id). Returns the events that are ready to process: the
+        matched ones and those that waited longer than resolve_timeout, which
+        are given up on.
+        """
+        if not events:
+            return []
+        Order = self.order_model
+        references = dict(self.db.session.query(Order.checkout_request_id, Order.reference).filter(
+            Order.checkout_request_id.in_([event.event_id for event in events])))
+        expired = datetime.utcnow() - timedelta(seconds=self.resolve_timeout)
+        ready = []
+        for event in events:
+            if event.event_id in references:
+                event.reference = references[event.event_id]
+                ready.append(event)
+            elif event.received_at < expired:
+                print(f"Giving up on {event.provider} event {event.event_id}: no order matches it")
+                ready.append(event)
+        return ready
@@ -0,0 +1,152 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import record_outbound
+
+# (connect, read) timeouts in seconds for calls to payment providers
+PAYMENT_CONNECT_TIMEOUT = float(os.environ.get('PAYMENT_CONNECT_TIMEOUT', 3.05))
+PAYMENT_READ_TIMEOUT = float(os.environ.get('PAYMENT_READ_TIMEOUT', 15))
+PAYMENT_POOL_SIZE = int(os.environ.get('PAYMENT_POOL_SIZE', 10))
+PAYMENT_MAX_RETRIES = int(os.environ.get('PAYMENT_MAX_RETRIES', 2))
+# Consecutive failures before a host's circuit opens, and how long it stays open
+PAYMENT_BREAKER_THRESHOLD = int(os.environ.get('PAYMENT_BREAKER_THRESHOLD', 5))
+PAYMENT_BREAKER_COOLDOWN = float(os.environ.get('PAYMENT_BREAKER_COOLDOWN', 30))
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised without making a request while a host's circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker. After `threshold` consecutive failures the circuit
+    opens and calls fail fast for `cooldown` seconds; then a single trial call
+    is let through and its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold=PAYMENT_BREAKER_THRESHOLD, cooldown=PAYMENT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                # Half-open: let one trial call through and push the window forward
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class PaymentHTTPClient:
+    """
+    Shared HTTP client for payment provider APIs.
+
+    Keeps a pooled keep-alive requests.Session per process, so checkouts reuse
+    TCP/TLS connections. Every call has connect and read timeouts. Idempotent
+    calls are retried on connection errors and 502/503/504 with jittered
+    exponential backoff, and each host sits behind a circuit breaker.
+    """
+
+    def __init__(self, pool_size=PAYMENT_POOL_SIZE, max_retries=PAYMENT_MAX_RETRIES,
+                 timeout=(PAYMENT_CONNECT_TIMEOUT, PAYMENT_READ_TIMEOUT)):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._session = None
+        self._pid = None
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Sockets must not be shared across forked gunicorn workers
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._breakers = {}
+                    self._pid = os.getpid()
+        return self._session
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker()
+            return self._breakers[host]
+
+    def request(self, method, url, idempotent=None, timeout=None, service=None, **kwargs):
+        """
+        Send a request and return the response. Raises requests exceptions on
+        failure, or CircuitOpenError if the host's circuit is open. Each attempt
+        is timed under `service` (default: the host) in the outbound metrics.
+        """
+        method = method.upper()
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        session = self.session
+        breaker = self.breaker(url)
+        service = service or urlsplit(url).netloc
+
+        for attempt in range(attempts):
+            if not breaker.allow():
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}; not calling the payment API.")
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                record_outbound(service, time.perf_counter() - started, ok=False)
+                breaker.record_failure()
+                if attempt == attempts - 1:
+                    raise
+            else:
+                record_outbound(service, time.perf_counter() - started, ok=response.status_code < 500)
+                if response.status_code in RETRY_STATUSES:
+                    breaker.record_failure()
+                    if attempt == attempts - 1:
+                        return response
+                else:
+                    breaker.record_success()
+                    return response
+            # Full jitter backoff: 0..(0.25s * 2^attempt)
+            time.sleep(random.uniform(0, 0.25 * 2 ** attempt))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+# Process-wide client shared by paystack_handler and mpesa_handler
+payment_http = PaymentHTTPClient()
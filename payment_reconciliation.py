@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from pagination import keyset_page
+from payment_events import apply_status_updates
+
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', 100))
+# Concurrent provider status queries per batch
+RECONCILE_WORKERS = int(os.environ.get('RECONCILE_WORKERS', 8))
+# Unsettled orders younger than this are left for their webhook, callback or payment request
+RECONCILE_STALE_AFTER = int(os.environ.get('RECONCILE_STALE_AFTER', 900))
+# Seconds between in-process runs, in every app process; 0 (the default) leaves it to one
+# `flask reconcile-payments` cron job
+RECONCILE_INTERVAL = int(os.environ.get('RECONCILE_INTERVAL', 0))
+
+
+class PaymentReconciler:
+    """
+    Settles orders whose webhook or callback never arrived, and orders left
+    'initiating' because their payment request was lost (a worker restart or
+    crash while it was queued or running).
+
+    Walks stale 'pending' and 'initiating' orders oldest first in keyset
+    batches, asks each order's provider for its status through a bounded
+    thread pool, and applies the results with one guarded bulk UPDATE and one
+    commit per batch. Each batch's orders stay row-locked until that commit
+    and runs skip locked rows, so overlapping runs (a cron job and a manual
+    one, or RECONCILE_INTERVAL in several workers) never query a provider
+    about the same order at once. A stale 'initiating' order the provider has no outcome
+    for is failed, so `on_status_change` puts its stock back on sale; if the
+    customer did pay, the late success still settles it.
+    `lookup(reference, provider, checkout_request_id)` returns 'success',
+    'failed' or None (still unresolved), and may raise. `on_status_change` is
+    passed to apply_status_updates.
+    """
+
+    def __init__(self, app, db, order_model, lookup, on_status_change=None, batch_size=RECONCILE_BATCH_SIZE,
+                 workers=RECONCILE_WORKERS, stale_after=RECONCILE_STALE_AFTER, interval=RECONCILE_INTERVAL):
+        self.app = app
+        self.db = db
+        self.order_model = order_model
+        self.lookup = lookup
+        self.on_status_change = on_status_change
+        self.batch_size = batch_size
+        self.workers = workers
+        self.stale_after = stale_after
+        self.interval = interval
+        self.last_run = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the periodic job in this process, if RECONCILE_INTERVAL enables it."""
+        if not self.interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='payment-reconciler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    stats = self.run()
+                if stats['checked']:
+                    print(f"Reconciled {stats['checked']} stale orders ({stats['updated']} updated)")
+            except Exception as e:
+                print(f"Payment reconciliation failed: {e}")
+
+    def _lookup(self, row):
+        try:
+            return self.lookup(row.reference, row.payment_provider, row.checkout_request_id), None
+        except Exception as e:
+            return None, e
+
+    def _stale_orders(self, now):
+        """Unsettled orders older than the staleness window, claimed with FOR UPDATE SKIP LOCKED where supported."""
+        Order = self.order_model
+        return self.db.session.query(
+            Order.id, Order.reference, Order.status, Order.payment_provider, Order.checkout_request_id,
+            Order.created_at
+        ).filter(Order.status.in_(('initiating', 'pending')),
+                 Order.created_at < now - timedelta(seconds=self.stale_after)
+                 ).with_for_update(skip_locked=True, of=Order)
+
+    def run(self, limit=None):
+        """
+        Reconcile every stale unsettled order (or the first `limit`). Returns
+        throughput and lag metrics, also kept in last_run.
+        """
+        Order = self.order_model
+        started = time.monotonic()
+        now = datetime.utcnow()
+        query = self._stale_orders(now)
+        stats = {'checked': 0, 'updated': 0, 'expired': 0, 'unresolved': 0, 'errors': 0, 'batches': 0,
+                 'oldest_pending_seconds': None}
+
+        cursor = None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='reconcile') as pool:
+            while limit is None or stats['checked'] < limit:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - stats['checked'])
+                rows, cursor = keyset_page(query, [Order.created_at, Order.id], cursor, size)
+                if not rows:
+                    break
+                if stats['oldest_pending_seconds'] is None:
+                    # Lag: how long the oldest unsettled order has been waiting
+                    stats['oldest_pending_seconds'] = round((now - rows[0].created_at).total_seconds(), 1)
+
+                updates = {}
+                for row, (status, error) in zip(rows, pool.map(self._lookup, rows)):
+                    if error is not None:
+                        stats['errors'] += 1
+                        print(f"Could not check payment status of {row.reference}: {error}")
+                    elif status is None and row.status == 'initiating':
+                        # Its payment request never reached the provider (or was never answered)
+                        updates[row.reference] = 'failed'
+                        stats['expired'] += 1
+                    elif status is None:
+                        stats['unresolved'] += 1
+                    else:
+                        updates[row.reference] = status
+                stats['updated'] += apply_status_updates(self.db, Order, updates, self.on_status_change)
+                self.db.session.commit()
+                stats['checked'] += len(rows)
+                stats['batches'] += 1
+                if cursor is None:
+                    break
+
+        elapsed = time.monotonic() - started
+        stats['seconds'] = round(elapsed, 3)
+        stats['orders_per_second'] = round(stats['checked'] / elapsed, 1) if elapsed else None
+        stats['finished_at'] = datetime.utcnow().isoformat()
+        self.last_run = stats
+        return stats
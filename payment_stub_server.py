@@ -0,0 +1,91 @@
+"""
+Local stand-in for the Paystack and Safaricom Daraja APIs.
+
+Lets checkout be exercised and benchmarked offline. Start it and point the
+handlers at it:
+
+    python payment_stub_server.py --port 8099 --latency 0.2
+    PAYSTACK_BASE_URL=http://127.0.0.1:8099 MPESA_BASE_URL=http://127.0.0.1:8099 python app.py
+
+Benchmarks can also embed it with start_stub_server().
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class PaymentStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real APIs
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output clean
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path.startswith('/oauth/v1/generate'):
+            self._send_json({'access_token': 'stub-token', 'expires_in': '3599'})
+        elif self.path.startswith('/transaction/verify/'):
+            reference = self.path.rsplit('/', 1)[-1]
+            self._send_json({'status': True, 'data': {'reference': reference, 'status': 'success'}})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        data = self._read_json()
+        if self.path == '/charge':
+            reference = data.get('reference') or f'STUB_{uuid.uuid4().hex[:12]}'
+            self._send_json({'status': True, 'message': 'Charge attempted',
+                             'data': {'reference': reference, 'status': 'pay_offline'}})
+        elif self.path == '/mpesa/stkpush/v1/processrequest':
+            self._send_json({'MerchantRequestID': uuid.uuid4().hex[:10],
+                             'CheckoutRequestID': f'ws_CO_{uuid.uuid4().hex[:16]}',
+                             'ResponseCode': '0',
+                             'ResponseDescription': 'Success. Request accepted for processing',
+                             'CustomerMessage': 'Success. Request accepted for processing'})
+        elif self.path == '/mpesa/stkpushquery/v1/query':
+            self._send_json({'ResponseCode': '0', 'ResultCode': '0',
+                             'CheckoutRequestID': data.get('CheckoutRequestID'),
+                             'ResultDesc': 'The service request is processed successfully.'})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+
+def start_stub_server(host='127.0.0.1', port=0, latency=0.0):
+    """Start the stub in a daemon thread. Returns (server, base_url); call server.shutdown() to stop."""
+    handler = type('ConfiguredPaymentStubHandler', (PaymentStubHandler,), {'latency': latency})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds of simulated upstream latency per call')
+    args = parser.parse_args()
+    server, base_url = start_stub_server(args.host, args.port, args.latency)
+    print(f"Payment stub listening on {base_url} (latency {args.latency}s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
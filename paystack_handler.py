@@ -1,9 +1,18 @@
+import hashlib
+import hmac
 import os
-import requests
 from dotenv import load_dotenv
+from payment_http import payment_http
 
 load_dotenv()
 
+# Override to point at a local stub (see payment_stub_server.py)
+PAYSTACK_BASE_URL = os.environ.get('PAYSTACK_BASE_URL', 'https://api.paystack.co')
+# Webhook events that settle an order, mapped to the order status they imply
+WEBHOOK_EVENT_STATUSES = {'charge.success': 'success', 'charge.failed': 'failed'}
+# Transaction statuses from /transaction/verify that settle an order; others are still in progress
+TRANSACTION_STATUSES = {'success': 'success', 'failed': 'failed', 'abandoned': 'failed', 'reversed': 'failed'}
+
 def initiate_mpesa_charge(phone_number, amount, email="customer@example.com", reference=None):
     """
     Initiates an M-Pesa charge via Paystack.
@@ -21,7 +30,7 @@ def initiate_mpesa_charge(phone_number, amount, email="customer@example.com", re
     # Amount in kobo (Paystack uses kobo, 1 KES = 100 kobo)
     amount_kobo = int(amount * 100)
 
-    url = "https://api.paystack.co/charge"
+    url = f"{PAYSTACK_BASE_URL}/charge"
     headers = {
         "Authorization": f"Bearer {paystack_secret_key}",
         "Content-Type": "application/json"
@@ -39,10 +48,50 @@ def initiate_mpesa_charge(phone_number, amount, email="customer@example.com", re
         data["reference"] = reference
 
     try:
-        response = requests.post(url, json=data, headers=headers)
+        # Not retried: a charge POST is not idempotent
+        response = payment_http.post(url, json=data, headers=headers, service='paystack')
         if response.status_code == 200:
             return response.json()
         else:
             return {"error": f"API error: {response.status_code} - {response.text}"}
     except Exception as e:
         return {"error": str(e)}
+
+def verify_transaction(reference):
+    """
+    Looks up a transaction by reference. Returns the order status it implies
+    ('success' or 'failed'), or None while it is still in progress or if
+    Paystack has no charge with that reference. Raises if Paystack cannot be
+    reached or rejects the lookup.
+    """
+    paystack_secret_key = os.environ.get('PAYSTACK_SECRET_KEY')
+    if not paystack_secret_key:
+        raise RuntimeError("Paystack secret key not configured.")
+
+    url = f"{PAYSTACK_BASE_URL}/transaction/verify/{reference}"
+    headers = {"Authorization": f"Bearer {paystack_secret_key}"}
+    response = payment_http.get(url, headers=headers, service='paystack')
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    status = (response.json().get('data') or {}).get('status')
+    return TRANSACTION_STATUSES.get(status)
+
+def verify_webhook_signature(body, signature):
+    """
+    Checks the x-paystack-signature header: an HMAC-SHA512 of the raw request
+    body keyed with the secret key. Fails closed when no key is configured.
+    """
+    paystack_secret_key = os.environ.get('PAYSTACK_SECRET_KEY')
+    if not paystack_secret_key or not signature:
+        return False
+    expected = hmac.new(paystack_secret_key.encode(), body, hashlib.sha512).hexdigest()
+    # Compared as bytes: compare_digest raises TypeError for a str header with non-ASCII characters
+    return hmac.compare_digest(expected.encode(), signature.encode('utf-8', 'replace'))
+
+def webhook_event_id(payload, body):
+    """A stable id for deduplicating redeliveries of the same webhook event."""
+    data = payload.get('data') or {}
+    if data.get('id'):
+        return f"{payload.get('event')}:{data['id']}"
+    return hashlib.sha256(body).hexdigest()
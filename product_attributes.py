@@ -0,0 +1,122 @@
+import os
+import re
+
+from sqlalchemy import func, select
+
+# Facets recognised in spec text, checked in order; specs that match none are plain features
+ATTRIBUTE_PATTERNS = [
+    ('Processor', re.compile(r'\b(intel|amd|ryzen|core i\d|apple m\d|snapdragon|celeron|pentium)\b', re.I)),
+    ('RAM', re.compile(r'\b\d+\s*gb\s*(ram|ddr\d*|lpddr\d*)\b', re.I)),
+    ('Storage', re.compile(r'\b\d+\s*(gb|tb)\s*(ssd|nvme|hdd|emmc)\b', re.I)),
+]
+FACET_NAMES = [name for name, _ in ATTRIBUTE_PATTERNS]
+# In "24,000mAh" the comma is a thousands separator: a standalone 1-3 digit number, then exactly three digits
+THOUSANDS_HEAD = re.compile(r'(?:^|[^\w.])\d{1,3}$')
+THOUSANDS_TAIL = re.compile(r'^\d{3}(?!\d)')
+# Query parameter carrying "Name:Value" facet filters, repeated for several
+FACET_PARAM = 'f'
+# Options listed per facet in the sidebar (selected options are always listed)
+FACET_OPTION_LIMIT = int(os.environ.get('FACET_OPTION_LIMIT', 12))
+
+
+def split_description(text):
+    """Split a legacy comma-joined description into spec lines, keeping numbers like 24,000 whole."""
+    parts = []
+    for part in (text or '').split(','):
+        if parts and THOUSANDS_HEAD.search(parts[-1]) and THOUSANDS_TAIL.match(part):
+            parts[-1] += ',' + part
+        else:
+            parts.append(part)
+    return [part.strip() for part in parts if part.strip()]
+
+
+def attribute_name(value):
+    """The facet a spec line belongs to ('Processor', 'RAM', 'Storage'), or None."""
+    for name, pattern in ATTRIBUTE_PATTERNS:
+        if pattern.search(value):
+            return name
+    return None
+
+
+def attribute_rows(specs):
+    """
+    Attribute mappings (name, value, position) for a product's specs, given as
+    strings (the facet name is inferred) or {'name', 'value'} dicts.
+    """
+    rows = []
+    for spec in specs:
+        if isinstance(spec, dict):
+            value, name = str(spec.get('value') or '').strip(), spec.get('name') or None
+        else:
+            value = str(spec).strip()
+            name = attribute_name(value)
+        if value:
+            rows.append({'name': name, 'value': value, 'position': len(rows)})
+    return rows
+
+
+def parse_facets(params):
+    """{name: [values]} from "Name:Value" query parameters, sorted so equal filters share cache keys."""
+    selected = {}
+    for param in params:
+        name, sep, value = param.partition(':')
+        if sep and name in FACET_NAMES and value:
+            selected.setdefault(name, set()).add(value)
+    return {name: sorted(selected[name]) for name in FACET_NAMES if name in selected}
+
+
+def facet_params(selected):
+    """The "Name:Value" query parameters for a parse_facets() result."""
+    return [f'{name}:{value}' for name, values in selected.items() for value in values]
+
+
+def filter_by_facets(query, product_model, attribute_model, selected, exclude=None):
+    """
+    Restrict a product query to the selected facet values: any of a facet's
+    values (OR), across every facet (AND). Each facet is one indexed
+    semi-join on (name, value, product_id).
+    """
+    for name, values in selected.items():
+        if name == exclude:
+            continue
+        query = query.filter(product_model.id.in_(
+            select(attribute_model.product_id)
+            .where(attribute_model.name == name, attribute_model.value.in_(values))))
+    return query
+
+
+def facet_counts(db, product_model, attribute_model, selected, category=None, limit=FACET_OPTION_LIMIT):
+    """
+    Product counts per facet value, computed in SQL: {name: [(value, count)]},
+    most common first. Each facet is counted with only the *other* facets'
+    filters applied, so choosing one RAM size still shows how many products
+    the other sizes would add. Facets without a selection share one query.
+    """
+    Product, Attribute = product_model, attribute_model
+
+    def count(exclude, names):
+        query = (db.session.query(Attribute.name, Attribute.value, func.count(func.distinct(Attribute.product_id)))
+                 .join(Product, Product.id == Attribute.product_id)
+                 .filter(Attribute.name.in_(names)))
+        if category:
+            query = query.filter(Product.category == category)
+        query = filter_by_facets(query, Product, Attribute, selected, exclude=exclude)
+        return query.group_by(Attribute.name, Attribute.value).all()
+
+    rows = []
+    unselected = [name for name in FACET_NAMES if name not in selected]
+    if unselected:
+        rows += count(None, unselected)
+    for name in selected:
+        rows += count(name, [name])
+
+    options = {}
+    for name, value, n in rows:
+        options.setdefault(name, []).append((value, n))
+    facets = {}
+    for name in FACET_NAMES:
+        if name in options:
+            ranked = sorted(options[name], key=lambda option: (-option[1], option[0]))
+            chosen = set(selected.get(name, ()))
+            facets[name] = [option for i, option in enumerate(ranked) if i < limit or option[0] in chosen]
+    return facets
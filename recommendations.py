@@ -0,0 +1,273 @@
+import os
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select, update
+
+# Neighbours stored per product in each list
+RECS_TOP_K = int(os.environ.get('RECS_TOP_K', 8))
+# Rows of the similarity matrix computed at once; memory is RECS_BLOCK_SIZE x (largest category) floats
+RECS_BLOCK_SIZE = int(os.environ.get('RECS_BLOCK_SIZE', 1000))
+# Orders read from the basket source per co-purchase batch
+RECS_ORDER_BATCH = int(os.environ.get('RECS_ORDER_BATCH', 5000))
+# Rows per IN (...) lookup and per bulk write
+WRITE_BATCH_SIZE = 500
+
+
+def _numeric():
+    """NumPy and SciPy are only needed by the offline builder, not to serve recommendations."""
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError:
+        raise RuntimeError("Building recommendations needs NumPy and SciPy: pip install numpy scipy")
+    return np, sparse
+
+
+def encode_ids(ids):
+    return ','.join(str(i) for i in ids)
+
+
+def decode_ids(text):
+    return [int(i) for i in text.split(',')] if text else []
+
+
+def _chunks(items, size=WRITE_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def similar_products(db, product_model, attribute_model, categories=None, top_k=RECS_TOP_K,
+                     block_size=RECS_BLOCK_SIZE):
+    """
+    The `top_k` most similar products in the same category for every product
+    (of `categories`, when given): {product_id: [ids, best first]}.
+
+    Products are rows of a sparse TF-IDF matrix over their spec values, so
+    rare shared specs count for more than common ones; cosine similarity is
+    one sparse product per block of rows. Closeness in (log) price breaks ties,
+    so products without specs still get their nearest-priced neighbours.
+    """
+    np, sparse = _numeric()
+    Product, Attribute = product_model, attribute_model
+    query = db.session.query(Product.id, Product.category, Product.price)
+    if categories is not None:
+        query = query.filter(Product.category.in_(list(categories)))
+    products = query.order_by(Product.id).all()
+    if not products:
+        return {}
+    ids = np.array([row[0] for row in products])
+    _, category_codes = np.unique([row[1] for row in products], return_inverse=True)
+    log_price = np.log1p(np.maximum(np.array([row[2] or 0 for row in products], dtype=np.float32), 0))
+    position = {product_id: i for i, product_id in enumerate(ids.tolist())}
+
+    rows, columns, tokens = [], [], {}
+    attributes = db.session.query(Attribute.product_id, Attribute.name, Attribute.value)
+    if categories is not None:
+        attributes = attributes.join(Product, Product.id == Attribute.product_id).filter(
+            Product.category.in_(list(categories)))
+    for product_id, name, value in attributes:
+        if product_id in position:
+            rows.append(position[product_id])
+            columns.append(tokens.setdefault(f'{name}:{value.strip().lower()}', len(tokens)))
+    features = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, columns)),
+                                 shape=(len(ids), max(len(tokens), 1)))
+    features.data[:] = 1  # Repeated specs count once
+    document_frequency = np.bincount(features.indices, minlength=features.shape[1])
+    idf = (np.log((1 + len(ids)) / (1 + document_frequency)) + 1).astype(np.float32)
+    features = features @ sparse.diags(idf)
+    norms = np.sqrt(np.asarray(features.multiply(features).sum(axis=1)).ravel())
+    features = (sparse.diags(1 / np.where(norms > 0, norms, 1)) @ features).astype(np.float32).tocsr()
+
+    neighbours = {}
+    for code in range(category_codes.max() + 1):
+        members = np.flatnonzero(category_codes == code)
+        k = min(top_k, len(members) - 1)
+        if k <= 0:
+            neighbours.update((int(ids[i]), []) for i in members)
+            continue
+        block_features = features[members]
+        for start in range(0, len(members), block_size):
+            block = members[start:start + block_size]
+            scores = (block_features[start:start + block_size] @ block_features.T).toarray()
+            scores += 1e-3 * np.exp(-np.abs(log_price[block, None] - log_price[None, members]))
+            scores[np.arange(len(block)), np.arange(start, start + len(block))] = -np.inf
+            top = np.argpartition(scores, -k, axis=1)[:, -k:]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+            best = ids[members[np.take_along_axis(top, order, axis=1)]]
+            neighbours.update(zip(ids[block].tolist(), best.tolist()))
+    return neighbours
+
+
+def copurchase_counts(pairs):
+    """
+    Co-purchase counts from (order_id, product_id) pairs as
+    {product_id: {other_id: orders containing both}}: the off-diagonal of
+    BᵀB for the sparse order-by-product basket matrix B.
+    """
+    np, sparse = _numeric()
+    if not pairs:
+        return {}
+    orders, products = np.array(pairs).T
+    _, order_index = np.unique(orders, return_inverse=True)
+    product_ids, product_index = np.unique(products, return_inverse=True)
+    baskets = sparse.csr_matrix((np.ones(len(pairs)), (order_index, product_index)),
+                                shape=(order_index.max() + 1, len(product_ids)))
+    baskets.data[:] = 1  # Several lines of one product in an order count once
+    counts = (baskets.T @ baskets).tocoo()
+    off_diagonal = counts.row != counts.col
+    result = {}
+    for row, col, n in zip(product_ids[counts.row[off_diagonal]].tolist(),
+                           product_ids[counts.col[off_diagonal]].tolist(),
+                           counts.data[off_diagonal].astype(int).tolist()):
+        result.setdefault(row, {})[col] = n
+    return result
+
+
+class RecommendationBuilder:
+    """
+    Offline builder for the precomputed product neighbours that product
+    pages read with one primary-key lookup.
+
+    - "Similar" lists come from spec similarity within a category
+      (similar_products). Incremental runs only recompute categories with
+      products that have no recommendation row yet; a full run redoes all.
+    - "Bought together" lists come from pair counts kept in the co-purchase
+      table. Each run reads the orders after the last run's watermark from
+      `basket_source(after_id, limit)`, which returns ((order_id, product_id)
+      pairs, new watermark); it adds their counts and re-ranks only the
+      products those orders touched.
+    - Orders paid after the watermark passed them (a success after a
+      failure, or after the basket source stopped waiting) are queued by
+      orders_paid() in the backlog table and counted by the next run. An
+      order the run already read as paid is skipped, so each basket counts
+      once.
+    """
+
+    def __init__(self, db, product_model, attribute_model, recommendation_model, copurchase_model, run_model,
+                 basket_source=None, top_k=RECS_TOP_K, backlog_model=None, item_model=None):
+        self.db = db
+        self.Product = product_model
+        self.Attribute = attribute_model
+        self.Recommendation = recommendation_model
+        self.Copurchase = copurchase_model
+        self.Run = run_model
+        self.basket_source = basket_source
+        self.top_k = top_k
+        self.Backlog = backlog_model
+        self.Item = item_model
+
+    def watermark(self):
+        """The last order id folded into the co-purchase counts."""
+        return self.db.session.query(func.max(self.Run.last_order_id)).scalar() or 0
+
+    def run(self, full=False):
+        """Rebuild what changed since the last run (everything with `full`). Commits; returns stats."""
+        started = time.perf_counter()
+        db = self.db
+        if full:
+            db.session.execute(delete(self.Copurchase))
+            db.session.execute(delete(self.Run))
+            db.session.execute(update(self.Recommendation).values(bought_with=''))
+            categories = None
+        else:
+            categories = [category for category, in db.session.query(self.Product.category).distinct().filter(
+                ~self.Product.id.in_(db.session.query(self.Recommendation.product_id)))]
+        similar = similar_products(db, self.Product, self.Attribute, categories, self.top_k) \
+            if categories is None or categories else {}
+
+        last_order_id, orders, bought, counted = self.watermark(), 0, {}, set()
+        while self.basket_source is not None:
+            pairs, new_watermark = self.basket_source(last_order_id, RECS_ORDER_BATCH)
+            if new_watermark is None or new_watermark <= last_order_id:
+                break
+            batch_orders = {order_id for order_id, _ in pairs}
+            orders += len(batch_orders)
+            counted |= batch_orders
+            bought.update(self._add_copurchases(copurchase_counts(pairs)))
+            last_order_id = new_watermark
+        late = self._claim_backlog(last_order_id, counted)
+        if late:
+            orders += len({order_id for order_id, _ in late})
+            bought.update(self._add_copurchases(copurchase_counts(late)))
+
+        self._write(similar, bought)
+        stats = {'full': full, 'last_order_id': last_order_id, 'orders': orders,
+                 'similar_updated': len(similar), 'bought_updated': len(bought),
+                 'seconds': round(time.perf_counter() - started, 3)}
+        db.session.add(self.Run(finished_at=datetime.utcnow(), **stats))
+        db.session.commit()
+        return stats
+
+    def orders_paid(self, order_ids):
+        """
+        Queue the lines of orders that were just paid, in case the watermark
+        already passed them as unpaid. Call inside the transaction that marks
+        them paid; it only appends rows, so payments never wait on a build.
+        """
+        if self.Backlog is None:
+            return
+        Item = self.Item
+        self.db.session.execute(insert(self.Backlog).from_select(
+            ['order_id', 'product_id'],
+            select(Item.order_id, Item.product_id).where(Item.order_id.in_(order_ids), Item.product_id.is_not(None))))
+
+    def _claim_backlog(self, last_order_id, counted):
+        """
+        Take the queued lines of paid orders up to the watermark and return
+        the (order_id, product_id) pairs of those not in `counted`, the orders
+        this run read as paid. A line queued after this run read its order is
+        claimed by this run or, if queued later still, by the next one; either
+        way the order was read as unpaid, so nothing is counted twice.
+        """
+        if self.Backlog is None:
+            return []
+        Backlog = self.Backlog
+        rows = self.db.session.query(Backlog.id, Backlog.order_id, Backlog.product_id).filter(
+            Backlog.order_id <= last_order_id).all()
+        for ids in _chunks(row[0] for row in rows):
+            self.db.session.execute(delete(Backlog).where(Backlog.id.in_(ids)))
+        return [(order_id, product_id) for _, order_id, product_id in rows if order_id not in counted]
+
+    def _add_copurchases(self, increments):
+        """Add pair counts to the co-purchase table; returns the re-ranked lists of the products touched."""
+        table = self.Copurchase.__table__
+        ranked = {}
+        for product_ids in _chunks(increments):
+            merged = {product_id: dict(increments[product_id]) for product_id in product_ids}
+            for product_id, other_id, count in self.db.session.query(
+                    table.c.product_id, table.c.other_id, table.c.count).filter(table.c.product_id.in_(product_ids)):
+                merged[product_id][other_id] = merged[product_id].get(other_id, 0) + count
+            self.db.session.execute(delete(table).where(table.c.product_id.in_(product_ids)))
+            self.db.session.execute(insert(table), [
+                {'product_id': product_id, 'other_id': other_id, 'count': count}
+                for product_id, counts in merged.items() for other_id, count in counts.items()])
+            for product_id, counts in merged.items():
+                best = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:self.top_k]
+                ranked[product_id] = [other_id for other_id, _ in best]
+        return ranked
+
+    def _write(self, similar, bought):
+        """Upsert recommendation rows for the products whose lists changed."""
+        model = self.Recommendation
+        now = datetime.utcnow()
+        for product_ids in _chunks(set(similar) | set(bought)):
+            existing = {product_id for product_id, in self.db.session.query(model.product_id)
+                        .filter(model.product_id.in_(product_ids))}
+            updates, inserts = [], []
+            for product_id in product_ids:
+                row = {'product_id': product_id, 'updated_at': now}
+                if product_id in similar:
+                    row['similar'] = encode_ids(similar[product_id])
+                if product_id in bought:
+                    row['bought_with'] = encode_ids(bought[product_id])
+                if product_id in existing:
+                    updates.append(row)
+                else:
+                    inserts.append(dict({'similar': '', 'bought_with': ''}, **row))
+            # Group updates by the columns they set, as bulk updates need uniform keys
+            for keys in {tuple(sorted(row)) for row in updates}:
+                self.db.session.bulk_update_mappings(model, [row for row in updates if tuple(sorted(row)) == keys])
+            if inserts:
+                self.db.session.execute(insert(model), inserts)
@@ -0,0 +1,309 @@
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.exc import IntegrityError
+
+# Orders folded into the rollups per transaction
+ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 5000))
+# Seconds between in-process refreshes; 0 disables them (run `flask refresh-analytics` from cron instead)
+ANALYTICS_INTERVAL = int(os.environ.get('ANALYTICS_INTERVAL', 300))
+# Orders younger than this are left for the next refresh, so one whose checkout commits late is not skipped
+ANALYTICS_LAG = int(os.environ.get('ANALYTICS_LAG', 60))
+# Days shown on the dashboard by default
+ANALYTICS_DAYS = int(os.environ.get('ANALYTICS_DAYS', 30))
+ORDER_STATUSES = ('initiating', 'pending', 'success', 'failed')
+
+
+def _day(value):
+    """func.date() gives a date on PostgreSQL and an ISO string on SQLite."""
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+class SalesRollup:
+    """
+    Incrementally maintained sales rollups behind the admin analytics view:
+    orders and their value per (day, county, city, status), and units,
+    revenue and orders per product from paid orders.
+
+    Each refresh folds the orders after the watermark (the last order id
+    folded) in id order, with one aggregate query and one merge per batch.
+    Orders are folded whatever their status. Later transitions are appended
+    to the delta table by order_status_changed (the apply_status_updates
+    hook), which takes no lock and reads nothing, and the refresh moves the
+    folded orders between status rows. A batch's orders are share-locked
+    while they are folded, so a transition either lands before the fold
+    reads the status (its delta is then dropped) or after it (and is
+    applied). Refreshes in several processes may run at once: deltas are
+    claimed by deleting them, and the watermark only moves from the value a
+    refresh started from, so each order and transition counts once.
+    Dashboard reads only touch the rollups for the days shown.
+    """
+
+    def __init__(self, app, db, order_model, item_model, daily_model, product_model, state_model, delta_model,
+                 batch_size=ANALYTICS_BATCH_SIZE, interval=ANALYTICS_INTERVAL, lag=ANALYTICS_LAG):
+        self.app = app
+        self.db = db
+        self.Order = order_model
+        self.Item = item_model
+        self.Daily = daily_model
+        self.Product = product_model
+        self.State = state_model
+        self.Delta = delta_model
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lag = lag
+        self.last_run = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the periodic refresh in this process, if ANALYTICS_INTERVAL enables it."""
+        if not self.interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='sales-rollup', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    stats = self.run()
+                if stats['orders'] or stats['transitions']:
+                    print(f"Folded {stats['orders']} orders and {stats['transitions']} status changes "
+                          f"into the sales rollups")
+            except Exception as e:
+                print(f"Sales rollup refresh failed: {e}")
+
+    def _watermark(self):
+        """The last order id folded, read without locking; creates the state row on the first refresh."""
+        State = self.State
+        watermark = self.db.session.query(State.last_order_id).filter(State.id == 1).scalar()
+        if watermark is None:
+            try:
+                self.db.session.execute(insert(State).values(id=1, last_order_id=0))
+                self.db.session.commit()
+            except IntegrityError:
+                self.db.session.rollback()  # Another refresh created it first
+            return self._watermark()
+        return watermark
+
+    def _advance(self, watermark, last):
+        """
+        Move the watermark from `watermark` to `last`, locking the state row
+        only from here to the commit. False if another refresh moved it
+        first; the caller must then roll back its batch.
+        """
+        State = self.State
+        result = self.db.session.execute(
+            update(State).where(State.id == 1, State.last_order_id == watermark)
+            .values(last_order_id=last, refreshed_at=datetime.utcnow())
+            .execution_options(synchronize_session=False))
+        return result.rowcount == 1
+
+    def run(self, full=False):
+        """
+        Fold the orders placed and the status changes recorded since the last
+        refresh (every order with `full`). Commits; returns stats.
+        """
+        started = time.perf_counter()
+        db, Order, Delta = self.db, self.Order, self.Delta
+        if full:
+            self._watermark()
+            db.session.execute(update(self.State).where(self.State.id == 1).values(last_order_id=0))
+            db.session.execute(delete(self.Daily))
+            db.session.execute(delete(self.Product))
+            db.session.execute(delete(Delta))
+            db.session.commit()
+
+        stats = {'full': full, 'orders': 0, 'transitions': 0, 'batches': 0}
+        while True:
+            watermark = self._watermark()
+            cutoff = datetime.utcnow() - timedelta(seconds=self.lag)
+            batch = db.session.query(Order.id).filter(Order.id > watermark)
+            young = db.session.query(func.min(Order.id)).filter(
+                Order.id > watermark, Order.created_at >= cutoff).scalar()
+            if young is not None:
+                batch = batch.filter(Order.id < young)
+            batch = batch.order_by(Order.id).limit(self.batch_size).subquery()
+            last = db.session.query(func.max(batch.c.id)).scalar()
+            orders = 0
+            if last is not None:
+                in_batch = (Order.id > watermark, Order.id <= last)
+                # Transitions of these orders wait for this commit, so each is either read or left as a delta
+                db.session.query(Order.id).filter(*in_batch).with_for_update(read=True).all()
+                orders = self._fold(*in_batch)
+                db.session.execute(delete(Delta).where(Delta.order_id > watermark, Delta.order_id <= last))
+            transitions = self._apply_deltas(watermark)
+            if transitions is None or not self._advance(watermark, watermark if last is None else last):
+                db.session.rollback()  # Another refresh got there first; start again from its watermark
+                continue
+            db.session.commit()
+            stats['orders'] += orders
+            stats['transitions'] += transitions
+            if last is not None:
+                stats['batches'] += 1
+                watermark = last
+            elif transitions < self.batch_size:
+                break
+
+        stats['last_order_id'] = watermark
+        stats['seconds'] = round(time.perf_counter() - started, 3)
+        stats['finished_at'] = datetime.utcnow().isoformat()
+        self.last_run = stats
+        return stats
+
+    def order_status_changed(self, previous, status, order_ids):
+        """
+        Record that `order_ids` moved from `previous` to `status`, for the
+        next refresh to apply. Call inside the transaction that changed them;
+        it only appends rows, so payments never wait on a refresh.
+        """
+        self.db.session.execute(insert(self.Delta), [
+            {'order_id': order_id, 'previous': previous, 'status': status} for order_id in order_ids])
+
+    def _apply_deltas(self, watermark):
+        """
+        Claim up to a batch of recorded transitions of orders at or below the
+        watermark and move those orders between status rows, adding their
+        lines to the product totals once paid. Transitions of orders not
+        folded yet stay until their batch is folded. Returns how many were
+        applied, or None if another refresh claimed some of them first.
+        """
+        Delta = self.Delta
+        deltas = (self.db.session.query(Delta.id, Delta.order_id, Delta.previous, Delta.status)
+                  .filter(Delta.order_id <= watermark).order_by(Delta.id).limit(self.batch_size).all())
+        if not deltas:
+            return 0
+        claimed = self.db.session.execute(delete(Delta).where(Delta.id.in_([row[0] for row in deltas])))
+        if claimed.rowcount != len(deltas):
+            return None
+        moves = {}
+        for _, order_id, previous, status in deltas:
+            moves.setdefault((previous, status), []).append(order_id)
+        for (previous, status), order_ids in moves.items():
+            self._move(previous, status, order_ids)
+        return len(deltas)
+
+    def _move(self, previous, status, order_ids):
+        """Move folded orders from their `previous` status rows to `status`."""
+        Order = self.Order
+        day = func.date(Order.created_at)
+        deltas = {}
+        for order_day, county, city, orders, amount in (
+                self.db.session.query(day, Order.county, Order.city, func.count(Order.id), func.sum(Order.amount))
+                .filter(Order.id.in_(order_ids)).group_by(day, Order.county, Order.city)):
+            deltas[(_day(order_day), county, city, previous)] = (-orders, -amount)
+            deltas[(_day(order_day), county, city, status)] = (orders, amount)
+        self._merge_daily(deltas)
+        if status == 'success':
+            self._merge_products(self.Item.order_id.in_(order_ids))
+
+    def _fold(self, *order_filter):
+        """Add the orders matching `order_filter` to the rollups; returns how many there were."""
+        Order = self.Order
+        day = func.date(Order.created_at)
+        deltas = {}
+        for order_day, county, city, status, orders, amount in (
+                self.db.session.query(day, Order.county, Order.city, Order.status, func.count(Order.id),
+                                      func.sum(Order.amount))
+                .filter(*order_filter).group_by(day, Order.county, Order.city, Order.status)):
+            deltas[(_day(order_day), county, city, status)] = (orders, amount)
+        self._merge_daily(deltas)
+        self._merge_products(*order_filter, Order.status == 'success')
+        return sum(orders for orders, _ in deltas.values())
+
+    def _merge_daily(self, deltas):
+        """Add {(day, county, city, status): (orders, amount)} to the daily rows."""
+        if not deltas:
+            return
+        Daily = self.Daily
+        existing = {(row.day, row.county, row.city, row.status): row for row in self.db.session.query(
+            Daily.day, Daily.county, Daily.city, Daily.status, Daily.orders, Daily.amount)
+            .filter(Daily.day.in_({key[0] for key in deltas}))}
+        updates, inserts = [], []
+        for (day, county, city, status), (orders, amount) in deltas.items():
+            row = {'day': day, 'county': county, 'city': city, 'status': status}
+            current = existing.get((day, county, city, status))
+            if current is None:
+                inserts.append(dict(row, orders=orders, amount=amount or 0))
+            else:
+                updates.append(dict(row, orders=current.orders + orders, amount=current.amount + (amount or 0)))
+        if updates:
+            self.db.session.bulk_update_mappings(Daily, updates)
+        if inserts:
+            self.db.session.execute(insert(Daily), inserts)
+
+    def _merge_products(self, *order_filter):
+        """Add the lines of the paid orders matching `order_filter` to the product totals."""
+        Order, Item, Product = self.Order, self.Item, self.Product
+        totals = (self.db.session.query(Item.product_id, func.max(Item.name), func.sum(Item.quantity),
+                                        func.sum(Item.quantity * Item.price), func.count(func.distinct(Item.order_id)))
+                  .join(Order, Order.id == Item.order_id)
+                  .filter(*order_filter, Item.product_id.is_not(None)).group_by(Item.product_id).all())
+        if not totals:
+            return
+        existing = {row.product_id: row for row in self.db.session.query(
+            Product.product_id, Product.units, Product.amount, Product.orders)
+            .filter(Product.product_id.in_([row[0] for row in totals]))}
+        updates, inserts = [], []
+        for product_id, name, units, amount, orders in totals:
+            current = existing.get(product_id)
+            if current is None:
+                inserts.append({'product_id': product_id, 'name': name, 'units': units, 'amount': amount,
+                                'orders': orders})
+            else:
+                updates.append({'product_id': product_id, 'name': name, 'units': current.units + units,
+                                'amount': current.amount + amount, 'orders': current.orders + orders})
+        if updates:
+            self.db.session.bulk_update_mappings(Product, updates)
+        if inserts:
+            self.db.session.execute(insert(Product), inserts)
+
+    def dashboard(self, days=ANALYTICS_DAYS, top=10):
+        """
+        The figures for the admin analytics view over the last `days` days:
+        daily orders, revenue and conversion, order counts by status, the top
+        locations and the best-selling products. Reads only rollup rows, so
+        the cost depends on `days` and not on the order history.
+        """
+        db, Daily, Product = self.db, self.Daily, self.Product
+        since = datetime.utcnow().date() - timedelta(days=days - 1)
+        by_day, by_status = {}, dict.fromkeys(ORDER_STATUSES, 0)
+        for day, status, orders, amount in (db.session.query(Daily.day, Daily.status, func.sum(Daily.orders),
+                                                             func.sum(Daily.amount))
+                                            .filter(Daily.day >= since).group_by(Daily.day, Daily.status)):
+            row = by_day.setdefault(day, {'day': day, 'orders': 0, 'paid': 0, 'revenue': 0})
+            row['orders'] += orders
+            if status == 'success':
+                row['paid'] += orders
+                row['revenue'] += amount
+            by_status[status] = by_status.get(status, 0) + orders
+        daily = sorted(by_day.values(), key=lambda row: row['day'], reverse=True)
+        for row in daily:
+            row['conversion'] = row['paid'] / row['orders'] if row['orders'] else None
+        orders = sum(by_status.values())
+        revenue = func.sum(Daily.amount)
+        locations = (db.session.query(Daily.county, Daily.city, func.sum(Daily.orders), revenue)
+                     .filter(Daily.day >= since, Daily.status == 'success')
+                     .group_by(Daily.county, Daily.city).order_by(revenue.desc()).limit(top).all())
+        state = db.session.get(self.State, 1)
+        return {
+            'days': days,
+            'orders': orders,
+            'revenue': sum(row['revenue'] for row in daily),
+            'conversion': by_status['success'] / orders if orders else None,
+            'by_status': by_status,
+            'daily': daily,
+            'locations': [{'county': county, 'city': city, 'orders': n, 'revenue': amount}
+                          for county, city, n, amount in locations],
+            'products': db.session.query(Product).order_by(Product.amount.desc()).limit(top).all(),
+            'last_order_id': state.last_order_id if state else 0,
+            'refreshed_at': state.refreshed_at if state else None,
+        }
@@ -0,0 +1,168 @@
+import os
+import re
+from sqlalchemy import event, or_, text
+from sqlalchemy.engine import make_url
+
+# Search backend: 'auto' picks one from the database dialect, 'like' forces ILIKE scans
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'auto')
+# Upper bound on ranked results returned for a single query
+SEARCH_RESULT_LIMIT = int(os.environ.get('SEARCH_RESULT_LIMIT', 200))
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def search_tokens(query):
+    """Split a raw search string into lowercase word tokens (at most 8)."""
+    return _TOKEN_RE.findall((query or '').lower())[:8]
+
+
+class LikeSearchBackend:
+    """
+    Fallback backend that scans name, description and category with ILIKE.
+    Used for databases without a native full-text engine.
+    """
+    name = 'like'
+
+    def __init__(self, model):
+        self.model = model
+
+    def create(self, connection):
+        """Create any storage the backend needs. Returns True if it was newly created."""
+        return False
+
+    def rebuild(self, connection):
+        pass
+
+    def index(self, connection, product):
+        pass
+
+    def remove(self, connection, product_id):
+        pass
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        """Return products matching every token of the query, best matches first."""
+        tokens = search_tokens(query)
+        if not tokens:
+            return []
+        Product = self.model
+        q = Product.query
+        for token in tokens:
+            pattern = f'%{token}%'
+            q = q.filter(or_(Product.name.ilike(pattern),
+                             Product.description.ilike(pattern),
+                             Product.category.ilike(pattern)))
+        return q.order_by(Product.name).limit(limit).all()
+
+
+class SQLiteFTSSearchBackend(LikeSearchBackend):
+    """
+    SQLite FTS5 backend. Product text is mirrored into the product_fts virtual
+    table (rowid = product id) and ranked with bm25, weighting name matches
+    above category and description matches.
+    """
+    name = 'fts5'
+
+    def create(self, connection):
+        exists = connection.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+        )).first()
+        if exists:
+            return False
+        connection.execute(text(
+            "CREATE VIRTUAL TABLE product_fts USING fts5(name, description, category, "
+            "tokenize = 'unicode61 remove_diacritics 2')"
+        ))
+        return True
+
+    def rebuild(self, connection):
+        connection.execute(text("DELETE FROM product_fts"))
+        connection.execute(text(
+            "INSERT INTO product_fts (rowid, name, description, category) "
+            "SELECT id, name, coalesce(description, ''), category FROM product"
+        ))
+
+    def index(self, connection, product):
+        self.remove(connection, product.id)
+        connection.execute(
+            text("INSERT INTO product_fts (rowid, name, description, category) "
+                 "VALUES (:id, :name, :description, :category)"),
+            {'id': product.id, 'name': product.name,
+             'description': product.description or '', 'category': product.category}
+        )
+
+    def remove(self, connection, product_id):
+        connection.execute(text("DELETE FROM product_fts WHERE rowid = :id"), {'id': product_id})
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        tokens = search_tokens(query)
+        if not tokens:
+            return []
+        # Every token must match, and the last one is treated as a prefix (typeahead)
+        match = ' '.join(f'"{t}"' for t in tokens[:-1])
+        match = f'{match} "{tokens[-1]}"*'.strip()
+        Product = self.model
+        session = Product.query.session
+        rows = session.execute(
+            text("SELECT rowid FROM product_fts WHERE product_fts MATCH :match "
+                 "ORDER BY bm25(product_fts, 10.0, 1.0, 2.0) LIMIT :limit"),
+            {'match': match, 'limit': limit}
+        ).all()
+        ids = [row[0] for row in rows]
+        if not ids:
+            return []
+        by_id = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+        return [by_id[pid] for pid in ids if pid in by_id]
+
+
+class PostgresSearchBackend(LikeSearchBackend):
+    """
+    PostgreSQL backend using a weighted tsvector expression over name (A),
+    category (B) and description (C), backed by a GIN expression index.
+    The index is maintained by Postgres itself, so no sync hooks are needed.
+    """
+    name = 'tsvector'
+
+    VECTOR = ("setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+              "setweight(to_tsvector('simple', coalesce(category, '')), 'B') || "
+              "setweight(to_tsvector('simple', coalesce(description, '')), 'C')")
+
+    def create(self, connection):
+        connection.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_product_search ON product USING GIN (({self.VECTOR}))"
+        ))
+        return False
+
+    def search(self, query, limit=SEARCH_RESULT_LIMIT):
+        tokens = search_tokens(query)
+        if not tokens:
+            return []
+        tsquery = ' & '.join(f'{t}:*' for t in tokens)
+        Product = self.model
+        return (Product.query
+                .filter(text(f"({self.VECTOR}) @@ to_tsquery('simple', :tsquery)"))
+                .order_by(text(f"ts_rank(({self.VECTOR}), to_tsquery('simple', :tsquery)) DESC"),
+                          Product.name)
+                .params(tsquery=tsquery)
+                .limit(limit)
+                .all())
+
+
+def get_search_backend(database_uri, model):
+    """
+    Build the search backend for the given database URI and register
+    mapper hooks that keep it in sync with Product inserts, updates and deletes.
+    """
+    dialect = make_url(database_uri).get_backend_name()
+    if SEARCH_BACKEND == 'like':
+        backend = LikeSearchBackend(model)
+    elif dialect == 'sqlite':
+        backend = SQLiteFTSSearchBackend(model)
+    elif dialect == 'postgresql':
+        backend = PostgresSearchBackend(model)
+    else:
+        backend = LikeSearchBackend(model)
+
+    # Hooks run on the flush connection, so the index commits or rolls back with the product
+    event.listen(model, 'after_insert', lambda mapper, connection, target: backend.index(connection, target))
+    event.listen(model, 'after_update', lambda mapper, connection, target: backend.index(connection, target))
+    event.listen(model, 'after_delete', lambda mapper, connection, target: backend.remove(connection, target.id))
+    return backend
@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import abort, request, send_from_directory
+
+# Hashed copies and the manifest are written here by `flask build-assets`; not committed
+DIST_DIR = 'dist'
+HASH_LENGTH = 12
+# Hashed URLs never change content, so browsers may keep them for a year without revalidating
+ASSET_MAX_AGE = 31536000
+# Text assets are also minified and pre-compressed; every asset is served from its hashed copy in DIST_DIR
+COMPRESSIBLE_EXTENSIONS = frozenset(['.css', '.js', '.svg', '.json', '.txt'])
+ENCODING_SUFFIXES = {'br': 'br', 'gzip': 'gz'}  # Preference order for Accept-Encoding
+
+
+def minify_css(css):
+    """Strip comments and redundant whitespace from a stylesheet."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def _compress(content, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=9, mtime=0)
+    try:
+        import brotli  # Optional dependency; without it only gzip variants are built
+    except ImportError:
+        return None
+    return brotli.compress(content, quality=11)
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def build_assets(static_root):
+    """
+    Fingerprint every file under `static_root` by content hash and write the
+    manifest. Every file is copied to DIST_DIR under its hashed name, so a
+    hashed URL keeps serving the bytes it was built from even if the source
+    file is later replaced. CSS is minified first; text assets also get .gz
+    and .br siblings (kept only when they are meaningfully smaller).
+    Returns the manifest.
+    """
+    dist = os.path.join(static_root, DIST_DIR)
+    files, assets = {}, {}
+    for dirpath, dirnames, filenames in os.walk(static_root):
+        dirnames[:] = sorted(d for d in dirnames if os.path.join(dirpath, d) != dist)
+        for name in sorted(filenames):
+            if name.endswith('.tmp') or name == 'manifest.json':
+                continue
+            source = os.path.join(dirpath, name)
+            logical = os.path.relpath(source, static_root).replace(os.sep, '/')
+            stem, ext = os.path.splitext(logical)
+            with open(source, 'rb') as f:
+                content = f.read()
+            if ext.lower() == '.css':
+                content = minify_css(content.decode('utf-8')).encode('utf-8')
+            hashed = f'{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}'
+
+            encodings = []
+            path = f'{DIST_DIR}/{hashed}'
+            if ext.lower() in COMPRESSIBLE_EXTENSIONS:
+                _write(os.path.join(static_root, path), content)
+                for encoding, suffix in ENCODING_SUFFIXES.items():
+                    compressed = _compress(content, encoding)
+                    if compressed is not None and len(compressed) < len(content) * 0.9:
+                        _write(os.path.join(static_root, f'{path}.{suffix}'), compressed)
+                        encodings.append(encoding)
+            elif not os.path.exists(os.path.join(static_root, path)):
+                # Same hash, same bytes: images already copied by an earlier build are kept
+                _write(os.path.join(static_root, path), content)
+            files[logical] = hashed
+            assets[hashed] = {'path': path, 'encodings': encodings}
+
+    manifest = {'files': files, 'assets': assets}
+    _write(os.path.join(dist, 'manifest.json'), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    return manifest
+
+
+class StaticAssets:
+    """
+    Serves fingerprinted static files from /assets with far-future immutable
+    caching, picking the brotli or gzip variant the client accepts.
+
+    url_for('static', filename=...) is overridden app-wide to emit the hashed
+    URL for any file in the manifest; files added after the last build (e.g.
+    admin uploads) keep their plain /static URL.
+    """
+
+    def __init__(self, app, url_prefix='/assets'):
+        self.static_root = app.static_folder
+        self.manifest_path = os.path.join(self.static_root, DIST_DIR, 'manifest.json')
+        self.files = {}
+        self.assets = {}
+        self.load()
+        app.add_url_rule(f'{url_prefix}/<path:filename>', 'hashed_asset', self.send)
+
+        build_url = app.url_for
+
+        def url_for(endpoint, **values):
+            if endpoint == 'static':
+                hashed = self.files.get(values.get('filename'))
+                if hashed:
+                    endpoint, values['filename'] = 'hashed_asset', hashed
+            return build_url(endpoint, **values)
+
+        # flask.url_for delegates to app.url_for; Jinja captured the bound method, so replace it there too
+        app.url_for = url_for
+        app.jinja_env.globals['url_for'] = url_for
+
+    def load(self):
+        """(Re)read the manifest written by build_assets; without one every URL stays unhashed."""
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        self.files = manifest.get('files', {})
+        self.assets = manifest.get('assets', {})
+
+    def build(self):
+        manifest = build_assets(self.static_root)
+        self.load()
+        return manifest
+
+    def send(self, filename):
+        asset = self.assets.get(filename)
+        if asset is None:
+            abort(404)
+        path, encoding = asset['path'], None
+        for candidate, suffix in ENCODING_SUFFIXES.items():
+            if candidate in asset['encodings'] and request.accept_encodings[candidate]:
+                path, encoding = f"{asset['path']}.{suffix}", candidate
+                break
+
+        response = send_from_directory(self.static_root, path, mimetype=mimetypes.guess_type(filename)[0],
+                                       max_age=ASSET_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if asset['encodings']:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
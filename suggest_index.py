@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from sqlalchemy import event
+
+# Rebuild the index at least this often so edits made by other workers show up
+SUGGEST_INDEX_MAX_AGE = int(os.environ.get('SUGGEST_INDEX_MAX_AGE', 300))
+# Seconds a worker reuses the catalog version it last read for typeahead lookups, so keystrokes skip the database
+SUGGEST_VERSION_MAX_AGE = int(os.environ.get('SUGGEST_VERSION_MAX_AGE', 5))
+
+
+class PrefixIndex:
+    """
+    Immutable sorted-array prefix index over product names.
+
+    Every word start of a name is indexed, so "xps" finds "Dell XPS 15".
+    Lookups are a bisect into the sorted keys plus a short forward scan.
+    """
+
+    def __init__(self, entries):
+        # entries: iterable of (product_id, name, category)
+        rows = []
+        for product_id, name, category in entries:
+            words = name.lower().split()
+            for i in range(len(words)):
+                # Whole-name matches (i == 0) sort before mid-name matches for the same key
+                rows.append((' '.join(words[i:]), i > 0, name, product_id, category))
+        rows.sort()
+        self._keys = [row[0] for row in rows]
+        self._rows = rows
+
+    def lookup(self, prefix, limit=8):
+        """Return up to `limit` (product_id, name, category) tuples whose name has a word starting with prefix."""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        i = bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            _, _, name, product_id, category = self._rows[i]
+            if product_id not in seen:
+                seen.add(product_id)
+                results.append((product_id, name, category))
+                if len(results) >= limit:
+                    break
+            i += 1
+        return results
+
+
+class SuggestIndex:
+    """
+    Process-wide holder for the current PrefixIndex.
+
+    Product insert/update/delete hooks (or a new catalog version) mark the index
+    stale; the next lookup rebuilds it from a single query and swaps it in
+    under a lock.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._index = None
+        self._built_at = 0
+        self._version = None
+        self._stale = True
+        self._lock = threading.Lock()
+        for name in ('after_insert', 'after_update', 'after_delete'):
+            event.listen(model, name, self._mark_stale)
+
+    def _mark_stale(self, mapper, connection, target):
+        self._stale = True
+
+    def _needs_rebuild(self, version):
+        return (self._stale or version != self._version
+                or time.time() - self._built_at > SUGGEST_INDEX_MAX_AGE)
+
+    def get(self, version=None):
+        """Return the current PrefixIndex, rebuilding it first if it is stale or built for another catalog version."""
+        if self._needs_rebuild(version):
+            with self._lock:
+                if self._needs_rebuild(version):
+                    self._stale = False
+                    self._version = version
+                    Product = self.model
+                    entries = Product.query.with_entities(Product.id, Product.name, Product.category).all()
+                    self._index = PrefixIndex(entries)
+                    self._built_at = time.time()
+        return self._index
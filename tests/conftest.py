@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import pytest
+
+from catalog_cache import LRUCacheBackend
+
+# app.py reads its configuration when it is imported, so point it at a throwaway
+# SQLite database (and keep the background workers quiet) before any test imports it
+WORKDIR = tempfile.mkdtemp(prefix='anorld-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(WORKDIR, 'test.db')}",
+    'SECRET_KEY': 'test-secret-key',
+    'PAYSTACK_SECRET_KEY': 'sk_test',
+    'PAYMENT_PROVIDER': 'paystack',
+    'ANALYTICS_INTERVAL': '0',
+    'ANALYTICS_LAG': '0',
+    'RECONCILE_INTERVAL': '0',
+})
+os.environ.pop('CATALOG_CACHE_URL', None)
+os.environ.pop('CART_STORE_URL', None)
+os.environ.pop('SESSION_TYPE', None)
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    """The app module, imported once against the test database."""
+    import app as app_module
+    return app_module
+
+
+@pytest.fixture
+def app(app_module, monkeypatch):
+    """
+    A freshly seeded database (admin user, sample catalog, one paid test order)
+    behind the Flask app; use `with app.app_context()` to query it.
+    Background threads are not started: tests drive the workers (event
+    processor, reconciler, rollups) by calling them directly. Checkout
+    records payment initiation in `app.payments` instead of calling Paystack;
+    the real job is `app.initiate_order_payment`.
+    """
+    m = app_module
+    with m.app.app_context():
+        m.db.session.remove()
+        m.db.drop_all()
+        with m.db.engine.begin() as connection:
+            connection.exec_driver_sql('DROP TABLE IF EXISTS product_fts')
+    m.setup_database()
+
+    for worker in (m.cart_sweeper, m.payment_event_processor, m.payment_reconciler, m.sales_rollup):
+        monkeypatch.setattr(worker, 'ensure_started', lambda: None)
+    monkeypatch.setattr(m.payment_event_processor, 'notify', lambda: None)
+    payments = []
+    initiate_order_payment = m.initiate_order_payment
+    monkeypatch.setattr(m, 'initiate_order_payment', lambda *args: payments.append(args))
+    # The new database starts again at catalog version 1, so nothing cached by an earlier test may survive
+    monkeypatch.setattr(m.catalog_cache, 'backend', LRUCacheBackend())
+    monkeypatch.setattr(m.catalog_cache, '_last_read', (None, float('-inf')))
+    monkeypatch.setattr(m.app.jinja_env.fragment_cache, 'backend', LRUCacheBackend())
+    monkeypatch.setattr(m.suggest_index, '_stale', True)
+
+    flask_app = m.create_app()
+    flask_app.config['TESTING'] = True
+    flask_app.payments = payments
+    flask_app.initiate_order_payment = initiate_order_payment
+    # No app context is pushed here: requests would reuse it, and with it flask.g, across clients
+    yield flask_app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def login(client, username='admin', is_admin=True):
+    """Log the test client in without going through /login (which queues a notification email)."""
+    with client.session_transaction() as session:
+        session['username'] = username
+        session['is_admin'] = is_admin
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+
+from tests.conftest import login
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_the_app_does_not_touch_the_database(tmp_path):
+    database = tmp_path / 'untouched.db'
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}')
+    result = subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=env, capture_output=True,
+                            text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    # SQLite creates the file on the first connection
+    assert not database.exists()
+
+
+def test_flask_cli_serves_through_the_factory(app):
+    env = dict(os.environ)
+    env.pop('FLASK_APP', None)  # As in a plain shell, where .flaskenv supplies it
+    result = subprocess.run([sys.executable, '-m', 'flask', 'routes'], cwd=ROOT, env=env, capture_output=True,
+                            text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'admin.index' in result.stdout
+
+
+def test_create_app_returns_the_same_app_and_mounts_admin_once(app_module, app):
+    m = app_module
+    assert m.create_app() is app
+    assert m.create_app() is app
+    assert app.extensions['admin'] == [m.admin]
+    assert [rule.endpoint for rule in app.url_map.iter_rules() if rule.rule == '/admin/'] == ['admin.index']
+
+
+def test_admin_views_are_served(client):
+    login(client)
+    assert client.get('/admin/').status_code == 200
+    assert client.get('/admin/analytics/').status_code == 200
+
+
+def test_admin_views_require_an_admin(client):
+    login(client, username='shopper', is_admin=False)
+    assert client.get('/admin/analytics/').status_code in (302, 403)
+
+
+def test_sessions_are_stored_server_side(app_module, app, client):
+    login(client)
+    with app.app_context():
+        assert app_module.db.session.execute(app_module.db.text('SELECT COUNT(*) FROM sessions')).scalar() == 1
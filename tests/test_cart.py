@@ -0,0 +1,94 @@
+import contextlib
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+
+@contextlib.contextmanager
+def count_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def fill_cart(client, product_ids):
+    for product_id in product_ids:
+        client.get(f'/add_to_cart/{product_id}')
+
+
+@pytest.fixture
+def products(app_module, app):
+    m = app_module
+    with app.app_context():
+        m.db.session.add_all([m.Product(name=f'Cable {i:02d}', price=100 + i, image='images/pc.webp',
+                                        category='Cables') for i in range(50)])
+        m.db.session.commit()
+        return [product_id for product_id, in m.db.session.query(m.Product.id).filter_by(category='Cables')]
+
+
+@pytest.mark.parametrize('path', ['/cart', '/api/cart'])
+def test_cart_summary_query_count_does_not_grow_with_the_cart(app_module, app, products, path):
+    small, large = app.test_client(), app.test_client()
+    fill_cart(small, products[:1])
+    fill_cart(large, products)
+    small.get(path)
+    large.get(path)  # Warm both, so neither pays for a first-request setup query
+
+    with app.app_context():
+        engine = app_module.db.engine
+    with count_statements(engine) as one_line:
+        assert small.get(path).status_code == 200
+    with count_statements(engine) as fifty_lines:
+        response = large.get(path)
+    assert response.status_code == 200
+    assert one_line and len(one_line) == len(fifty_lines)
+    if path == '/api/cart':
+        assert response.get_json()['count'] == 50
+
+
+def expire_cart_lines(m, app):
+    """Age every cart line past CART_TTL without sweeping it."""
+    with app.app_context():
+        m.db.session.query(m.CartItem).update(
+            {'updated_at': datetime.utcnow() - timedelta(seconds=m.cart_store.ttl + 60)})
+        m.db.session.commit()
+
+
+def cart_count(client):
+    return client.get('/api/cart').get_json()['count']
+
+
+def test_adding_to_an_expired_line_starts_from_nothing(app_module, app, client):
+    m = app_module
+    for _ in range(3):
+        client.get('/add_to_cart/1')
+    assert cart_count(client) == 3
+
+    expire_cart_lines(m, app)
+    assert cart_count(client) == 0
+    client.get('/add_to_cart/1')
+    assert cart_count(client) == 1
+    client.get('/add_to_cart/1')
+    assert cart_count(client) == 2
+
+
+def test_updating_an_expired_line_does_not_revive_it(app_module, app, client):
+    m = app_module
+    client.get('/add_to_cart/1')
+    expire_cart_lines(m, app)
+
+    client.post('/update_cart/1', data={'quantity': '5'})
+
+    assert cart_count(client) == 0
+    with app.app_context():
+        cart_id = m.db.session.query(m.CartItem.cart_id).scalar()
+        assert not m.cart_store.set(cart_id, 1, 5)
+        assert m.cart_store.sweep() == 1
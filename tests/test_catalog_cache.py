@@ -0,0 +1,51 @@
+from catalog_cache import CatalogCache, LRUCacheBackend
+
+
+def other_worker(app_module):
+    """A catalog cache with its own in-process entries, as in another gunicorn worker."""
+    return CatalogCache(LRUCacheBackend(), versions=app_module.catalog_cache.versions)
+
+
+def test_product_change_invalidates_other_workers(app_module, app):
+    m = app_module
+    worker = other_worker(m)
+    with app.app_context():
+        version = worker.version()
+        assert worker.get_or_set('name', lambda: 'old name', version) == 'old name'
+
+        product = m.db.session.get(m.Product, 1)
+        product.name = 'Renamed in this worker'
+        m.db.session.commit()
+
+        assert worker.version() == m.catalog_cache.version() > version
+        assert worker.get_or_set('name', lambda: 'new name', worker.version()) == 'new name'
+
+
+def test_rolled_back_change_keeps_the_version(app_module, app):
+    m = app_module
+    with app.app_context():
+        version = m.catalog_cache.version()
+        m.db.session.get(m.Product, 1).name = 'Never saved'
+        m.db.session.flush()
+        m.db.session.rollback()
+        assert m.catalog_cache.version() == version
+
+
+def test_explicit_bump_creates_the_version_row(app_module, app):
+    m = app_module
+    with app.app_context():
+        m.db.session.query(m.CatalogVersion).delete()
+        m.db.session.commit()
+        assert m.catalog_cache.version() == 1
+        assert m.catalog_cache.bump() == 2
+        assert m.catalog_cache.bump() == 3
+        assert m.catalog_cache.version() == 3
+
+
+def test_pages_show_a_committed_change(app_module, app, client):
+    m = app_module
+    assert b'Renamed Laptop' not in client.get('/product/1').data
+    with app.app_context():
+        m.db.session.get(m.Product, 1).name = 'Renamed Laptop'
+        m.db.session.commit()
+    assert b'Renamed Laptop' in client.get('/product/1').data
@@ -0,0 +1,30 @@
+from catalog_cache import CatalogCache, LRUCacheBackend
+
+
+def test_workers_agree_on_the_validator(app_module, app):
+    m = app_module
+    worker = CatalogCache(LRUCacheBackend(), versions=m.catalog_cache.versions)
+    with app.app_context():
+        assert worker.validator() == m.catalog_cache.validator() == str(m.catalog_cache.version())
+
+
+def test_in_process_validator_expires_with_the_ttl():
+    cache = CatalogCache(LRUCacheBackend(), ttl=60)
+    assert cache.validator().startswith('1.')
+
+
+def test_etag_is_stable_until_the_catalog_changes(app_module, app, client):
+    m = app_module
+    first = client.get('/product/1')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert client.get('/product/1').headers['ETag'] == first.headers['ETag']
+
+    revalidated = client.get('/product/1', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code == 304 and revalidated.data == b''
+
+    with app.app_context():
+        m.db.session.get(m.Product, 1).price = 12345
+        m.db.session.commit()
+    changed = client.get('/product/1', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
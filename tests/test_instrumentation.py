@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loads gunicorn.conf.py as gunicorn does, then imports and serves the app the way a worker would.
+# It runs in a fresh interpreter, as prometheus_client is already imported in-process by the test app.
+WORKER = textwrap.dedent('''
+    import os, runpy
+    runpy.run_path('gunicorn.conf.py')
+    from app import create_app
+    client = create_app().test_client()
+    assert client.get('/').status_code == 200
+    response = client.get('/metrics')
+    print(response.status_code, len(os.listdir(os.environ['PROMETHEUS_MULTIPROC_DIR'])))
+    print(response.get_data(as_text=True))
+''')
+
+
+def test_metrics_are_shared_through_the_multiprocess_dir(app, tmp_path):
+    # PROMETHEUS_MULTIPROC_DIR is left for gunicorn.conf.py to default, under this test's temp dir
+    env = dict(os.environ, TMPDIR=str(tmp_path))
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    result = subprocess.run([sys.executable, '-c', WORKER], cwd=ROOT, env=env, capture_output=True, text=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr
+    status, files = result.stdout.splitlines()[0].split()
+    assert status == '200' and int(files) > 0
+    assert (tmp_path / 'store-metrics').is_dir()
+    assert 'db_queries_total' in result.stdout
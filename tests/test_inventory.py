@@ -0,0 +1,118 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+from payment_events import apply_status_updates
+from tests.conftest import login
+from tests.test_webhooks import charge, paystack_post
+
+CHECKOUT_FORM = {'phone_number': '0712345678', 'county': 'Nairobi', 'city': 'Nairobi',
+                 'shipping_address': 'Test Street'}
+
+
+@pytest.fixture
+def flash_sale(app_module, app):
+    """A product with 5 units left and 12 buyers, each with 1 in their cart; returns (product_id, clients)."""
+    m = app_module
+    with app.app_context():
+        product = m.Product(name='Flash Sale Deal', price=4999, image='images/pc.webp', category='Flash Sale',
+                            stock=5)
+        m.db.session.add(product)
+        m.db.session.add_all([m.User(username=f'buyer_{i}', email=f'buyer_{i}@example.com',
+                                     password_hash=generate_password_hash('secret')) for i in range(12)])
+        m.db.session.commit()
+        product_id = product.id
+    clients = []
+    for i in range(12):
+        client = app.test_client()
+        login(client, f'buyer_{i}', is_admin=False)
+        client.get(f'/add_to_cart/{product_id}')
+        clients.append(client)
+    return product_id, clients
+
+
+def checkout_together(clients):
+    """POST /checkout from every client at once; returns the redirect targets."""
+    barrier = threading.Barrier(len(clients))
+
+    def checkout(client):
+        barrier.wait()
+        response = client.post('/checkout', data=CHECKOUT_FORM)
+        assert response.status_code == 302
+        return response.headers['Location']
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        return list(pool.map(checkout, clients))
+
+
+def stock_and_ordered(m, product_id):
+    """The product's stock and the units of it in orders that still hold them (not failed)."""
+    m.db.session.expire_all()
+    ordered = (m.db.session.query(m.db.func.coalesce(m.db.func.sum(m.OrderItem.quantity), 0))
+               .join(m.Order, m.Order.id == m.OrderItem.order_id)
+               .filter(m.OrderItem.product_id == product_id, m.Order.status != 'failed').scalar())
+    return m.db.session.get(m.Product, product_id).stock, ordered
+
+
+def test_concurrent_checkouts_never_oversell(app_module, app, flash_sale):
+    m = app_module
+    product_id, clients = flash_sale
+    locations = checkout_together(clients)
+
+    accepted = [location.rsplit('/', 1)[-1] for location in locations if '/orders/' in location]
+    assert len(accepted) == 5
+    assert sum(location.endswith('/cart') for location in locations) == 7
+    assert len(app.payments) == 5
+    with app.app_context():
+        assert stock_and_ordered(m, product_id) == (0, 5)
+
+
+def test_failure_delivered_twice_restocks_once(app_module, app, client, flash_sale):
+    m = app_module
+    product_id, clients = flash_sale
+    reference = checkout_together(clients[:2])[0].rsplit('/', 1)[-1]
+    with app.app_context():
+        assert stock_and_ordered(m, product_id) == (3, 2)
+
+    assert paystack_post(client, charge('charge.failed', reference, event_id=1)).status_code == 200
+    assert paystack_post(client, charge('charge.failed', reference, event_id=2)).status_code == 200
+    with app.app_context():
+        assert m.payment_event_processor.process_batch() == 2
+        assert stock_and_ordered(m, product_id) == (4, 1)
+
+        # A reconciliation run that finds the same failure changes nothing either
+        apply_status_updates(m.db, m.Order, {reference: 'failed'}, m.order_status_changed)
+        m.db.session.commit()
+        assert stock_and_ordered(m, product_id) == (4, 1)
+
+
+def test_late_success_takes_the_units_again(app_module, app, client, flash_sale):
+    m = app_module
+    product_id, clients = flash_sale
+    reference = checkout_together(clients[:1])[0].rsplit('/', 1)[-1]
+    paystack_post(client, charge('charge.failed', reference, event_id=1))
+    with app.app_context():
+        m.payment_event_processor.process_batch()
+        assert stock_and_ordered(m, product_id) == (5, 0)
+    paystack_post(client, charge('charge.success', reference, event_id=2))
+    with app.app_context():
+        m.payment_event_processor.process_batch()
+        assert m.db.session.query(m.Order.status).filter_by(reference=reference).scalar() == 'success'
+        assert stock_and_ordered(m, product_id) == (4, 1)
+
+
+def test_failed_payment_request_restocks_once(app_module, app, flash_sale, monkeypatch):
+    m = app_module
+    product_id, clients = flash_sale
+    reference = checkout_together(clients[:1])[0].rsplit('/', 1)[-1]
+    monkeypatch.setattr('paystack_handler.initiate_mpesa_charge', lambda **kwargs: {'error': 'Declined'})
+    with app.app_context():
+        order_id = m.db.session.query(m.Order.id).filter_by(reference=reference).scalar()
+    # The job as the payment worker runs it, then a duplicate of it
+    for _ in range(2):
+        app.initiate_order_payment(order_id, '0712345678', 4999, 'buyer_0@example.com')
+    with app.app_context():
+        assert m.db.session.query(m.Order.status).filter_by(reference=reference).scalar() == 'failed'
+        assert stock_and_ordered(m, product_id) == (5, 0)
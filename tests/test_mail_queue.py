@@ -0,0 +1,123 @@
+import smtplib
+
+import pytest
+from flask_mail import Message
+
+import mail_queue
+from mail_queue import MailDispatcher
+
+
+class FakeConnection:
+    def __init__(self, mail):
+        self.mail = mail
+
+    def __enter__(self):
+        if self.mail.down:
+            raise ConnectionRefusedError('SMTP server is down')
+        self.mail.connections += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def send(self, msg):
+        if msg.recipients[0] in self.mail.poison:
+            raise smtplib.SMTPRecipientsRefused({msg.recipients[0]: (550, b'No such user')})
+        self.mail.sent.append(msg.recipients[0])
+
+
+class FakeMail:
+    def __init__(self, poison=(), down=False):
+        self.poison = set(poison)
+        self.down = down
+        self.sent = []
+        self.connections = 0
+
+    def connect(self):
+        return FakeConnection(self)
+
+
+class ImmediateTimer:
+    """Runs the retry as soon as it is scheduled instead of after the backoff."""
+
+    def __init__(self, interval, function, args=()):
+        self.function = function
+        self.args = args
+
+    def start(self):
+        self.function(*self.args)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(mail_queue.threading, 'Timer', ImmediateTimer)
+
+
+def message(recipient):
+    return Message(subject=f'Hello {recipient}', sender='shop@example.com', recipients=[recipient])
+
+
+def take(dispatcher):
+    item = dispatcher._queue.get_nowait()
+    dispatcher._queue.task_done()  # Otherwise the dispatcher's atexit flush waits for it
+    return item
+
+
+def drain(dispatcher):
+    """Send whatever is queued, batch by batch, as a worker would."""
+    while not dispatcher._queue.empty():
+        batch = []
+        while not dispatcher._queue.empty() and len(batch) < dispatcher.batch_size:
+            batch.append(take(dispatcher))
+        dispatcher._send_batch(batch)
+
+
+def enqueue(dispatcher, recipients):
+    for recipient in recipients:
+        dispatcher._queue.put_nowait((message(recipient), 0, 0.0))
+
+
+def test_poison_message_does_not_hold_back_the_batch(app_module):
+    mail = FakeMail(poison={'bad@example.com'})
+    dispatcher = MailDispatcher(app_module.app, mail, max_retries=3)
+    enqueue(dispatcher, ['a@example.com', 'bad@example.com', 'b@example.com', 'c@example.com'])
+
+    drain(dispatcher)
+
+    assert mail.sent == ['a@example.com', 'b@example.com', 'c@example.com']
+    stats = dispatcher.stats()
+    assert stats['sent'] == 3
+    assert stats['retried'] == 3
+    assert stats['failed'] == 1
+    [dead] = stats['dead_letters']
+    assert dead['recipients'] == ['bad@example.com'] and dead['attempts'] == 4
+    assert stats['queue_depth'] == 0 and stats['retry_waiting'] == 0
+
+
+def test_attempts_are_counted_per_message(app_module):
+    mail = FakeMail(poison={'bad@example.com'})
+    dispatcher = MailDispatcher(app_module.app, mail, max_retries=3)
+    # A message that already failed twice, batched with one that has never been tried
+    dispatcher._queue.put_nowait((message('bad@example.com'), 2, 0.0))
+    enqueue(dispatcher, ['fresh@example.com'])
+
+    dispatcher._send_batch([take(dispatcher), take(dispatcher)])
+
+    assert mail.sent == ['fresh@example.com']
+    msg, attempts, _ = take(dispatcher)
+    assert msg.recipients == ['bad@example.com'] and attempts == 3
+    assert dispatcher._queue.empty()
+
+
+def test_unreachable_server_charges_every_waiting_message_once(app_module):
+    mail = FakeMail(down=True)
+    dispatcher = MailDispatcher(app_module.app, mail, max_retries=3)
+    enqueue(dispatcher, ['a@example.com', 'b@example.com'])
+
+    dispatcher._send_batch([take(dispatcher), take(dispatcher)])
+
+    assert [attempts for _, attempts, _ in (take(dispatcher), take(dispatcher))] == [1, 1]
+    mail.down = False
+    enqueue(dispatcher, ['a@example.com'])
+    drain(dispatcher)
+    assert mail.sent == ['a@example.com']
@@ -0,0 +1,83 @@
+import base64
+import json
+from datetime import datetime
+
+import pytest
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+from tests.conftest import login
+
+
+def raw_cursor(values):
+    """A hand-made cursor, as a client could craft one."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+CRAFTED = [
+    raw_cursor([{'a': 1}, 2]),
+    raw_cursor([[1], [2]]),
+    raw_cursor(['Laptop', 'not-an-id']),
+    raw_cursor(['Laptop', True]),
+    raw_cursor(['Laptop', None]),
+    raw_cursor(['Laptop', 1.5]),
+    raw_cursor(['Laptop', 2 ** 40]),
+    raw_cursor([7, 2]),
+    raw_cursor(['Laptop']),
+    raw_cursor({'name': 'Laptop', 'id': 2}),
+    raw_cursor('[' * 5000),
+    'not base64!',
+    '%%%',
+]
+
+
+def test_round_trip(app_module):
+    m = app_module
+    name_id = [m.Product.name, m.Product.id]
+    assert decode_cursor(encode_cursor(['Laptop', 12]), name_id) == ['Laptop', 12]
+    created = datetime(2026, 10, 18, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor([created, 5]), [m.Order.created_at, m.Order.id]) == [created, 5]
+
+
+@pytest.mark.parametrize('cursor', CRAFTED)
+def test_crafted_cursors_are_rejected(app_module, cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, [app_module.Product.name, app_module.Product.id])
+
+
+@pytest.mark.parametrize('cursor', [raw_cursor(['yesterday', 1]), raw_cursor([1700000000, 1]),
+                                    raw_cursor([{'a': 1}, 1])])
+def test_crafted_order_cursors_are_rejected(app_module, cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor, [app_module.Order.created_at, app_module.Order.id])
+
+
+@pytest.mark.parametrize('cursor', CRAFTED[:4])
+def test_category_page_falls_back_to_the_first_page(client, cursor):
+    response = client.get('/', query_string={'category': 'Laptops', 'cursor': cursor})
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize('cursor', CRAFTED[:4])
+def test_products_api_answers_400(client, cursor):
+    response = client.get('/api/products', query_string={'category': 'Laptops', 'cursor': cursor})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('cursor', [raw_cursor([{'a': 1}, 2]), raw_cursor(['2026-01-01T00:00:00', 'x'])])
+def test_order_history_rejects_crafted_cursors(client, cursor):
+    login(client)
+    assert client.get('/api/orders', query_string={'cursor': cursor}).status_code == 400
+    assert client.get('/orders', query_string={'cursor': cursor}).status_code == 200
+
+
+def test_products_api_pages_through_a_category(app_module, app, client):
+    m = app_module
+    with app.app_context():
+        m.db.session.add_all([m.Product(name=f'Mouse {i:02d}', price=500, image='images/pc.webp',
+                                        category='Mice') for i in range(30)])
+        m.db.session.commit()
+    first = client.get('/api/products', query_string={'category': 'Mice'}).get_json()
+    second = client.get('/api/products', query_string={'category': 'Mice',
+                                                       'cursor': first['next_cursor']}).get_json()
+    assert first['next_cursor'] and second['next_cursor'] is None
+    assert 'Mouse 23' in first['html'] and 'Mouse 24' in second['html'] and 'Mouse 29' in second['html']
@@ -0,0 +1,85 @@
+import pytest
+
+from payment_events import apply_status_updates
+
+
+@pytest.fixture
+def orders(app_module, app):
+    """One order in each status, ORDER_<status>; yields the app module inside an app context."""
+    m = app_module
+    with app.app_context():
+        for status in ('initiating', 'pending', 'success', 'failed'):
+            m.db.session.add(m.Order(user_id=1, reference=f'ORDER_{status}', amount=100, phone_number='0712345678',
+                                     county='Nairobi', city='Nairobi', shipping_address='Test Street',
+                                     status=status, payment_provider='paystack'))
+        m.db.session.commit()
+        yield m
+
+
+def status_of(m, reference):
+    return m.db.session.query(m.Order.status).filter_by(reference=reference).scalar()
+
+
+def apply(m, updates):
+    calls = []
+    changed = apply_status_updates(m.db, m.Order, updates,
+                                   lambda previous, status, ids: calls.append((previous, status, len(ids))))
+    m.db.session.commit()
+    return changed, calls
+
+
+@pytest.mark.parametrize('late', ['pending', 'failed'])
+def test_stale_notification_cannot_undo_a_success(orders, late):
+    m = orders
+    changed, calls = apply(m, {'ORDER_success': late})
+    assert (changed, calls) == (0, [])
+    assert status_of(m, 'ORDER_success') == 'success'
+
+
+def test_pending_cannot_overwrite_a_failure(orders):
+    m = orders
+    assert apply(m, {'ORDER_failed': 'pending'}) == (0, [])
+    assert status_of(m, 'ORDER_failed') == 'failed'
+
+
+def test_redelivered_notification_does_nothing(orders):
+    m = orders
+    assert apply(m, {'ORDER_pending': 'failed'}) == (1, [('pending', 'failed', 1)])
+    assert apply(m, {'ORDER_pending': 'failed'}) == (0, [])
+    assert status_of(m, 'ORDER_pending') == 'failed'
+
+
+def test_on_change_fires_once_per_real_transition(orders):
+    m = orders
+    changed, calls = apply(m, {'ORDER_initiating': 'success', 'ORDER_pending': 'success',
+                               'ORDER_failed': 'success', 'ORDER_success': 'success'})
+    assert changed == 3
+    assert sorted(calls) == [('failed', 'success', 1), ('initiating', 'success', 1), ('pending', 'success', 1)]
+    assert {status_of(m, f'ORDER_{status}') for status in ('initiating', 'pending', 'failed')} == {'success'}
+
+
+def test_orders_moving_together_are_reported_together(orders):
+    m = orders
+    for i in range(3):
+        m.db.session.add(m.Order(user_id=1, reference=f'ORDER_batch_{i}', amount=100, phone_number='0712345678',
+                                 county='Nairobi', city='Nairobi', shipping_address='Test Street',
+                                 status='pending', payment_provider='paystack'))
+    m.db.session.commit()
+    changed, calls = apply(m, {f'ORDER_batch_{i}': 'failed' for i in range(3)})
+    assert (changed, calls) == (3, [('pending', 'failed', 3)])
+
+
+def test_without_on_change_the_same_guards_apply(orders):
+    m = orders
+    assert apply_status_updates(m.db, m.Order, {'ORDER_success': 'failed', 'ORDER_initiating': 'pending'}) == 1
+    m.db.session.commit()
+    assert status_of(m, 'ORDER_success') == 'success'
+    assert status_of(m, 'ORDER_initiating') == 'pending'
+
+
+def test_out_of_order_events_in_one_batch_settle_on_success(orders):
+    m = orders
+    for event_id, status in (('evt-success', 'success'), ('evt-failed', 'failed')):
+        m.record_event(m.db, m.WebhookEvent, 'paystack', event_id, 'charge', 'ORDER_pending', status, {})
+    assert m.payment_event_processor.process_batch() == 2
+    assert status_of(m, 'ORDER_pending') == 'success'
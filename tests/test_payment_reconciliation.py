@@ -0,0 +1,119 @@
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from tests.conftest import login
+
+
+@pytest.fixture
+def hot_product(app_module, app):
+    m = app_module
+    with app.app_context():
+        product = m.Product(name='Hot Deal', price=500, image='images/pc.webp', category='Deals', stock=10)
+        m.db.session.add(product)
+        m.db.session.commit()
+        return product.id
+
+
+def place_order(m, product_id, status, age, quantity=2, reference=None):
+    """An order holding `quantity` reserved units, placed `age` ago."""
+    reference = reference or f'ORDER_{status}_{int(age.total_seconds())}'
+    order = m.Order(user_id=1, reference=reference, amount=1000, phone_number='0712345678', county='Nairobi',
+                    city='Nairobi', shipping_address='Test Street', status=status,
+                    created_at=datetime.utcnow() - age, payment_provider='paystack')
+    m.db.session.add(order)
+    m.db.session.flush()
+    m.db.session.add(m.OrderItem(order_id=order.id, product_id=product_id, name='Hot Deal', price=500,
+                                 quantity=quantity))
+    m.db.session.get(m.Product, product_id).stock -= quantity
+    m.db.session.commit()
+    return reference
+
+
+def statuses(m):
+    return dict(m.db.session.query(m.Order.reference, m.Order.status))
+
+
+def test_stale_initiating_orders_are_failed_and_restocked(app_module, app, hot_product, monkeypatch):
+    m = app_module
+    lookups = {'ORDER_PAID': 'success'}
+    monkeypatch.setattr(m.payment_reconciler, 'lookup', lambda reference, provider, checkout_request_id:
+                        lookups.get(reference))
+    with app.app_context():
+        lost = place_order(m, hot_product, 'initiating', timedelta(hours=1))
+        paid = place_order(m, hot_product, 'initiating', timedelta(hours=1, seconds=1), reference='ORDER_PAID')
+        young = place_order(m, hot_product, 'initiating', timedelta(seconds=5))
+        waiting = place_order(m, hot_product, 'pending', timedelta(hours=1))
+        assert m.db.session.get(m.Product, hot_product).stock == 2
+
+        stats = m.payment_reconciler.run()
+
+        assert stats['checked'] == 3
+        assert stats['expired'] == 1 and stats['unresolved'] == 1 and stats['updated'] == 2
+        settled = statuses(m)
+        assert [settled[reference] for reference in (lost, paid, young, waiting)] == [
+            'failed', 'success', 'initiating', 'pending']
+        # Only the expired order's units came back
+        m.db.session.expire_all()
+        assert m.db.session.get(m.Product, hot_product).stock == 4
+
+        # Running again changes nothing, so the units are not returned twice
+        m.payment_reconciler.run()
+        m.db.session.expire_all()
+        assert m.db.session.get(m.Product, hot_product).stock == 4
+
+
+def test_lookup_errors_leave_initiating_orders_alone(app_module, app, hot_product, monkeypatch):
+    m = app_module
+
+    def unreachable(reference, provider, checkout_request_id):
+        raise ConnectionError('Paystack is down')
+
+    monkeypatch.setattr(m.payment_reconciler, 'lookup', unreachable)
+    with app.app_context():
+        reference = place_order(m, hot_product, 'initiating', timedelta(hours=1))
+        stats = m.payment_reconciler.run()
+        assert stats['errors'] == 1
+        assert statuses(m)[reference] == 'initiating'
+
+
+class SyncExecutor:
+    """Runs each job on submit, like a payment worker that picks it up at once."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def test_crashed_payment_job_is_logged(app_module, app, client, hot_product, monkeypatch, capsys):
+    m = app_module
+
+    def crash(*args):
+        raise RuntimeError('worker lost its database connection')
+
+    monkeypatch.setattr(m, 'payment_executor', SyncExecutor())
+    monkeypatch.setattr(m, 'initiate_order_payment', crash)
+    login(client)
+    client.get(f'/add_to_cart/{hot_product}')
+    response = client.post('/checkout', data={'phone_number': '0712345678', 'county': 'Nairobi',
+                                              'city': 'Nairobi', 'shipping_address': 'Test Street'})
+
+    assert response.status_code == 302
+    reference = response.headers['Location'].rsplit('/', 1)[-1]
+    assert f'Payment initiation for order {reference} crashed' in capsys.readouterr().out
+    with app.app_context():
+        assert statuses(m)[reference] == 'initiating'
+
+
+def test_runs_skip_orders_another_run_is_checking(app_module, app):
+    with app.app_context():
+        query = app_module.payment_reconciler._stale_orders(datetime.utcnow())
+        sql = str(query.statement.compile(dialect=postgresql.dialect()))
+    assert sql.endswith('FOR UPDATE OF "order" SKIP LOCKED')
+
@@ -0,0 +1,62 @@
+import io
+
+import pytest
+
+from catalog_io import read_catalog
+from product_attributes import attribute_name, attribute_rows, parse_facets, split_description
+
+
+@pytest.mark.parametrize('text, specs', [
+    ('Intel Core i7, 16GB RAM, 512GB SSD', ['Intel Core i7', '16GB RAM', '512GB SSD']),
+    ('USB-C,HDMI', ['USB-C', 'HDMI']),
+    # Thousands separators stay inside their spec
+    ('1,000 mAh', ['1,000 mAh']),
+    ('24,000mAh battery, Fast charging', ['24,000mAh battery', 'Fast charging']),
+    ('1,234,567 pixels, OLED', ['1,234,567 pixels', 'OLED']),
+    # ...but only for a plain 1-3 digit number followed directly by three digits
+    ('Version 2.5, 100 units', ['Version 2.5', '100 units']),
+    ('Ports: 2, 100W charger', ['Ports: 2', '100W charger']),
+    ('Model 1234,567 edition', ['Model 1234', '567 edition']),
+    (' , Backlit keyboard,, ', ['Backlit keyboard']),
+    ('', []),
+    (None, []),
+])
+def test_split_description(text, specs):
+    assert split_description(text) == specs
+
+
+@pytest.mark.parametrize('value, name', [
+    ('Intel Core i7', 'Processor'),
+    ('AMD Ryzen 7 7840U', 'Processor'),
+    ('Apple M2 Chip', 'Processor'),
+    ('16GB RAM', 'RAM'),
+    ('32 GB DDR5', 'RAM'),
+    ('512GB SSD', 'Storage'),
+    ('1TB NVMe', 'Storage'),
+    ('1,000 mAh', None),
+    ('Backlit keyboard', None),
+])
+def test_attribute_name(value, name):
+    assert attribute_name(value) == name
+
+
+def test_attribute_rows_infer_names_and_keep_given_ones():
+    assert attribute_rows(['Intel Core i7', {'name': 'Colour', 'value': ' Black '}, '  ', '5,000 mAh']) == [
+        {'name': 'Processor', 'value': 'Intel Core i7', 'position': 0},
+        {'name': 'Colour', 'value': 'Black', 'position': 1},
+        {'name': None, 'value': '5,000 mAh', 'position': 2},
+    ]
+
+
+def test_csv_description_is_split_into_attributes():
+    csv = io.StringIO('name,price,image,category,description\n'
+                      'Power Bank,2500,images/pb.webp,Accessories,"20,000 mAh, 16GB RAM, USB-C"\n')
+    [row] = read_catalog(csv, 'csv')
+    assert [(a['name'], a['value']) for a in row['attributes']] == [
+        (None, '20,000 mAh'), ('RAM', '16GB RAM'), (None, 'USB-C')]
+    assert row['description'] == '20,000 mAh, 16GB RAM, USB-C'
+
+
+def test_parse_facets_ignores_unknown_names_and_sorts_values():
+    assert parse_facets(['RAM:8GB RAM', 'Colour:Black', 'RAM:16GB RAM', 'Storage:', 'Processor']) == {
+        'RAM': ['16GB RAM', '8GB RAM']}
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from payment_events import apply_status_updates
+
+
+@pytest.fixture
+def basket(app_module, app):
+    """Two products that are always bought together; yields the app module inside an app context."""
+    m = app_module
+    with app.app_context():
+        products = [m.Product(name=name, price=500, image='images/pc.webp', category='Bundles')
+                    for name in ('Keyboard', 'Mouse')]
+        m.db.session.add_all(products)
+        m.db.session.commit()
+        m.basket_ids = [product.id for product in products]
+        yield m
+
+
+def order(m, status, age=timedelta(0)):
+    """An order for one of each basket product, placed `age` ago."""
+    placed = m.Order(user_id=1, reference=f'ORDER_{m.Order.query.count()}', amount=1000, phone_number='0712345678',
+                     county='Nairobi', city='Nairobi', shipping_address='Test Street', status=status,
+                     created_at=datetime.utcnow() - age, payment_provider='paystack')
+    m.db.session.add(placed)
+    m.db.session.flush()
+    m.db.session.add_all([m.OrderItem(order_id=placed.id, product_id=product_id, name='Item', price=500, quantity=1)
+                          for product_id in m.basket_ids])
+    m.db.session.commit()
+    return placed.id
+
+
+def settle(m, order_id, status):
+    reference = m.db.session.get(m.Order, order_id).reference
+    apply_status_updates(m.db, m.Order, {reference: status}, m.order_status_changed)
+    m.db.session.commit()
+
+
+def bought_together(m):
+    keyboard, mouse = m.basket_ids
+    return m.db.session.query(m.ProductCopurchase.count).filter_by(product_id=keyboard, other_id=mouse).scalar() or 0
+
+
+def test_watermark_waits_for_young_unpaid_orders(basket):
+    m = basket
+    pending = order(m, 'pending')
+    order(m, 'success')
+    assert m.recommendation_builder.run()['last_order_id'] < pending
+    assert bought_together(m) == 0
+
+    settle(m, pending, 'success')
+    m.recommendation_builder.run()
+    assert bought_together(m) == 2
+
+
+def test_watermark_passes_orders_unsettled_past_the_staleness_window(basket):
+    m = basket
+    stale = order(m, 'pending', age=timedelta(seconds=m.payment_reconciler.stale_after + 60))
+    paid = order(m, 'success')
+    assert m.recommendation_builder.run()['last_order_id'] == paid
+    assert bought_together(m) == 1
+
+    # Reconciliation finds it was paid after all
+    settle(m, stale, 'success')
+    m.recommendation_builder.run()
+    assert bought_together(m) == 2
+
+
+def test_failed_order_paid_late_is_counted_once(basket):
+    m = basket
+    failed = order(m, 'failed')
+    m.recommendation_builder.run()
+    assert bought_together(m) == 0
+
+    settle(m, failed, 'success')
+    settle(m, failed, 'success')  # Redelivered webhook
+    m.recommendation_builder.run()
+    m.recommendation_builder.run()
+    assert bought_together(m) == 1
+    keyboard, mouse = m.basket_ids
+    assert m.db.session.get(m.ProductRecommendation, keyboard).bought_with_ids == [mouse]
+    assert m.RecommendationBacklog.query.count() == 0
+
+
+def test_order_paid_before_the_run_reads_it_is_counted_once(basket):
+    m = basket
+    pending = order(m, 'pending')
+    settle(m, pending, 'success')
+    assert m.RecommendationBacklog.query.count() == 2
+    m.recommendation_builder.run()
+    assert bought_together(m) == 1
+    assert m.RecommendationBacklog.query.count() == 0
+
+    m.recommendation_builder.run(full=True)
+    assert bought_together(m) == 1
+
+
+def test_recommended_products_are_not_cached_with_empty_specs(app_module, app, client):
+    m = app_module
+    with app.app_context():
+        m.db.session.add(m.ProductRecommendation(product_id=1, similar='2,3', bought_with='4',
+                                                 updated_at=datetime.utcnow()))
+        m.db.session.commit()
+    assert client.get('/product/1').status_code == 200
+    with app.app_context():
+        product, similar, bought = m.catalog_cache.get_or_set('product:1', lambda: None)
+    assert [p.id for p in similar + bought] == [2, 3, 4]
+    # Specs were not loaded for the cards; an empty list here would pass for "no specs" wherever they are reused
+    assert not any('attributes' in p.__dict__ for p in similar + bought)
+    assert product.description_list
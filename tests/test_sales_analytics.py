@@ -0,0 +1,122 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from payment_events import apply_status_updates
+
+NEXT_STATUS = {'initiating': ['pending', 'failed', 'success'], 'pending': ['failed', 'success'],
+               'failed': ['success'], 'success': []}
+
+
+@pytest.fixture
+def shop(app_module, app):
+    """Yields the app module inside an app context, with a random generator for placing orders."""
+    with app.app_context():
+        app_module.rng = random.Random(2026)
+        yield app_module
+
+
+def place_orders(m, count):
+    rng = m.rng
+    for _ in range(count):
+        order = m.Order(user_id=1, reference=f'ORDER_{m.Order.query.count()}', amount=0, phone_number='0712345678',
+                        county=rng.choice(['Nairobi', 'Mombasa']), city=rng.choice(['Nairobi', 'Kisumu']),
+                        shipping_address='Test Street', status=rng.choice(['initiating', 'pending']),
+                        created_at=datetime.utcnow() - timedelta(days=rng.randrange(5)), payment_provider='paystack')
+        m.db.session.add(order)
+        m.db.session.flush()
+        for product_id in rng.sample(range(1, 16), rng.randint(1, 3)):
+            quantity, price = rng.randint(1, 3), rng.choice([500, 1200, 4999])
+            m.db.session.add(m.OrderItem(order_id=order.id, product_id=product_id, name='Item', price=price,
+                                         quantity=quantity))
+            order.amount += quantity * price
+    m.db.session.commit()
+
+
+def settle_some(m, count):
+    """Move `count` random orders one step along, as webhooks and reconciliation would."""
+    rng = m.rng
+    movable = [(reference, status) for reference, status in m.db.session.query(m.Order.reference, m.Order.status)
+               if NEXT_STATUS[status]]
+    updates = {reference: rng.choice(NEXT_STATUS[status]) for reference, status in rng.sample(movable, count)}
+    apply_status_updates(m.db, m.Order, updates, m.order_status_changed)
+    m.db.session.commit()
+
+
+def rollups(m):
+    daily = {(row.day, row.county, row.city, row.status): (row.orders, round(row.amount, 2))
+             for row in m.SalesDaily.query if row.orders}
+    products = {row.product_id: (row.units, round(row.amount, 2), row.orders) for row in m.SalesProduct.query}
+    return daily, products
+
+
+def ground_truth(m):
+    daily, products = {}, {}
+    for order in m.Order.query:
+        key = (order.created_at.date(), order.county, order.city, order.status)
+        orders, amount = daily.get(key, (0, 0))
+        daily[key] = (orders + 1, round(amount + order.amount, 2))
+        if order.status != 'success':
+            continue
+        for item in m.OrderItem.query.filter_by(order_id=order.id):
+            units, amount, orders = products.get(item.product_id, (0, 0, 0))
+            products[item.product_id] = (units + item.quantity, round(amount + item.quantity * item.price, 2),
+                                         orders + 1)
+    return daily, products
+
+
+def test_rollups_match_the_orders_after_late_transitions(shop):
+    m = shop
+    place_orders(m, 30)
+    settle_some(m, 10)  # Before the orders are folded: the fold reads these statuses
+    m.sales_rollup.run()
+    for _ in range(4):
+        settle_some(m, 12)
+        place_orders(m, 10)
+        settle_some(m, 8)
+        m.sales_rollup.run()
+        assert rollups(m) == ground_truth(m)
+    assert m.SalesRollupDelta.query.count() == 0
+
+    incremental = rollups(m)
+    stats = m.sales_rollup.run(full=True)
+    assert stats['orders'] == m.Order.query.count()
+    assert rollups(m) == incremental == ground_truth(m)
+
+
+def test_small_batches_fold_orders_and_status_changes(shop, monkeypatch):
+    m = shop
+    monkeypatch.setattr(m.sales_rollup, 'batch_size', 4)
+    place_orders(m, 15)
+    m.sales_rollup.run()
+    settle_some(m, 13)
+    stats = m.sales_rollup.run()
+    assert stats['transitions'] == 13
+    assert rollups(m) == ground_truth(m)
+
+
+def test_status_changes_do_not_touch_the_watermark_row(shop):
+    m = shop
+    place_orders(m, 5)
+    m.sales_rollup.run()
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(m.db.engine, 'before_cursor_execute', listener)
+    try:
+        settle_some(m, 5)
+    finally:
+        event.remove(m.db.engine, 'before_cursor_execute', listener)
+    assert not [statement for statement in statements if 'sales_rollup_state' in statement]
+    assert m.SalesRollupDelta.query.count() == 5
+
+
+def test_refresh_from_a_stale_watermark_is_not_applied(shop):
+    m = shop
+    place_orders(m, 5)
+    m.sales_rollup.run()
+    watermark = m.db.session.get(m.SalesRollupState, 1).last_order_id
+    assert not m.sales_rollup._advance(watermark - 2, watermark + 100)
+    m.db.session.rollback()
+    assert m.db.session.get(m.SalesRollupState, 1).last_order_id == watermark
@@ -0,0 +1,106 @@
+from search_index import LikeSearchBackend
+from suggest_index import PrefixIndex
+from tests.test_cart import count_statements
+
+
+def suggest(client, q, **params):
+    return client.get('/api/search/suggest', query_string=dict(params, q=q)).get_json()['results']
+
+
+def test_repeat_suggestions_run_no_query(app_module, app, client):
+    m = app_module
+    assert [row['name'] for row in suggest(client, 'mac')] == ['Apple MacBook Air M2']
+    with app.app_context():
+        engine = m.db.engine
+    with count_statements(engine) as statements:
+        assert [row['name'] for row in suggest(client, 'macb')] == ['Apple MacBook Air M2']
+    assert statements == []
+
+
+def test_another_workers_edit_shows_once_the_version_is_reread(app_module, app, client):
+    m = app_module
+    assert suggest(client, 'zebra') == []
+    with app.app_context():
+        # As another worker would: no ORM events in this process, just the data and a version bump
+        with m.db.engine.begin() as connection:
+            connection.exec_driver_sql("INSERT INTO product (name, price, image, category) "
+                                       "VALUES ('Zebra Label Printer', 30000, 'images/pc.webp', 'Printers')")
+            m.catalog_cache.versions.bump(connection)
+    assert suggest(client, 'zebra') == []
+    m.catalog_cache._last_read = (None, float('-inf'))  # SUGGEST_VERSION_MAX_AGE has passed
+    assert [row['name'] for row in suggest(client, 'zebra')] == ['Zebra Label Printer']
+
+
+def add_products(m, *rows):
+    for name, description, category in rows:
+        m.db.session.add(m.Product(name=name, description=description, category=category,
+                                   price=1000, image='images/pc.webp'))
+    m.db.session.commit()
+
+
+def test_fts_ranks_name_matches_above_description_matches(app_module, app):
+    m = app_module
+    with app.app_context():
+        add_products(m, ('Travel Mug', 'Fits the Quokka dock', 'Accessories'),
+                        ('Quokka Dock', 'USB-C, HDMI', 'Accessories'))
+        assert m.search_backend.name == 'fts5'
+        assert [p.name for p in m.search_backend.search('quokka')] == ['Quokka Dock', 'Travel Mug']
+
+
+def test_fts_needs_every_token_and_treats_the_last_as_a_prefix(app_module, app):
+    m = app_module
+    with app.app_context():
+        add_products(m, ('Quokka Dock', 'USB-C, HDMI', 'Accessories'),
+                        ('Quokka Stand', 'Aluminium', 'Accessories'))
+        assert [p.name for p in m.search_backend.search('QUOKKA do')] == ['Quokka Dock']
+        assert [p.name for p in m.search_backend.search('quokka hdmi')] == ['Quokka Dock']
+        assert m.search_backend.search('quo stand') == []
+        assert m.search_backend.search('  ,. ') == []
+
+
+def test_like_search_needs_every_token_and_orders_by_name(app_module, app):
+    m = app_module
+    like = LikeSearchBackend(m.Product)
+    with app.app_context():
+        add_products(m, ('Quokka Stand', 'Aluminium', 'Accessories'),
+                        ('Travel Mug', 'Fits the Quokka dock', 'Accessories'),
+                        ('Quokka Dock', 'USB-C, HDMI', 'Accessories'))
+        assert [p.name for p in like.search('quokka')] == ['Quokka Dock', 'Quokka Stand', 'Travel Mug']
+        assert [p.name for p in like.search('Quokka DOCK')] == ['Quokka Dock', 'Travel Mug']
+        assert [p.name for p in like.search('quokka accessories', limit=1)] == ['Quokka Dock']
+        assert like.search('quokka printer') == []
+
+
+ENTRIES = [(1, 'Dell XPS 15', 'Laptops'), (2, 'Apple MacBook Air M2', 'Laptops'),
+           (3, 'Dell Monitor', 'Monitors'), (4, 'Monitor Dell Stand', 'Accessories'),
+           (5, 'Dell Dell Dock', 'Accessories')]
+
+
+def names(results):
+    return [name for _, name, _ in results]
+
+
+def test_prefix_lookup_matches_any_word_start_ignoring_case_and_spacing():
+    index = PrefixIndex(ENTRIES)
+    assert index.lookup('xps') == [(1, 'Dell XPS 15', 'Laptops')]
+    assert names(index.lookup('MACBOOK  air')) == ['Apple MacBook Air M2']
+    assert names(index.lookup(' Air M')) == ['Apple MacBook Air M2']
+    assert index.lookup('ook') == []
+    assert index.lookup('') == []
+    assert index.lookup('   ') == []
+
+
+def test_prefix_lookup_puts_whole_name_matches_first_and_lists_each_product_once():
+    index = PrefixIndex(ENTRIES)
+    # Ordered by the matched text; "Dell Dell Dock" matches "dell" twice but is returned once
+    assert names(index.lookup('dell')) == ['Dell Dell Dock', 'Dell Monitor', 'Monitor Dell Stand', 'Dell XPS 15']
+    # Same key "monitor": the name that starts with it sorts before "Dell Monitor"
+    assert names(PrefixIndex([(3, 'Dell Monitor', 'Monitors'), (6, 'Monitor', 'Monitors')]).lookup('mon')) == [
+        'Monitor', 'Dell Monitor']
+
+
+def test_prefix_lookup_stops_at_the_limit():
+    index = PrefixIndex(ENTRIES)
+    assert names(index.lookup('dell', limit=2)) == ['Dell Dell Dock', 'Dell Monitor']
+    assert len(index.lookup('d')) == 4
+    assert len(PrefixIndex((i, f'Cable {i:02}', 'Accessories') for i in range(20)).lookup('cable')) == 8
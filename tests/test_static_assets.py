@@ -0,0 +1,31 @@
+from flask import Flask
+
+from static_assets import DIST_DIR, StaticAssets, build_assets
+
+
+def test_replaced_image_keeps_its_hashed_bytes(tmp_path):
+    (tmp_path / 'images').mkdir()
+    (tmp_path / 'images' / 'pc.webp').write_bytes(b'old image')
+    (tmp_path / 'style.css').write_text('body {  color: red;  }')
+    manifest = build_assets(str(tmp_path))
+
+    hashed = manifest['files']['images/pc.webp']
+    assert manifest['assets'][hashed]['path'] == f'{DIST_DIR}/{hashed}'
+    # An upload with the same name overwrites the source file
+    (tmp_path / 'images' / 'pc.webp').write_bytes(b'new image')
+
+    app = Flask(__name__, static_folder=str(tmp_path))
+    StaticAssets(app)
+    response = app.test_client().get(f'/assets/{hashed}')
+    assert response.status_code == 200 and response.data == b'old image'
+    assert 'immutable' in response.headers['Cache-Control']
+    response.close()
+
+    rebuilt = build_assets(str(tmp_path))
+    assert rebuilt['files']['images/pc.webp'] != hashed
+    assert rebuilt['files']['style.css'] == manifest['files']['style.css']
+
+
+def test_admin_uploads_do_not_overwrite_images(app_module):
+    from admin_views import ProductAdminView
+    assert ProductAdminView.form_args['image']['allow_overwrite'] is False
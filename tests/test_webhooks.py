@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import json
+import os
+
+import pytest
+
+
+def paystack_post(client, payload, signature=None):
+    body = json.dumps(payload).encode()
+    if signature is None:
+        signature = hmac.new(os.environ['PAYSTACK_SECRET_KEY'].encode(), body, hashlib.sha512).hexdigest()
+    return client.post('/paystack_webhook', data=body, content_type='application/json',
+                       headers={'x-paystack-signature': signature})
+
+
+def charge(event, reference, event_id=1001):
+    return {'event': event, 'data': {'id': event_id, 'reference': reference}}
+
+
+@pytest.fixture
+def pending_order(app_module, app):
+    m = app_module
+    with app.app_context():
+        m.db.session.add(m.Order(user_id=1, reference='ORDER_WEBHOOK', amount=1000, phone_number='0712345678',
+                                 county='Nairobi', city='Nairobi', shipping_address='Test Street',
+                                 status='pending', payment_provider='paystack'))
+        m.db.session.commit()
+    return 'ORDER_WEBHOOK'
+
+
+def events(m):
+    return m.db.session.query(m.WebhookEvent.event_id, m.WebhookEvent.reference, m.WebhookEvent.status).all()
+
+
+def test_signed_webhook_is_logged_and_applied(app_module, app, client, pending_order):
+    m = app_module
+    assert paystack_post(client, charge('charge.success', pending_order)).status_code == 200
+    with app.app_context():
+        assert events(m) == [('charge.success:1001', pending_order, 'success')]
+        assert m.payment_event_processor.process_batch() == 1
+        assert m.db.session.query(m.Order.status).filter_by(reference=pending_order).scalar() == 'success'
+
+
+@pytest.mark.parametrize('signature', [
+    '0' * 128,
+    'not-a-signature',
+    'é' * 128,  # Non-ASCII header: used to raise TypeError in compare_digest
+    '',
+])
+def test_bad_signature_is_rejected(app_module, app, client, pending_order, signature):
+    response = paystack_post(client, charge('charge.success', pending_order), signature=signature)
+    assert response.status_code == 401
+    with app.app_context():
+        assert events(app_module) == []
+
+
+def test_signature_of_another_body_is_rejected(app_module, app, client, pending_order):
+    signed = json.dumps(charge('charge.failed', pending_order)).encode()
+    signature = hmac.new(os.environ['PAYSTACK_SECRET_KEY'].encode(), signed, hashlib.sha512).hexdigest()
+    assert paystack_post(client, charge('charge.success', pending_order), signature=signature).status_code == 401
+
+
+def test_redelivered_event_is_logged_once(app_module, app, client, pending_order):
+    m = app_module
+    for _ in range(3):
+        assert paystack_post(client, charge('charge.success', pending_order)).status_code == 200
+    with app.app_context():
+        assert len(events(m)) == 1
+        assert m.payment_event_processor.process_batch() == 1
+        assert m.payment_event_processor.process_batch() == 0
+
+
+def stk_callback(client, checkout_request_id, result_code=0):
+    return client.post('/mpesa_callback', json={'Body': {'stkCallback': {
+        'MerchantRequestID': 'mr-1', 'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code,
+        'ResultDesc': 'The service request is processed successfully.'}}})
+
+
+@pytest.fixture
+def daraja_order(app_module, app):
+    """An order whose STK Push was sent, but whose CheckoutRequestID is not saved yet."""
+    m = app_module
+    with app.app_context():
+        m.db.session.add(m.Order(user_id=1, reference='ORDER_DARAJA', amount=1000, phone_number='0712345678',
+                                 county='Nairobi', city='Nairobi', shipping_address='Test Street',
+                                 status='initiating', payment_provider='daraja'))
+        m.db.session.commit()
+    return 'ORDER_DARAJA'
+
+
+def save_checkout_request_id(m, reference, checkout_request_id):
+    m.db.session.query(m.Order).filter_by(reference=reference).update(
+        {'status': 'pending', 'checkout_request_id': checkout_request_id})
+    m.db.session.commit()
+
+
+def order_status(m, reference):
+    return m.db.session.query(m.Order.status).filter_by(reference=reference).scalar()
+
+
+def test_early_stk_callback_waits_for_its_order(app_module, app, client, daraja_order):
+    m = app_module
+    assert stk_callback(client, 'ws_CO_EARLY').status_code == 200
+    with app.app_context():
+        assert events(m) == [('ws_CO_EARLY', None, 'success')]
+        # The payment worker has not saved the CheckoutRequestID yet: nothing to apply, nothing lost
+        assert m.payment_event_processor.process_batch() == 0
+        assert m.db.session.query(m.WebhookEvent.processed_at).scalar() is None
+
+        save_checkout_request_id(m, daraja_order, 'ws_CO_EARLY')
+        assert m.payment_event_processor.process_batch() == 1
+        assert order_status(m, daraja_order) == 'success'
+        assert events(m) == [('ws_CO_EARLY', daraja_order, 'success')]
+
+
+def test_unmatched_callbacks_are_given_up_after_the_timeout(app_module, app, client, daraja_order,
+                                                            monkeypatch):
+    m = app_module
+    stk_callback(client, 'ws_CO_UNKNOWN')
+    monkeypatch.setattr(m.payment_event_processor, 'resolve_timeout', -1)
+    with app.app_context():
+        assert m.payment_event_processor.process_batch() == 1
+        assert m.db.session.query(m.WebhookEvent.processed_at).scalar() is not None
+        assert order_status(m, daraja_order) == 'initiating'
+
+
+def test_unmatched_callbacks_do_not_hold_up_the_queue(app_module, app, client, pending_order, monkeypatch):
+    m = app_module
+    monkeypatch.setattr(m.payment_event_processor, 'batch_size', 2)
+    for i in range(3):
+        stk_callback(client, f'ws_CO_WAITING_{i}')
+    paystack_post(client, charge('charge.success', pending_order))
+    with app.app_context():
+        assert m.payment_event_processor.process_batch() == 1
+        assert order_status(m, pending_order) == 'success'